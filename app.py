@@ -1,16 +1,26 @@
 """
 This file defines some functionality in the app
 """
+import atexit
+import hashlib
+import hmac
+import io
+import json
+import time
 import traceback
 import logging.config
+from contextlib import contextmanager
 
 import yaml
 from flask import Flask
-from flask import render_template, request
+from flask import Response, g, render_template, request, stream_with_context
 
 from config.flaskconfig import CONTRACT_TYPE, GENDERS, BINARY, INCOME_TYPE, EDU_TYPE, FAM_STATUS
-from src.add_application import ApplicationManager
-from src.predict import transform_input, get_prediction
+from src.add_application import ApplicationManager, pool_status
+from src.metrics import CONTENT_TYPE, MetricsRegistry
+from src.predict import InputEncoder, PredictionCache, get_prediction, load_model, \
+    model_registry, read_applicants, score_batch
+from src.profiling import ProfileWriter, StackProfiler
 
 # Initialize the Flask application
 app = Flask(__name__, template_folder="app/templates", static_folder="app/static")
@@ -26,6 +36,9 @@ logger.debug('Web app log')
 
 # Initialize the database session
 application_manager = ApplicationManager(app)
+if application_manager.writer is not None:
+    # insert the rows still buffered by the write-behind queue when the app stops
+    atexit.register(application_manager.writer.close)
 
 # load yaml configuration file
 try:
@@ -35,6 +48,156 @@ try:
 except FileNotFoundError:
     logger.error("Configuration file is not found")
 
+# Compile the user input encoder once from the model's column layout
+encoder = InputEncoder(**conf['predict']['transform_input'])
+
+# Cache predictions of resubmitted applicants, until the model file changes
+prediction_cache = PredictionCache(**conf['predict']['prediction_cache'])
+
+# Warm the model registry so that requests never pay for unpickling the model; with
+# mmap_mode 'r', the model arrays are mapped read-only and shared by all worker processes
+try:
+    load_model(conf['predict']['get_prediction']['model_path'], **conf['predict']['load_model'])
+except (OSError, ValueError):
+    logger.error("Not able to load the model at startup, it will be loaded on first request")
+
+# Profile the requests that ask for it, and a sample of the others
+profile_writer = ProfileWriter(app.config['PROFILE_DIR'], app.config['PROFILE_SAMPLE_EVERY'],
+                               app.config['PROFILE_MAX_FILES'])
+
+
+def model_version():
+    """Identify the version of the model that the app currently scores with
+
+    Returns:
+        list of (dict, int): the model path and a short hash of its fingerprint as labels,
+            or an empty list if the model cannot be loaded
+
+    """
+    model_path = conf['predict']['get_prediction']['model_path']
+    try:
+        fingerprint = model_registry.fingerprint(model_path)
+    except (OSError, ValueError):
+        return []
+    return [({'path': model_path,
+              'version': hashlib.sha1(fingerprint.encode()).hexdigest()[:12]}, 1)]
+
+
+def pool_metric(name):
+    """Read one value of the state of the database connection pool"""
+    # the overflow of a pool is negative until all its connections are open
+    return lambda: max(0, pool_status(application_manager.engine).get(name, 0))
+
+
+def writer_metric(name):
+    """Read one counter of the write-behind queue, if the app writes behind requests"""
+    writer = application_manager.writer
+    return lambda: None if writer is None else writer.stats()[name]
+
+
+# In-process metrics exposed on /metrics; every worker process keeps its own
+metrics = MetricsRegistry()
+request_count = metrics.counter('loan_app_requests_total', 'Requests handled by the app',
+                                ('route', 'method', 'status'))
+request_latency = metrics.histogram('loan_app_request_duration_seconds',
+                                    'Time to handle a request, until its body is sent',
+                                    ('route', 'method'))
+stage_latency = metrics.histogram('loan_app_stage_duration_seconds',
+                                  'Time spent in a stage of a request: encode, model_load, '
+                                  'inference or db_write', ('stage',))
+metrics.callback('loan_app_prediction_cache_hits_total', 'Predictions served from the cache',
+                 lambda: prediction_cache.stats()['hits'], 'counter')
+metrics.callback('loan_app_prediction_cache_misses_total', 'Predictions not found in the cache',
+                 lambda: prediction_cache.stats()['misses'], 'counter')
+metrics.callback('loan_app_prediction_cache_hit_rate', 'Share of cache lookups that were hits',
+                 lambda: prediction_cache.stats()['hit_rate'])
+metrics.callback('loan_app_prediction_cache_size', 'Predictions in the cache',
+                 lambda: prediction_cache.stats()['size'])
+metrics.callback('loan_app_model_info', 'Model the app scores with', model_version)
+metrics.callback('loan_app_db_pool_checked_out', 'Database connections in use',
+                 pool_metric('checkedout'))
+metrics.callback('loan_app_db_pool_overflow', 'Database connections open beyond the pool size',
+                 pool_metric('overflow'))
+metrics.callback('loan_app_db_pool_wait_seconds_total',
+                 'Time spent waiting for a free database connection',
+                 pool_metric('wait_time_total'), 'counter')
+metrics.callback('loan_app_db_rows_written_total', 'Application rows inserted by the '
+                 'write-behind queue', writer_metric('written'), 'counter')
+metrics.callback('loan_app_db_insert_seconds_total', 'Time spent inserting batches of '
+                 'application rows', writer_metric('insert_seconds'), 'counter')
+metrics.callback('loan_app_db_insert_failures_total', 'Batches of application rows that '
+                 'failed to insert and will be retried', writer_metric('failures'), 'counter')
+metrics.callback('loan_app_db_rows_rejected_total', 'Application rows rejected by the database '
+                 'and moved to the dead-letter file', writer_metric('rejected'), 'counter')
+metrics.callback('loan_app_db_write_backlog', 'Application rows waiting to be inserted',
+                 writer_metric('backlog'))
+
+
+@contextmanager
+def timed_stage(name):
+    """Time a stage of the request, reported in the Server-Timing header of the response
+    and in the stage latency histogram of /metrics
+
+    Args:
+        name (str): name of the stage, e.g. 'encode' or 'inference'
+
+    """
+    if 'profiler' not in g:
+        requested = '1' in (request.headers.get('X-Profile'), request.args.get('profile'))
+        # profiling slows the request down, so only admins can ask for it
+        g.profiler = StackProfiler() if profile_writer.should_profile(
+            requested and admin_token_valid()) else None
+    start = time.perf_counter()
+    try:
+        if g.profiler is None:
+            yield
+        else:
+            with g.profiler.profile('%s %s' % (request.method, request.path), name):
+                yield
+    finally:
+        duration = time.perf_counter() - start
+        stage_latency.observe(duration, stage=name)
+        if 'stage_timings' not in g:
+            g.stage_timings = []
+        g.stage_timings.append((name, 1000 * duration))
+
+
+@app.before_request
+def start_request_timer():
+    """Note when the request started, for the request latency histogram"""
+    g.request_start = time.perf_counter()
+
+
+@app.after_request
+def add_server_timing(response):
+    """Report the durations of the timed stages of the request in milliseconds"""
+    g.response_status = response.status_code
+    if app.config.get('SERVER_TIMING') and 'stage_timings' in g:
+        response.headers['Server-Timing'] = ', '.join(
+            '%s;dur=%.3f' % (name, duration) for name, duration in g.stage_timings)
+    return response
+
+
+@app.teardown_request
+def count_request(exc):
+    """Count the request and record its latency, after the last chunk of a streamed response,
+    and write the profile of the request if it was profiled"""
+    # a streamed response is also torn down once when its view returns
+    if 'request_start' not in g or (g.get('streaming') and not g.get('stream_done')):
+        return
+    if g.get('profiler') is not None:
+        try:
+            profile_writer.write(g.pop('profiler'), '%s %s' % (request.method, request.path))
+        except OSError:
+            logger.exception("Not able to write the profile of the request")
+    start = g.pop('request_start')
+    # the route pattern rather than the path, so that unknown paths share a single label
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    request_latency.observe(time.perf_counter() - start, route=route,
+                            method=request.method)
+    request_count.inc(route=route, method=request.method,
+                      status=g.get('response_status', 500))
+
 
 @app.route('/')
 def index():
@@ -74,34 +237,6 @@ def add_entry():
         return "Visit the homepage to add applicants and get predictions"
     elif request.method == 'POST':
         try:
-            # Add new applicant information to RDS for future usages
-            application_manager.add_application(
-                contract_type=request.form['contract_type'],
-                gender=request.form['gender'],
-                own_car=request.form['own_car'],
-                own_realty=request.form['own_realty'],
-                num_children=request.form['num_children'],
-                income_total=request.form['income_total'],
-                amt_credit=request.form['amt_credit'],
-                amt_annuity=request.form['amt_annuity'],
-                amt_goods_price=request.form['amt_goods_price'],
-                income_type=request.form['income_type'],
-                edu_type=request.form['edu_type'],
-                family_status=request.form['family_status'],
-                age=request.form['age'],
-                years_employed=request.form['years_employed'],
-                years_id_publish=request.form['years_id_publish'],
-                phone_contactable=request.form['phone_contactable'],
-                cnt_family_members=request.form['cnt_family_members'],
-                amt_req_credit_bureau_day=request.form['amt_req_credit_bureau_day'],
-                employed=request.form['employed']
-            )
-
-            logger.info(
-                "New applicant of contract type %s added",
-                request.form['contract_type']
-            )
-
             # Get loan delinquency prediction for the new applicant
             user_input = {'contract_type': request.form['contract_type'],
                           'gender': request.form['gender'],
@@ -122,12 +257,54 @@ def add_entry():
                           'cnt_family_members': request.form['cnt_family_members'],
                           'amt_req_credit_bureau_day': request.form['amt_req_credit_bureau_day'],
                           'Employed': request.form['employed']}
-            user_input_transformed = transform_input(user_input,
-                                                     **conf['predict']['transform_input'])
-            user_prob = get_prediction(user_input_transformed,
-                                       **conf['predict']['get_prediction'])[0]
-            user_bin = get_prediction(user_input_transformed,
-                                      **conf['predict']['get_prediction'])[1]
+            prediction = None
+            encoded = False
+            try:
+                with timed_stage('encode'):
+                    user_input_transformed = encoder.encode(user_input)
+                encoded = True
+                with timed_stage('model_load'):
+                    load_model(conf['predict']['get_prediction']['model_path'])
+                with timed_stage('inference'):
+                    prediction = get_prediction(user_input_transformed, cache=prediction_cache,
+                                                **conf['predict']['get_prediction'])
+            finally:
+                # Add new applicant information and its prediction to RDS for future usages,
+                # also when the applicant could not be scored, but only once its values
+                # were encoded, so that malformed input is not stored
+                if encoded:
+                    with timed_stage('db_write'):
+                        application_manager.add_application(
+                            contract_type=request.form['contract_type'],
+                            gender=request.form['gender'],
+                            own_car=request.form['own_car'],
+                            own_realty=request.form['own_realty'],
+                            num_children=request.form['num_children'],
+                            income_total=request.form['income_total'],
+                            amt_credit=request.form['amt_credit'],
+                            amt_annuity=request.form['amt_annuity'],
+                            amt_goods_price=request.form['amt_goods_price'],
+                            income_type=request.form['income_type'],
+                            edu_type=request.form['edu_type'],
+                            family_status=request.form['family_status'],
+                            age=request.form['age'],
+                            years_employed=request.form['years_employed'],
+                            years_id_publish=request.form['years_id_publish'],
+                            phone_contactable=request.form['phone_contactable'],
+                            cnt_family_members=request.form['cnt_family_members'],
+                            amt_req_credit_bureau_day=request.form['amt_req_credit_bureau_day'],
+                            employed=request.form['employed'],
+                            pred_prob=None if prediction is None else float(prediction.pred_prob),
+                            pred_class=None if prediction is None else prediction.pred_class
+                        )
+
+                    logger.info(
+                        "New applicant of contract type %s added",
+                        request.form['contract_type']
+                    )
+
+            user_prob = prediction.pred_prob
+            user_bin = prediction.pred_bin
 
             logger.info(
                 "The new applicant's probability of loan delinquency is: %f percent, "
@@ -141,6 +318,129 @@ def add_entry():
             return render_template('error.html')
 
 
+@app.route('/predict/batch', methods=['POST'])
+def predict_batch():
+    """View that scores many applicants in a single request
+
+    The request body is either a JSON list of applicant records (or an object with
+    an 'applicants' list), JSON lines (application/x-ndjson) or CSV (text/csv). The
+    record keys are the same as the user input of the form (e.g. 'Age', 'Employed').
+
+    Returns:
+        JSON lines streamed back with one prediction per applicant in input order,
+        or a JSON error with status 400/415 if the body cannot be parsed, or 503/500
+        if the model is missing or cannot be loaded
+
+    """
+    try:
+        if request.mimetype == 'application/json':
+            # parsed here rather than by Flask, so that malformed JSON gets the JSON error
+            records = json.loads(request.get_data(as_text=True))
+            if isinstance(records, dict):
+                records = records.get('applicants', [])
+            # checked before streaming, so that a bad record gets a 400 instead of a cut stream
+            if not isinstance(records, list) or \
+                    not all(isinstance(record, dict) for record in records):
+                raise ValueError('The batch must be a list of applicant records')
+        elif request.mimetype in ('application/x-ndjson', 'application/jsonl'):
+            records = read_applicants(io.StringIO(request.get_data(as_text=True)), 'jsonl')
+        elif request.mimetype == 'text/csv':
+            records = read_applicants(io.StringIO(request.get_data(as_text=True)), 'csv')
+        else:
+            return Response(json.dumps({'error': 'Unsupported content type %s' % request.mimetype}),
+                            status=415, mimetype='application/json')
+    except ValueError:
+        logger.warning("Not able to parse the batch of applicants")
+        return Response(json.dumps({'error': 'Not able to parse the batch of applicants'}),
+                        status=400, mimetype='application/json')
+
+    # the model is loaded before the response starts, so that a model that cannot be
+    # loaded gets an error status rather than a cut stream
+    try:
+        results = score_batch(records, encoder,
+                              model_path=conf['predict']['get_prediction']['model_path'],
+                              threshold=conf['predict']['get_prediction']['threshold'],
+                              **conf['predict']['score_batch'])
+    except OSError:
+        logger.error("The model is not available for batch scoring")
+        return Response(json.dumps({'error': 'The model is not available'}),
+                        status=503, mimetype='application/json')
+    except Exception:
+        logger.exception("Not able to load the model for batch scoring")
+        return Response(json.dumps({'error': 'Not able to load the model'}),
+                        status=500, mimetype='application/json')
+
+    def generate():
+        try:
+            for result in results:
+                yield json.dumps(result) + '\n'
+        except (ValueError, KeyError, TypeError):
+            logger.warning("Batch scoring stopped because of an invalid applicant record")
+            yield json.dumps({'error': 'Invalid applicant record'}) + '\n'
+        finally:
+            g.stream_done = True
+
+    logger.debug("Batch prediction requested")
+    g.streaming = True
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
+def admin_token_valid():
+    """Check whether the request carries ADMIN_TOKEN of flask_config.py in its X-Admin-Token
+    header; always False when ADMIN_TOKEN is not set"""
+    token = app.config.get('ADMIN_TOKEN')
+    return bool(token) and hmac.compare_digest(request.headers.get('X-Admin-Token', ''), token)
+
+
+def admin_authorized():
+    """Check the admin token of the request against ADMIN_TOKEN in flask_config.py
+
+    Returns:
+        None if the request is authorized, otherwise the JSON error response to return
+
+    """
+    if not app.config.get('ADMIN_TOKEN'):
+        return Response(json.dumps({'error': 'Not found'}), status=404,
+                        mimetype='application/json')
+    if not admin_token_valid():
+        logger.warning("Admin endpoint accessed without a valid token")
+        return Response(json.dumps({'error': 'Forbidden'}), status=403,
+                        mimetype='application/json')
+    return None
+
+
+@app.route('/admin/pool', methods=['GET'])
+def admin_pool():
+    """View of the state of the database connection pool
+
+    Returns:
+        JSON with the connections checked out, in overflow, the checkout wait times and
+        the connection events of the pool (see `pool_status` in src/add_application.py)
+
+    """
+    error = admin_authorized()
+    if error is not None:
+        return error
+    return Response(json.dumps(pool_status(application_manager.engine)),
+                    mimetype='application/json')
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_view():
+    """View of the metrics of this app process in the Prometheus text format
+
+    Returns:
+        text with the request counters and latency histograms per route, the latency of the
+        stages of /result, the prediction cache, database and model metrics, or a JSON error
+        with status 404 if METRICS is disabled in flask_config.py
+
+    """
+    if not app.config.get('METRICS'):
+        return Response(json.dumps({'error': 'Not found'}), status=404,
+                        mimetype='application/json')
+    return Response(metrics.render(), content_type=CONTENT_TYPE)
+
+
 @app.route('/about', methods=['GET'])
 def about():
     """View of an 'About' page that has detailed information about the project
@@ -0,0 +1,96 @@
+"""
+This file benchmarks the cleaning stage in src/acquire.py against the
+row-by-row Series.apply implementation it replaced.
+
+Run from the root of the repository:
+    python -m benchmarks.bench_acquire --rows 300000
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from src.acquire import clean_column, neg_to_pos, replace_cat
+
+CLEAN_REPLACE_DICT = {'Secondary / secondary special': 'Secondary education',
+                      'Lower secondary': 'Secondary education',
+                      'Academic degree': 'Higher education'}
+NEG_COLS = ['days_birth', 'days_employed', 'days_id_change']
+CAT_DICT = {'own_car': {"Y": "Yes", "N": "No"},
+            'own_realty': {"Y": "Yes", "N": "No"},
+            'phone_contactable': {"1": "Yes", "0": "No"},
+            'gender': {"M": "Male", "F": "Female", "XNA": "Not Provided"}}
+
+
+def legacy_clean_column(df, col, replace_dict):
+    for key, value in replace_dict.items():
+        df[col] = df[col].apply(lambda x: x.replace(key, value))
+    return df
+
+
+def legacy_neg_to_pos(df, cols):
+    for col in cols:
+        df[col] = df[col].apply(lambda x: x*-1)
+    return df
+
+
+def legacy_replace_cat(df, cat_dict):
+    for col, values in cat_dict.items():
+        for old, new in values.items():
+            df[col] = df[col].apply(lambda x: x.replace(old, new))
+    return df
+
+
+def make_data(rows, seed=0):
+    """Generate a DataFrame shaped like the raw columns touched by the cleaning stage"""
+    rng = np.random.RandomState(seed)
+    return pd.DataFrame({
+        'edu_type': rng.choice(['Secondary / secondary special', 'Higher education',
+                                'Incomplete higher', 'Lower secondary', 'Academic degree'],
+                               rows, p=[0.71, 0.24, 0.033, 0.016, 0.001]),
+        'own_car': rng.choice(['Y', 'N'], rows),
+        'own_realty': rng.choice(['Y', 'N'], rows),
+        'phone_contactable': rng.choice(['1', '0'], rows),
+        'gender': rng.choice(['M', 'F', 'XNA'], rows, p=[0.34, 0.65, 0.01]),
+        'days_birth': -rng.randint(7489, 25229, rows),
+        'days_employed': -rng.randint(0, 17912, rows),
+        'days_id_change': -rng.randint(0, 7197, rows)})
+
+
+def best_of(func, df, repeat):
+    """Return the best wall time in seconds of func over a fresh copy of df"""
+    times = []
+    for _ in range(repeat):
+        data = df.copy()
+        start = time.perf_counter()
+        func(data)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the cleaning stage")
+    parser.add_argument('--rows', type=int, default=300000, help='Number of rows to generate')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of timed repetitions')
+    args = parser.parse_args()
+
+    df = make_data(args.rows)
+    cases = [
+        ('clean_column',
+         lambda d: legacy_clean_column(d, 'edu_type', CLEAN_REPLACE_DICT),
+         lambda d: clean_column(d, 'edu_type', CLEAN_REPLACE_DICT)),
+        ('neg_to_pos',
+         lambda d: legacy_neg_to_pos(d, NEG_COLS),
+         lambda d: neg_to_pos(d, NEG_COLS)),
+        ('replace_cat',
+         lambda d: legacy_replace_cat(d, CAT_DICT),
+         lambda d: replace_cat(d, CAT_DICT)),
+    ]
+
+    print('%i rows, best of %i' % (args.rows, args.repeat))
+    print('%-14s %12s %12s %9s' % ('function', 'apply (s)', 'vector (s)', 'speedup'))
+    for name, legacy, current in cases:
+        t_legacy = best_of(legacy, df, args.repeat)
+        t_current = best_of(current, df, args.repeat)
+        print('%-14s %12.4f %12.4f %8.1fx' % (name, t_legacy, t_current, t_legacy / t_current))
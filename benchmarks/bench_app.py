@@ -0,0 +1,229 @@
+"""
+This file load-tests the Flask app: it sends applicants to the /result route (or the
+/predict/batch route) with a number of concurrent clients, and reports the latency
+percentiles, the throughput and the per-stage timings that the app returns in its
+Server-Timing header (encode, model_load, inference, db_write).
+
+The app runs on a fresh SQLite database and write-behind spool in a temporary directory,
+which is removed at the end of the run. Without --model,
+a forest is trained on random data with the columns of config.yaml and exported
+to the temporary directory, so no trained model or data is needed.
+
+Run from the root of the repository:
+    python -m benchmarks.bench_app --requests 2000 --concurrency 8 --client http
+    python -m benchmarks.bench_app --route batch --batch_size 500 --output app.json
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+import numpy as np
+
+# the app reads its database and spool directory from the environment when it is imported
+TMP_DIR = tempfile.mkdtemp(prefix='bench_app_')
+os.environ['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///%s' % os.path.join(TMP_DIR, 'application.db')
+os.environ['WRITE_BEHIND_SPOOL_DIR'] = os.path.join(TMP_DIR, 'spool')
+
+from config.flaskconfig import CONTRACT_TYPE, GENDERS, BINARY, INCOME_TYPE, EDU_TYPE, \
+    FAM_STATUS  # noqa: E402
+from src.add_application import create_db  # noqa: E402
+
+# names of the form fields that differ from the names of the user input
+FORM_FIELDS = {'Age': 'age', 'Years_Employed': 'years_employed',
+               'Years_ID_Publish': 'years_id_publish', 'Employed': 'employed'}
+
+
+def make_applicants(n, seed=0):
+    """Generate applicants with the keys of the user input of the app"""
+    rng = np.random.RandomState(seed)
+    applicants = []
+    for i in range(n):
+        applicants.append({
+            'id': i,
+            'contract_type': rng.choice(CONTRACT_TYPE), 'gender': rng.choice(GENDERS),
+            'own_car': rng.choice(BINARY), 'own_realty': rng.choice(BINARY),
+            'num_children': int(rng.randint(0, 4)),
+            'income_total': float(rng.randint(30000, 400000)),
+            'amt_credit': float(rng.randint(50000, 2000000)),
+            'amt_annuity': float(rng.randint(2000, 100000)),
+            'amt_goods_price': float(rng.randint(40000, 2000000)),
+            'income_type': rng.choice(INCOME_TYPE), 'edu_type': rng.choice(EDU_TYPE),
+            'family_status': rng.choice(FAM_STATUS), 'Age': int(rng.randint(21, 70)),
+            'Years_Employed': int(rng.randint(0, 40)), 'Years_ID_Publish': int(rng.randint(0, 20)),
+            'phone_contactable': rng.choice(BINARY), 'cnt_family_members': int(rng.randint(1, 6)),
+            'amt_req_credit_bureau_day': int(rng.randint(0, 3)), 'Employed': rng.choice(BINARY)})
+    return applicants
+
+
+def to_form(applicant):
+    """Convert an applicant to the fields of the form posted to /result"""
+    return {FORM_FIELDS.get(key, key): str(value)
+            for key, value in applicant.items() if key != 'id'}
+
+
+def train_model(ohe_cols, save_dir, n_estimators, max_depth):
+    """Train a forest on random data with the model's columns and export it"""
+    import sklearn.ensemble
+    from src.model import export_forest
+    rng = np.random.RandomState(0)
+    X = rng.rand(5000, len(ohe_cols)) * 100
+    y = (X[:, 0] + 50 * rng.rand(5000) > 80).astype(int)
+    rf = sklearn.ensemble.RandomForestClassifier(n_estimators=n_estimators, max_depth=max_depth,
+                                                 random_state=0).fit(X, y)
+    export_forest(rf, save_dir)
+
+
+def parse_server_timing(header):
+    """Parse a Server-Timing header into a dict of stage durations in milliseconds"""
+    stages = {}
+    for item in filter(None, (part.strip() for part in (header or '').split(','))):
+        name, _, duration = item.partition(';dur=')
+        if duration:
+            stages[name] = float(duration)
+    return stages
+
+
+def summarize(latencies, stages, elapsed, n_applicants):
+    """Compute latency percentiles, throughput and per-stage timings"""
+    latencies = np.array(latencies) * 1000
+    summary = {'requests': len(latencies), 'seconds': elapsed,
+               'requests_per_sec': len(latencies) / elapsed,
+               'applicants_per_sec': n_applicants / elapsed,
+               'latency_ms': {'mean': latencies.mean(),
+                              'p50': np.percentile(latencies, 50),
+                              'p95': np.percentile(latencies, 95),
+                              'p99': np.percentile(latencies, 99),
+                              'max': latencies.max()},
+               'stages_ms': {}}
+    for name, durations in sorted(stages.items()):
+        durations = np.array(durations)
+        summary['stages_ms'][name] = {'mean': durations.mean(),
+                                      'p50': np.percentile(durations, 50),
+                                      'p95': np.percentile(durations, 95),
+                                      'p99': np.percentile(durations, 99)}
+    return summary
+
+
+def git_commit():
+    """Return the current commit of the repository, if any"""
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Load-test the routes of the Flask app")
+    parser.add_argument('--route', default='result', choices=['result', 'batch'],
+                        help='Route to send applicants to')
+    parser.add_argument('--client', default='test', choices=['test', 'http'],
+                        help="'test' for the Flask test client in this process, "
+                             "'http' for a local threaded HTTP server")
+    parser.add_argument('--requests', type=int, default=1000, help='Number of requests')
+    parser.add_argument('--concurrency', type=int, default=4,
+                        help='Number of clients sending requests at the same time')
+    parser.add_argument('--batch_size', type=int, default=100,
+                        help='Number of applicants per request to /predict/batch')
+    parser.add_argument('--unique', type=int, default=None,
+                        help='Number of distinct applicants, to exercise the prediction cache '
+                             '(optional, default = every applicant is different)')
+    parser.add_argument('--model', default=None,
+                        help='Path to a trained model or export (optional, default = train a '
+                             'forest on random data)')
+    parser.add_argument('--n_estimat', type=int, default=100,
+                        help='Number of trees of the random forest trained without --model')
+    parser.add_argument('--max_dep', type=int, default=10,
+                        help='Maximum depth of the random forest trained without --model')
+    parser.add_argument('--output', '-o', default=None,
+                        help='Path to save the results as JSON (optional, default = None)')
+    args = parser.parse_args()
+
+    create_db(os.environ['SQLALCHEMY_DATABASE_URI'])
+    import app as flask_app
+    conf = flask_app.conf
+    if args.model is None:
+        args.model = os.path.join(TMP_DIR, 'randomforest.forest')
+        train_model(conf['predict']['get_prediction']['ohe_cols'], args.model,
+                    args.n_estimat, args.max_dep)
+    conf['predict']['get_prediction']['model_path'] = args.model
+
+    n_applicants = args.requests * (args.batch_size if args.route == 'batch' else 1)
+    applicants = make_applicants(args.unique or n_applicants)
+    if args.route == 'result':
+        payloads = [urlencode(to_form(applicants[i % len(applicants)])).encode()
+                    for i in range(args.requests)]
+        path, content_type = '/result', 'application/x-www-form-urlencoded'
+    else:
+        payloads = [json.dumps([applicants[(i * args.batch_size + j) % len(applicants)]
+                                for j in range(args.batch_size)]).encode()
+                    for i in range(args.requests)]
+        path, content_type = '/predict/batch', 'application/json'
+
+    server = None
+    if args.client == 'http':
+        from werkzeug.serving import make_server
+        server = make_server('127.0.0.1', 0, flask_app.app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = 'http://127.0.0.1:%i%s' % (server.server_port, path)
+
+        def send(payload):
+            req = urllib.request.Request(url, data=payload,
+                                         headers={'Content-Type': content_type})
+            start = time.perf_counter()
+            with urllib.request.urlopen(req) as response:
+                response.read()
+                return time.perf_counter() - start, response.headers.get('Server-Timing')
+    else:
+        local = threading.local()
+
+        def send(payload):
+            if not hasattr(local, 'client'):
+                local.client = flask_app.app.test_client()
+            start = time.perf_counter()
+            response = local.client.post(path, data=payload, content_type=content_type)
+            response.get_data()
+            return time.perf_counter() - start, response.headers.get('Server-Timing')
+
+    # one warm-up request loads the model and compiles the encoder paths
+    send(payloads[0])
+    latencies, stages = [], {}
+    start = time.perf_counter()
+    with ThreadPoolExecutor(args.concurrency) as pool:
+        for latency, header in pool.map(send, payloads):
+            latencies.append(latency)
+            for name, duration in parse_server_timing(header).items():
+                stages.setdefault(name, []).append(duration)
+    elapsed = time.perf_counter() - start
+    if server is not None:
+        server.shutdown()
+    if flask_app.application_manager.writer is not None:
+        flask_app.application_manager.writer.close()
+
+    results = summarize(latencies, stages, elapsed, n_applicants)
+    results.update(commit=git_commit(), route=args.route, client=args.client,
+                   concurrency=args.concurrency, batch_size=args.batch_size,
+                   unique=args.unique, model=args.model,
+                   prediction_cache=flask_app.prediction_cache.stats())
+
+    print('%s %s, %i requests, concurrency %i: %.1f requests/s, %.1f applicants/s'
+          % (args.client, path, args.requests, args.concurrency,
+             results['requests_per_sec'], results['applicants_per_sec']))
+    print('%-12s %9s %9s %9s %9s' % ('ms', 'mean', 'p50', 'p95', 'p99'))
+    for name, stats in [('latency', results['latency_ms'])] + \
+            sorted(results['stages_ms'].items()):
+        print('%-12s %9.3f %9.3f %9.3f %9.3f' % (name, stats['mean'], stats['p50'],
+                                                 stats['p95'], stats['p99']))
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print('Results saved to %s' % args.output)
+    shutil.rmtree(TMP_DIR, ignore_errors=True)
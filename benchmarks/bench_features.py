@@ -0,0 +1,59 @@
+"""
+This file benchmarks feature generation in src/features.py against the
+element-wise implementation it replaced.
+
+Run from the root of the repository:
+    python -m benchmarks.bench_features --rows 300000
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from src.features import featurize
+
+DTY_COLS_DICT = {'Age': 'days_birth',
+                 'Years_Employed': 'days_employed',
+                 'Years_ID_Publish': 'days_id_change'}
+
+
+def legacy_featurize(df, dty_cols_dict, old_col, new_col):
+    for key, value in dty_cols_dict.items():
+        df[key] = df[value].apply(lambda x: np.round(x/365))
+    df[new_col] = ['Yes' if i >= 0 else 'No' for i in df[old_col]]
+    return df
+
+
+def make_data(rows, seed=0):
+    """Generate a DataFrame shaped like the cleaned 'days' columns"""
+    rng = np.random.RandomState(seed)
+    return pd.DataFrame({'days_birth': rng.randint(7489, 25229, rows),
+                         'days_employed': np.where(rng.rand(rows) < 0.18, -365243,
+                                                   rng.randint(0, 17912, rows)),
+                         'days_id_change': rng.randint(0, 7197, rows)})
+
+
+def best_of(func, df, repeat):
+    """Return the best wall time in seconds of func over a fresh copy of df"""
+    times = []
+    for _ in range(repeat):
+        data = df.copy()
+        start = time.perf_counter()
+        func(data, DTY_COLS_DICT, 'days_employed', 'Employed')
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark feature generation")
+    parser.add_argument('--rows', type=int, default=300000, help='Number of rows to generate')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of timed repetitions')
+    args = parser.parse_args()
+
+    df = make_data(args.rows)
+    t_legacy = best_of(legacy_featurize, df, args.repeat)
+    t_current = best_of(featurize, df, args.repeat)
+    print('%i rows, best of %i' % (args.rows, args.repeat))
+    print('element-wise: %.4f s, column-level: %.4f s, speedup: %.1fx'
+          % (t_legacy, t_current, t_legacy / t_current))
@@ -0,0 +1,67 @@
+"""
+This file benchmarks random forest training and scoring across numbers of cores,
+using the n_jobs settings plumbed through src/model.py and src/predict.py.
+
+Run from the root of the repository:
+    python -m benchmarks.bench_parallel --rows 200000 --n_estimat 100
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import sklearn.ensemble
+
+
+def make_data(rows, n_features=30, seed=0):
+    """Generate a featurized-shaped data set with an imbalanced binary target"""
+    rng = np.random.RandomState(seed)
+    X = pd.DataFrame(rng.rand(rows, n_features),
+                     columns=['feature_%i' % i for i in range(n_features)])
+    y = ((X['feature_0'] + 0.5 * X['feature_1'] + 0.3 * rng.rand(rows)) > 1.2).astype(int)
+    return X, y.values
+
+
+def core_counts(max_cores):
+    """Return 1, 2, 4, ... up to and including max_cores"""
+    counts = [1]
+    while counts[-1] * 2 < max_cores:
+        counts.append(counts[-1] * 2)
+    if max_cores > 1:
+        counts.append(max_cores)
+    return counts
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark forest training and scoring by cores")
+    parser.add_argument('--rows', type=int, default=200000, help='Number of rows to generate')
+    parser.add_argument('--n_estimat', type=int, default=100, help='Number of trees')
+    parser.add_argument('--max_dep', type=int, default=10, help='Maximum depth of the trees')
+    parser.add_argument('--max_cores', type=int, default=os.cpu_count(),
+                        help='Largest number of cores to try')
+    args = parser.parse_args()
+
+    X, y = make_data(args.rows)
+    reference = None
+    print('%i rows, %i trees, max depth %i' % (args.rows, args.n_estimat, args.max_dep))
+    print('%6s %10s %8s %10s %8s %10s' % ('n_jobs', 'train (s)', 'speedup', 'score (s)',
+                                         'speedup', 'same'))
+    base = None
+    for n_jobs in core_counts(args.max_cores):
+        rf = sklearn.ensemble.RandomForestClassifier(n_estimators=args.n_estimat,
+                                                     max_depth=args.max_dep,
+                                                     random_state=0, n_jobs=n_jobs)
+        start = time.perf_counter()
+        rf.fit(X, y)
+        t_train = time.perf_counter() - start
+
+        start = time.perf_counter()
+        proba = rf.predict_proba(X)[:, 1]
+        t_score = time.perf_counter() - start
+
+        if reference is None:
+            reference, base = proba, (t_train, t_score)
+        same = np.allclose(proba, reference)
+        print('%6i %10.3f %7.1fx %10.3f %7.1fx %10s' % (n_jobs, t_train, base[0] / t_train,
+                                                     t_score, base[1] / t_score, same))
@@ -0,0 +1,141 @@
+"""
+This file benchmarks every stage of the model pipeline (import_data, clean, featurize,
+get_ohe_data, train_model and evaluate) on synthetic application data of increasing
+size, to show how the time and memory of each stage scale with the number of rows.
+
+Each stage runs with the arguments of config.yaml. For every stage and scale, the
+wall time, the rows in and out, the throughput and the peak memory allocated during the
+stage (traced with tracemalloc, which also sees numpy and pandas buffers) are reported.
+Tracing slows the stages down; use --no_trace for timings only.
+
+Run from the root of the repository:
+    python -m benchmarks.bench_pipeline --rows 10000 100000 1000000 --output pipeline.json
+    python -m benchmarks.bench_pipeline --rows 10000000 --data_dir data/synthetic --no_trace
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+import yaml
+
+from benchmarks.synthetic_data import write_raw
+from src.acquire import import_data, clean
+from src.features import featurize, get_ohe_data
+from src.model import train_model, evaluate
+
+
+def git_commit():
+    """Return the current commit of the repository, if any"""
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_stage(func, trace):
+    """Run one stage, returning its output, its wall time and its peak traced memory in MB"""
+    if trace:
+        tracemalloc.start()
+    start = time.perf_counter()
+    output = func()
+    seconds = time.perf_counter() - start
+    peak = None
+    if trace:
+        peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        tracemalloc.stop()
+    return output, seconds, peak
+
+
+def bench_scale(conf, path, trace):
+    """Run every stage of the pipeline on the raw file at `path`"""
+    results = []
+
+    def record(stage, seconds, peak, rows_in, rows_out):
+        results.append({'stage': stage, 'seconds': seconds, 'rows_in': rows_in,
+                        'rows_out': rows_out, 'rows_per_sec': rows_in / seconds,
+                        'peak_mb': peak})
+
+    import_conf = dict(conf['acquire']['import_data'], path=path)
+    raw, seconds, peak = run_stage(lambda: import_data(**import_conf), trace)
+    record('import_data', seconds, peak, len(raw), len(raw))
+
+    cleaned, seconds, peak = run_stage(lambda: clean(raw, **conf['acquire']['clean']), trace)
+    record('clean', seconds, peak, len(raw), len(cleaned))
+    del raw
+
+    featurized, seconds, peak = run_stage(
+        lambda: featurize(cleaned, **conf['features']['featurize']), trace)
+    record('featurize', seconds, peak, len(cleaned), len(featurized))
+    del cleaned
+
+    ohe, seconds, peak = run_stage(
+        lambda: get_ohe_data(featurized, **conf['features']['get_ohe_data']), trace)
+    record('get_ohe_data', seconds, peak, len(featurized), len(ohe))
+    del featurized
+
+    # the rows out of train_model are the rows of the held out test set
+    (rf, X_test, y_test), seconds, peak = run_stage(
+        lambda: train_model(ohe, **conf['model']['train_model']), trace)
+    record('train_model', seconds, peak, len(ohe), len(X_test))
+    del ohe
+
+    _, seconds, peak = run_stage(
+        lambda: evaluate(rf, X_test, y_test, **conf['model']['evaluate']), trace)
+    record('evaluate', seconds, peak, len(X_test), len(X_test))
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the model pipeline at several scales")
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000, 1000000],
+                        help='Numbers of raw applications to benchmark the pipeline on')
+    parser.add_argument('--config', default='config/config.yaml',
+                        help='Path to configuration file')
+    parser.add_argument('--data_dir', default=None,
+                        help='Directory to keep the generated raw files in and reuse them '
+                             'across runs (optional, default = a temporary directory)')
+    parser.add_argument('--no_trace', action='store_true',
+                        help='Do not trace memory allocations, for timings without overhead')
+    parser.add_argument('--output', '-o', default=None,
+                        help='Path to save the results as JSON (optional, default = None)')
+    args = parser.parse_args()
+
+    with open(args.config, 'r') as f:
+        conf = yaml.load(f, Loader=yaml.FullLoader)
+    tmp_dir = tempfile.mkdtemp(prefix='bench_pipeline_')
+    data_dir = args.data_dir or tmp_dir
+    os.makedirs(data_dir, exist_ok=True)
+    conf['model']['evaluate']['save_path'] = os.path.join(tmp_dir, 'evaluation_result.csv')
+
+    results = []
+    for rows in args.rows:
+        path = os.path.join(data_dir, 'application_data_%i.csv' % rows)
+        if not os.path.exists(path):
+            write_raw(rows, path)
+        for result in bench_scale(conf, path, not args.no_trace):
+            result['rows'] = rows
+            results.append(result)
+        print('%i rows' % rows)
+        print('%-14s %10s %10s %10s %13s %10s' % ('stage', 'seconds', 'rows in', 'rows out',
+                                                  'rows/sec', 'peak MB'))
+        for result in results[-6:]:
+            print('%-14s %10.3f %10i %10i %13.0f %10s' % (
+                result['stage'], result['seconds'], result['rows_in'], result['rows_out'],
+                result['rows_per_sec'],
+                '-' if result['peak_mb'] is None else '%.1f' % result['peak_mb']))
+
+    # resident set size high-water mark of the whole run, in megabytes on Linux
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print('Maximum resident set size: %.0f MB' % max_rss)
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump({'commit': git_commit(), 'trace': not args.no_trace, 'max_rss_mb': max_rss,
+                       'train_model': conf['model']['train_model'], 'results': results},
+                      f, indent=2)
+        print('Results saved to %s' % args.output)
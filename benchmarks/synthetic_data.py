@@ -0,0 +1,144 @@
+"""
+This file generates synthetic loan application data shaped like the Home Credit
+application_data.csv file, so that the pipeline can be run and benchmarked without
+the real data from S3.
+
+The columns listed in colnames_dict (config.yaml) get plausible distributions:
+category frequencies close to the real file, log-normal amounts, the 365243 sentinel
+of DAYS_EMPLOYED for pensioners and unemployed applicants, missing values in the same
+columns as the real file, and a TARGET that depends on age, employment and the credit
+to income ratio. Filler columns without missing values can be added to make the file
+as wide as the real one (122 columns) and measure the cost of parsing unused columns.
+
+Run from the root of the repository:
+    python -m benchmarks.synthetic_data --rows 100000 --output data/sample/application_data.csv
+"""
+import argparse
+
+import numpy as np
+import pandas as pd
+
+INCOME_TYPES = {'Working': 0.516, 'Commercial associate': 0.233, 'Pensioner': 0.18,
+                'State servant': 0.0706, 'Unemployed': 0.0002, 'Student': 0.0001,
+                'Businessman': 0.0001, 'Maternity leave': 0.0001}
+EDU_TYPES = {'Secondary / secondary special': 0.71, 'Higher education': 0.2434,
+             'Incomplete higher': 0.0334, 'Lower secondary': 0.0124, 'Academic degree': 0.0008}
+FAMILY_STATUSES = {'Married': 0.6388, 'Single / not married': 0.1478, 'Civil marriage': 0.0968,
+                   'Separated': 0.0643, 'Widow': 0.0523}
+# the real file has 102 more columns than the 20 used by the pipeline
+N_FILLER_COLS = 0
+
+
+def _choice(rng, frequencies, rows):
+    """Draw categories with the given frequencies"""
+    p = np.array(list(frequencies.values()))
+    return rng.choice(list(frequencies), rows, p=p / p.sum())
+
+
+def _with_missing(rng, values, rate):
+    """Replace a fraction of the values by NaN"""
+    values = values.astype(float)
+    values[rng.rand(len(values)) < rate] = np.nan
+    return values
+
+
+def make_raw(rows, seed=0, first_id=100002, n_filler_cols=N_FILLER_COLS):
+    """Generate raw loan applications with the columns of application_data.csv
+
+    Args:
+        rows (int): number of applications
+        seed (int): seed of the random generator
+        first_id (int): SK_ID_CURR of the first application
+        n_filler_cols (int): number of extra columns that the pipeline does not use
+
+    Returns:
+        data (:obj:`DataFrame <pandas.DataFrame>`): the raw applications
+
+    """
+    rng = np.random.RandomState(seed)
+    income_type = _choice(rng, INCOME_TYPES, rows)
+    days_birth = -rng.randint(7489, 25229, rows)
+    # pensioners and unemployed applicants have the 365243 sentinel instead of a duration
+    not_employed = np.isin(income_type, ['Pensioner', 'Unemployed'])
+    days_employed = np.where(not_employed, 365243,
+                             -np.minimum(rng.exponential(2400, rows).astype(int),
+                                         -days_birth - 6570))
+    income = np.round(rng.lognormal(11.9, 0.5, rows) / 4500) * 4500
+    credit = np.round(income * rng.lognormal(1.1, 0.6, rows) / 4500) * 4500
+    contract_type = rng.choice(['Cash loans', 'Revolving loans'], rows, p=[0.905, 0.095])
+    # the goods price is only missing for a few revolving loans
+    goods_price = np.round(credit * rng.uniform(0.8, 1.0, rows) / 4500) * 4500
+    goods_price[(contract_type == 'Revolving loans') & (rng.rand(rows) < 0.01)] = np.nan
+    num_children = np.minimum(rng.poisson(0.42, rows), 19)
+    married = rng.rand(rows) < 0.7
+
+    # delinquency is more likely for young, recently employed and highly indebted applicants
+    logit = (-2.6 + 0.8 * (days_birth > -12000) + 0.5 * (days_employed > -700)
+             - 0.6 * not_employed + 0.3 * np.log(credit / income))
+    target = (rng.rand(rows) < 1 / (1 + np.exp(-logit))).astype(int)
+
+    data = pd.DataFrame({
+        'SK_ID_CURR': np.arange(first_id, first_id + rows),
+        'TARGET': target,
+        'NAME_CONTRACT_TYPE': contract_type,
+        'CODE_GENDER': rng.choice(['F', 'M', 'XNA'], rows, p=[0.6583, 0.3416, 0.0001]),
+        'FLAG_OWN_CAR': rng.choice(['N', 'Y'], rows, p=[0.66, 0.34]),
+        'FLAG_OWN_REALTY': rng.choice(['Y', 'N'], rows, p=[0.69, 0.31]),
+        'CNT_CHILDREN': num_children,
+        'AMT_INCOME_TOTAL': income,
+        'AMT_CREDIT': credit,
+        'AMT_ANNUITY': _with_missing(rng, np.round(credit * rng.uniform(0.03, 0.08, rows), 1),
+                                     0.00004),
+        'AMT_GOODS_PRICE': goods_price,
+        'NAME_INCOME_TYPE': income_type,
+        'NAME_EDUCATION_TYPE': _choice(rng, EDU_TYPES, rows),
+        'NAME_FAMILY_STATUS': _choice(rng, FAMILY_STATUSES, rows),
+        'DAYS_BIRTH': days_birth,
+        'DAYS_EMPLOYED': days_employed,
+        'DAYS_ID_PUBLISH': -rng.randint(0, 7198, rows),
+        'FLAG_CONT_MOBILE': rng.choice([1, 0], rows, p=[0.998, 0.002]),
+        'CNT_FAM_MEMBERS': _with_missing(rng, num_children + 1 + married, 0.00001),
+        'AMT_REQ_CREDIT_BUREAU_DAY': _with_missing(
+            rng, rng.choice([0, 1, 2], rows, p=[0.9945, 0.005, 0.0005]), 0.135)})
+    for i in range(n_filler_cols):
+        if i % 4 == 0:
+            data['FILLER_%i' % i] = rng.choice(['A', 'B', 'C', 'XNA'], rows)
+        else:
+            data['FILLER_%i' % i] = np.round(rng.rand(rows), 4)
+    return data
+
+
+def write_raw(rows, path, chunk_rows=500000, seed=0, n_filler_cols=N_FILLER_COLS):
+    """Write raw loan applications to a CSV file, generating them chunk by chunk
+
+    Args:
+        rows (int): number of applications
+        path (str): path of the CSV file to write
+        chunk_rows (int): number of applications generated and written at a time,
+            which bounds the memory needed for large files
+        seed (int): seed of the random generator; each chunk uses seed + its index
+        n_filler_cols (int): number of extra columns that the pipeline does not use
+
+    Returns:
+        None
+
+    """
+    for i, start in enumerate(range(0, rows, chunk_rows)):
+        chunk = make_raw(min(chunk_rows, rows - start), seed=seed + i, first_id=100002 + start,
+                         n_filler_cols=n_filler_cols)
+        chunk.to_csv(path, index=False, mode='w' if i == 0 else 'a', header=i == 0)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Generate synthetic loan application data")
+    parser.add_argument('--rows', type=int, default=100000, help='Number of applications')
+    parser.add_argument('--output', '-o', default='data/sample/application_data.csv',
+                        help='Path of the CSV file to write')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the random generator')
+    parser.add_argument('--filler_cols', type=int, default=N_FILLER_COLS,
+                        help='Number of extra columns that the pipeline does not use '
+                             '(optional, default = 0; 102 for the width of the real file)')
+    args = parser.parse_args()
+
+    write_raw(args.rows, args.output, seed=args.seed, n_filler_cols=args.filler_cols)
+    print('%i applications written to %s' % (args.rows, args.output))
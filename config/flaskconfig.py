@@ -9,6 +9,43 @@ HOST = "0.0.0.0"
 SQLALCHEMY_ECHO = False  # If true, SQL for queries made will be printed
 MAX_ROWS_SHOW = 100
 
+# Connection pool of the database engine (see engine_options in src/add_application.py);
+# the pool size, overflow and timeout do not apply to SQLite
+DB_POOL = {
+    'pool_size': int(os.environ.get('DB_POOL_SIZE', 5)),
+    'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+    'pool_timeout': float(os.environ.get('DB_POOL_TIMEOUT', 30)),
+    'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+    'pool_pre_ping': True
+}
+
+# Report the durations of the stages of a request in its Server-Timing header
+SERVER_TIMING = True
+
+# Expose request counters, latency histograms, cache, database and model metrics of the
+# app process on /metrics in the Prometheus text format
+METRICS = True
+
+# Profile the stages of /result and write their stacks as folded stack files to PROFILE_DIR,
+# keeping the last PROFILE_MAX_FILES files; a request is profiled when it sends the
+# X-Profile: 1 header or the ?profile=1 query flag with the admin token, and 1 in
+# PROFILE_SAMPLE_EVERY requests is profiled (0 for none)
+PROFILE_DIR = 'data/profiles'
+PROFILE_MAX_FILES = 200
+PROFILE_SAMPLE_EVERY = int(os.environ.get('PROFILE_SAMPLE_EVERY', 0))
+
+# Token expected in the X-Admin-Token header of the /admin endpoints, which are
+# disabled when it is not set
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+
+# Write new applications behind the request: rows are spooled to WRITE_BEHIND_SPOOL_DIR and
+# inserted in bulk every WRITE_BEHIND_BATCH_SIZE rows or WRITE_BEHIND_FLUSH_INTERVAL seconds
+WRITE_BEHIND = True
+WRITE_BEHIND_SPOOL_DIR = os.environ.get('WRITE_BEHIND_SPOOL_DIR', 'data/spool')
+WRITE_BEHIND_BATCH_SIZE = 100
+WRITE_BEHIND_FLUSH_INTERVAL = 1.0
+WRITE_BEHIND_FSYNC = False
+
 # Connection string
 DB_HOST = os.environ.get('MYSQL_HOST')
 DB_PORT = os.environ.get('MYSQL_PORT')
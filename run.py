@@ -3,19 +3,24 @@ This file defines command-line arguments from the user and
 delegates tasks to the appropriate module in `src/`.
 """
 import argparse
+import json
 import logging.config
 import os
+import sys
 import pkg_resources
 
 import yaml
 import joblib
-import pandas as pd
 
-from src.add_application import ApplicationManager, create_db
+from src.add_application import ApplicationManager, create_db, bulk_ingest
 from src.s3 import upload_file_to_s3, download_file_from_s3
-from src.acquire import import_data, clean
-from src.features import featurize, get_ohe_data
-from src.model import train_model, evaluate
+from src.artifacts import load_artifact, save_artifact
+from src.pipeline import stream_clean_featurize, run_all, clean_stage, featurize_stage, model_stage
+from src.cache import StageCache, hash_file
+from src.instrument import run_summary
+from src.model import evaluate, export_forest, train_model
+from src.tune import tune_model, train_model_args
+from src.predict import InputEncoder, read_applicants, score_batch
 from config.flaskconfig import SQLALCHEMY_DATABASE_URI
 
 logging.config.fileConfig(pkg_resources.resource_filename(__name__, "config/logging/local.conf"),
@@ -81,18 +86,50 @@ if __name__ == '__main__':
     sb_ingest.add_argument("--engine_string", default='sqlite:///data/application.db',
                            help="SQLAlchemy Connection URI for database")
 
+    # Sub-parser for loading a file of applications into the database
+    sb_bulk = subparsers.add_parser("bulk_ingest", description="Add a file of applications "
+                                                               "to database in batches")
+    sb_bulk.add_argument('--input', '-i', required=True,
+                         help='Path to applications (.csv or .parquet), with columns named like '
+                              'the table columns or the ingest arguments')
+    sb_bulk.add_argument("--batch_size", type=int, default=10000,
+                         help="Number of applications inserted at a time")
+    sb_bulk.add_argument("--engine_string", default=SQLALCHEMY_DATABASE_URI,
+                         help="SQLAlchemy Connection URI for database")
+
     # Sub-parser for acquiring, cleaning, and running model pipeline
     sb_pipeline = subparsers.add_parser("run_model_pipeline",
                                         description="Acquire data, clean data, "
                                                     "featurize data, and run model-pipeline")
     sb_pipeline.add_argument('--step', help="Which step to run",
-                             choices=['clean', 'featurize', 'model', 'test'])
+                             choices=['clean', 'stream', 'featurize', 'model', 'all', 'tune',
+                                      'export', 'test'])
     sb_pipeline.add_argument('--input', '-i', default=None,
-                             help='Path to input data (optional, default = None)')
+                             help='Path to input data; .csv, .parquet, .feather or .npz '
+                                  '(optional, default = None)')
     sb_pipeline.add_argument('--config', default='config/config.yaml',
                              help='Path to configuration file')
+    sb_pipeline.add_argument('--save_cleaned', default=None,
+                             help='Path to also save the cleaned data when running all steps '
+                                  '(optional, default = None)')
+    sb_pipeline.add_argument('--save_featurized', default=None,
+                             help='Path to also save the featurized data when running all steps '
+                                  '(optional, default = None)')
+    sb_pipeline.add_argument('--no_cache', action='store_true',
+                             help='Run every step from scratch instead of reusing cached outputs')
     sb_pipeline.add_argument('--output', '-o', default=None,
-                             help='Path to save output (optional, default = None)')
+                             help='Path to save output; the format of intermediate artifacts is '
+                                  'picked by the extension (optional, default = None)')
+
+    # Sub-parser for scoring a file of applicants in batch
+    sb_score = subparsers.add_parser("score", description="Score a file of applicants in batch")
+    sb_score.add_argument('--input', '-i', required=True,
+                          help='Path to applicant records (.csv, or .jsonl for JSON lines)')
+    sb_score.add_argument('--config', default='config/config.yaml',
+                          help='Path to configuration file')
+    sb_score.add_argument('--output', '-o', default=None,
+                          help='Path to save predictions as JSON lines '
+                               '(optional, default = stdout)')
 
     args = parser.parse_args()
     sp_used = args.subparser_name
@@ -101,7 +138,7 @@ if __name__ == '__main__':
         create_db(args.engine_string)
     elif sp_used == 'ingest':
         am = ApplicationManager(engine_string=args.engine_string)
-        am.add_application(args.id, args.target, args.contract_type,
+        am.add_application(args.contract_type,
                            args.gender, args.own_car, args.own_realty,
                            args.num_children, args.income_total,
                            args.amt_credit, args.amt_annuity,
@@ -112,6 +149,8 @@ if __name__ == '__main__':
                            args.cnt_family_members, args.amt_req_credit_bureau_day,
                            args.employed)
         am.close()
+    elif sp_used == 'bulk_ingest':
+        bulk_ingest(args.engine_string, args.input, args.batch_size)
     elif sp_used == 'upload_file_to_s3':
         upload_file_to_s3(args.local_path, args.s3_path)
     elif sp_used == 'download_file_from_s3':
@@ -125,38 +164,100 @@ if __name__ == '__main__':
         except FileNotFoundError:
             logger.error("Configuration file from %s is not found" % args.config)
 
-        if args.input is not None:
-            input = pd.read_csv(args.input)
-            logger.info("Input data loaded from %s", args.input)
+        if args.input is not None and args.step != 'export':
+            input = load_artifact(args.input)
+            input_hash = hash_file(args.input)
+
+        # reuse the output of a step when its input, configuration and code are unchanged
+        cache = None
+        if not args.no_cache and 'cache' in conf.get('pipeline', {}):
+            cache = StageCache(**conf['pipeline']['cache'])
 
         if args.step == 'clean':
             # import raw data and clean data
-            raw = import_data(**conf['acquire']['import_data'])
-            output = clean(raw, **conf['acquire']['clean'])
+            output, _ = clean_stage(conf, cache)
+        elif args.step == 'stream':
+            # import raw data in chunks, clean and generate new features chunk by chunk;
+            # the chunks are appended to the output instead of being kept in memory
+            if args.output is None:
+                logger.error("The stream step needs --output to append the chunks to")
+            else:
+                stream_clean_featurize(conf, args.output)
         elif args.step == 'featurize':
             # generate new features from cleaned data and one-hot encode
-            featurized = featurize(input, **conf['features']['featurize'])
-            output = get_ohe_data(featurized, **conf['features']['get_ohe_data'])
+            output, _ = featurize_stage(input, conf, cache, input_hash=input_hash)
         elif args.step == 'model':
             # train model & evaluate results
-            model_result = train_model(input, **conf['model']['train_model'])
+            model_result, _ = model_stage(input, conf, cache, input_hash=input_hash)
             output = model_result[0]
             X_test = model_result[1]
             y_test = model_result[2]
             # evaluate the model result
             evaluate(output, X_test, y_test, **conf['model']['evaluate'])
+        elif args.step == 'all':
+            # run every step in this process, handing data from step to step in memory
+            output = run_all(conf, cleaned_path=args.save_cleaned,
+                             featurized_path=args.save_featurized, cache=cache)
+        elif args.step == 'tune':
+            # search hyperparameters on the featurized data; without --input, the
+            # featurized data is generated in memory (reusing cached steps)
+            if args.input is None:
+                cleaned, key = clean_stage(conf, cache)
+                input, _ = featurize_stage(cleaned, conf, cache, input_hash=key)
+            # search on the training rows of the model step's split only, weighted like
+            # them, then train the best candidate like the model step and evaluate it on
+            # the held out rows, which took no part in the search
+            best = tune_model(input, train_kwargs=conf['model']['train_model'],
+                              **conf['model']['tune_model'])[0]
+            output, X_test, y_test = train_model(
+                input, **train_model_args(conf['model']['train_model'], best))
+            evaluate(output, X_test, y_test, **conf['model']['evaluate'])
+        elif args.step == 'export':
+            # flatten a saved model into NumPy arrays that the app scores without sklearn
+            export_forest(joblib.load(args.input),
+                          args.output or conf['model']['export_forest']['save_dir'])
         elif args.step == 'test':
             os.system('pytest')
 
-        if args.output is not None:
-            if args.step != "model":
+        if args.output is not None and args.step not in ('stream', 'export'):
+            if args.step not in ('model', 'all', 'tune'):
                 # save intermediate artifacts in the model pipeline
-                output.to_csv(args.output, index=False)
-                logger.info("Output saved to %s", args.output)
+                save_artifact(output, args.output)
             else:
                 # save the trained model
                 joblib.dump(output, args.output)
                 logger.info("Trained model object saved to %s", args.output)
+                # export next to the saved model, e.g. models/randomforest.forest for
+                # models/randomforest.joblib, so a model saved elsewhere does not replace
+                # the forest the app serves
+                export_dir = os.path.splitext(args.output)[0] + '.forest'
+                if 'export_forest' in conf['model'] and export_dir != args.output:
+                    export_forest(output, export_dir)
+
+        # timings, memory and rows of every stage that ran, next to the evaluation results
+        if args.step != 'test' and 'run_summary' in conf.get('pipeline', {}):
+            run_summary.write(conf['pipeline']['run_summary']['path'], step=args.step,
+                              config=args.config, input=args.input, output=args.output)
 
+    elif sp_used == 'score':
+        with open(args.config, "r") as f:
+            conf = yaml.load(f, Loader=yaml.FullLoader)
+            logger.info("Configuration file loaded from %s" % args.config)
+
+        encoder = InputEncoder(**conf['predict']['transform_input'])
+        fmt = 'csv' if args.input.endswith('.csv') else 'jsonl'
+        out = open(args.output, 'w') if args.output is not None else sys.stdout
+        get_prediction_conf = conf['predict']['get_prediction']
+        try:
+            with open(args.input, 'r', newline='') as f:
+                for result in score_batch(read_applicants(f, fmt), encoder,
+                                          model_path=get_prediction_conf['model_path'],
+                                          threshold=get_prediction_conf['threshold'],
+                                          **conf['predict']['score_batch']):
+                    out.write(json.dumps(result) + '\n')
+        finally:
+            if out is not sys.stdout:
+                out.close()
+                logger.info("Predictions saved to %s", args.output)
     else:
         parser.print_help()
@@ -6,11 +6,42 @@ import logging
 
 import pandas as pd
 
+from src.instrument import instrument
+
 logger = logging.getLogger(__name__)
 
 pd.options.mode.chained_assignment = None
 
 
+def _map_unique(series, func):
+    """Apply a Python function once per distinct value of a Series instead of once per row
+
+    Args:
+        series (:obj:`Series <pandas.Series>`): column with few distinct values
+            (object or categorical dtype)
+        func (callable): function applied to each distinct non-missing value
+
+    Returns:
+        :obj:`Series <pandas.Series>`: the mapped column; missing values are left as they are
+
+    """
+    mapping = {value: func(value) for value in series.dropna().unique()}
+    mapped = series.map(mapping)
+    # merging categories makes pandas fall back to object; keep categoricals categorical
+    if isinstance(series.dtype, pd.CategoricalDtype) and \
+            not isinstance(mapped.dtype, pd.CategoricalDtype):
+        mapped = mapped.astype('category')
+    return mapped
+
+
+def _replace_all(value, replace_dict):
+    """Apply every (old, new) substring replacement of a dictionary in order to one value"""
+    for old, new in replace_dict.items():
+        value = value.replace(old, new)
+    return value
+
+
+@instrument()
 def import_data(path, colnames_dict):
     """Read data from "path" into a DataFrame and change column names to lower case
 
@@ -33,6 +64,41 @@ def import_data(path, colnames_dict):
     return data
 
 
+def import_data_chunks(path, colnames_dict, chunksize, dtypes=None):
+    """Read data from "path" in chunks, keeping only the columns that are renamed
+
+    `clean` drops the rows with a missing value in any column of the data read by
+    `import_data`, so the rows with a missing value in a column that is not kept are
+    dropped here, and cleaning the chunks keeps the same rows as cleaning the whole file.
+
+    Args:
+        path (str): file name path; default value is 'data/sample/application_data.csv'
+            (specified in config.yaml)
+        colnames_dict (dict of {str : str}): a dictionary that contains the old column names
+            as keys and lower-cased column names as values; only these columns are kept
+        chunksize (int): number of rows read per chunk; default is 100000 (config.yaml)
+        dtypes (dict of {str : str}): explicit dtypes of the raw columns, so that every chunk
+            is parsed the same way without type inference (default in config.yaml)
+
+    Yields:
+        chunk (:obj:`DataFrame <pandas.DataFrame>`): a DataFrame of at most `chunksize`
+            loan records with renamed columns
+
+    """
+    reader = pd.read_csv(path, dtype=dtypes, chunksize=chunksize)
+    logger.info('Reading data from path %s in chunks of %i rows', path, chunksize)
+    for chunk in reader:
+        missing = [col for col in colnames_dict if col not in chunk.columns]
+        if missing:
+            logger.error('Columns %s are not found in %s', missing, path)
+            raise ValueError('Missing columns: %s' % missing)
+        kept = [col for col in chunk.columns if col in colnames_dict]
+        unused = [col for col in chunk.columns if col not in colnames_dict]
+        if unused:
+            chunk = chunk.loc[chunk[unused].notna().all(axis=1), kept]
+        yield chunk.rename(columns=colnames_dict)
+
+
 def filna(df, col):
     """Fill the specified column's missing values with 0
 
@@ -70,8 +136,8 @@ def clean_column(df, col, replace_dict):
             categorical column cleaned with less categories
 
     """
-    for key, value in replace_dict.items():
-        df.loc[:, col] = df[col].apply(lambda x: x.replace(key, value))
+    # the replacements are computed once per category and mapped onto the whole column
+    df[col] = _map_unique(df[col], lambda x: _replace_all(x, replace_dict))
 
     logger.debug("The categorical column cleaned with less categories is %s", col)
 
@@ -91,7 +157,7 @@ def to_str(df, col):
             the the specified column changed to string type
 
     """
-    df.loc[:, col] = df[col].astype(str)
+    df[col] = df[col].astype(str)
     logger.info("The values in column %s was changed to string", col)
     return df
 
@@ -111,7 +177,7 @@ def neg_to_pos(df, cols):
 
     """
     for col in cols:
-        df.loc[:, col] = df[col].apply(lambda x: x*-1)
+        df[col] = -df[col]
         logger.info("The values in column %s was changed from "
                     "negative values to positive values", col)
     return df
@@ -135,14 +201,14 @@ def replace_cat(df, cat_dict):
 
     """
     for col, values in cat_dict.items():
-        for old, new in values.items():
-            df[col] = df[col].apply(lambda x: x.replace(old, new))
+        df[col] = _map_unique(df[col], lambda x: _replace_all(x, values))
         logger.debug("The values in column %s was changed to "
                      "binary categories that match future user input", col)
 
     return df
 
 
+@instrument()
 def clean(df, filna_col, clean_col, clean_replace_dict, to_str_col, neg_cols, cat_dict):
     """Clean the input DataFrame to be ready to generate new features from
 
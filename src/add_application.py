@@ -2,18 +2,48 @@
 This file contains multiple functions that offers
 creating database and adding new data to the database functionality
 """
+import datetime
+import json
 import logging.config
+import math
+import os
+import threading
+import time
 
+import pandas as pd
 import sqlalchemy
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import Column, Integer, String, Float
+from sqlalchemy import Column, DateTime, Integer, String, Float
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
 from flask_sqlalchemy import SQLAlchemy
 
+from src.artifacts import artifact_format
+
+try:
+    import fcntl
+except ImportError:  # file locks are not available on Windows
+    fcntl = None
+
 logger = logging.getLogger(__name__)
 
 Base = declarative_base()
 
+# select() takes a list of columns before SQLAlchemy 1.4 and positional columns from 2.0
+_LEGACY_SELECT = tuple(int(part) for part in sqlalchemy.__version__.split('.')[:2]) < (1, 4)
+
+
+def _select(*columns):
+    """Build a SELECT of the given columns with any supported version of SQLAlchemy"""
+    if _LEGACY_SELECT:
+        return sqlalchemy.select(list(columns))
+    return sqlalchemy.select(*columns)
+
+
+def _utcnow():
+    """Current UTC time as a naive datetime, as stored in the created_at column"""
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
 
 class Application(Base):
     """Create a data model for the database for capturing loan applicants information"""
@@ -21,7 +51,8 @@ class Application(Base):
     __tablename__ = 'applications'
 
     id = Column(Integer, primary_key=True, autoincrement=True)
-    contract_type = Column(String(100), unique=False, nullable=True)
+    created_at = Column(DateTime, unique=False, nullable=True, default=_utcnow, index=True)
+    contract_type = Column(String(100), unique=False, nullable=True, index=True)
     gender = Column(String(100), unique=False, nullable=True)
     own_car = Column(String(100), unique=False, nullable=True)
     own_realty = Column(String(100), unique=False, nullable=True)
@@ -30,7 +61,7 @@ class Application(Base):
     amt_credit = Column(Float, unique=False, nullable=True)
     amt_annuity = Column(Float, unique=False, nullable=True)
     amt_goods_price = Column(Float, unique=False, nullable=True)
-    income_type = Column(String(100), unique=False, nullable=True)
+    income_type = Column(String(100), unique=False, nullable=True, index=True)
     edu_type = Column(String(100), unique=False, nullable=True)
     family_status = Column(String(100), unique=False, nullable=True)
     Age = Column(Integer, unique=False, nullable=True)
@@ -40,14 +71,165 @@ class Application(Base):
     cnt_family_members = Column(Integer, unique=False, nullable=True)
     amt_req_credit_bureau_day = Column(Integer, unique=False, nullable=True)
     Employed = Column(String(100), unique=False, nullable=True)
+    pred_prob = Column(Float, unique=False, nullable=True)
+    pred_class = Column(Integer, unique=False, nullable=True)
 
     def __repr__(self):
         return '<Application ID %r>' % self.id
 
 
+class TimedQueuePool(QueuePool):
+    """Connection pool that records how long checkouts wait for a free connection"""
+
+    def __init__(self, *args, **kwargs):
+        super(TimedQueuePool, self).__init__(*args, **kwargs)
+        self.wait_count = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+        self._wait_lock = threading.Lock()
+
+    def _do_get(self):
+        start = time.time()
+        try:
+            return super(TimedQueuePool, self)._do_get()
+        finally:
+            wait = time.time() - start
+            with self._wait_lock:
+                self.wait_count += 1
+                self.wait_time_total += wait
+                self.wait_time_max = max(self.wait_time_max, wait)
+
+
+def engine_options(engine_string, pool_size=5, max_overflow=10, pool_timeout=30,
+                   pool_recycle=1800, pool_pre_ping=True):
+    """Build the keyword arguments of `sqlalchemy.create_engine` for the connection pool
+
+    Stale connections are tested before use (`pool_pre_ping`) and replaced after
+    `pool_recycle` seconds, before the server closes them. The size of the pool only
+    applies to server databases; SQLite keeps the pool SQLAlchemy picks for it.
+
+    Args:
+        engine_string (str): SQLAlchemy connection URI for the database
+        pool_size (int): number of connections kept open
+        max_overflow (int): number of extra connections opened under bursts of traffic
+        pool_timeout (float): number of seconds to wait for a connection before failing
+        pool_recycle (int): number of seconds after which a connection is replaced
+        pool_pre_ping (bool): whether to test connections when they are checked out
+
+    Returns:
+        dict: keyword arguments for `sqlalchemy.create_engine`
+
+    """
+    options = {'pool_pre_ping': pool_pre_ping, 'pool_recycle': pool_recycle}
+    if not engine_string.startswith('sqlite'):
+        options.update(poolclass=TimedQueuePool, pool_size=pool_size,
+                       max_overflow=max_overflow, pool_timeout=pool_timeout)
+    return options
+
+
+def instrument_engine(engine):
+    """Count the connections opened, checked out and invalidated by the pool of an engine
+
+    Args:
+        engine (:obj:`sqlalchemy.engine.Engine`): the engine to instrument
+
+    Returns:
+        engine (:obj:`sqlalchemy.engine.Engine`): the same engine
+
+    """
+    if hasattr(engine, 'pool_events'):
+        return engine
+    engine.pool_events = {'connects': 0, 'checkouts': 0, 'invalidations': 0}
+
+    def count(name):
+        def listener(*args):
+            engine.pool_events[name] += 1
+        return listener
+
+    sqlalchemy.event.listen(engine, 'connect', count('connects'))
+    sqlalchemy.event.listen(engine, 'checkout', count('checkouts'))
+    sqlalchemy.event.listen(engine, 'invalidate', count('invalidations'))
+    return engine
+
+
+def get_engine(engine_string, **pool_options):
+    """Create an engine with the pool configuration of `engine_options` and pool metrics
+
+    Args:
+        engine_string (str): SQLAlchemy connection URI for the database
+        **pool_options: pool settings passed to `engine_options`
+
+    Returns:
+        engine (:obj:`sqlalchemy.engine.Engine`): the engine
+
+    """
+    engine = sqlalchemy.create_engine(engine_string,
+                                      **engine_options(engine_string, **pool_options))
+    return instrument_engine(engine)
+
+
+def pool_status(engine):
+    """Get the current state of the connection pool of an engine
+
+    Args:
+        engine (:obj:`sqlalchemy.engine.Engine`): an engine from `get_engine`, or instrumented
+            with `instrument_engine`
+
+    Returns:
+        dict: the pool class, its size, the connections checked out, checked in and in
+            overflow, the counts of pool events and, for a `TimedQueuePool`, the number of
+            checkouts and the total and maximum number of seconds they waited
+
+    """
+    pool = engine.pool
+    status = {'pool': type(pool).__name__}
+    for name in ('size', 'checkedout', 'checkedin', 'overflow'):
+        if hasattr(pool, name):
+            status[name] = getattr(pool, name)()
+    status.update(getattr(engine, 'pool_events', {}))
+    if isinstance(pool, TimedQueuePool):
+        status.update(wait_count=pool.wait_count, wait_time_total=pool.wait_time_total,
+                      wait_time_max=pool.wait_time_max)
+    return status
+
+
+def upgrade_db(engine):
+    """Add the columns and indexes of the applications table that an existing table lacks
+
+    Args:
+        engine (:obj:`sqlalchemy.engine.Engine`): engine of the applications database
+
+    Returns:
+        added (:obj:`list` of str): names of the columns and indexes added
+
+    """
+    table = Application.__table__
+    inspector = sqlalchemy.inspect(engine)
+    if table.name not in inspector.get_table_names():
+        return []
+    existing = {column['name'] for column in inspector.get_columns(table.name)}
+    added = []
+    with engine.begin() as connection:
+        for column in table.columns:
+            if column.name not in existing:
+                connection.execute(sqlalchemy.text('ALTER TABLE %s ADD COLUMN %s %s' % (
+                    table.name, column.name, column.type.compile(dialect=engine.dialect))))
+                added.append(column.name)
+    existing = {index['name'] for index in inspector.get_indexes(table.name)}
+    for index in table.indexes:
+        if index.name not in existing:
+            index.create(engine)
+            added.append(index.name)
+    if added:
+        logger.info('Added %s to the %s table', ', '.join(added), table.name)
+    return added
+
+
 def create_db(engine_string: str):
     """Create a database from provided engine string
 
+    An existing applications table is upgraded with the columns and indexes it lacks.
+
     Args:
         engine_string (str): Engine string
 
@@ -56,7 +238,8 @@ def create_db(engine_string: str):
 
     """
     try:
-        engine = sqlalchemy.create_engine(engine_string)
+        engine = get_engine(engine_string)
+        upgrade_db(engine)
         Base.metadata.create_all(engine)
         logger.info("Database created at %s", engine_string)
     except sqlalchemy.exc.ArgumentError:
@@ -66,33 +249,544 @@ def create_db(engine_string: str):
                      'Please check if you are connected to Northwestern VPN')
 
 
+def coerce_row(row):
+    """Convert the values of an application row to the Python types of their columns
+
+    Values come as strings from the app's form, so a value that is not a number, e.g. 'abc'
+    for the age, is rejected here rather than stored or sent to the database.
+
+    Args:
+        row (dict): values of the columns of the applications table
+
+    Returns:
+        row (dict): the same dictionary with integer and float columns converted
+
+    Raises:
+        ValueError: if a value is not a finite number, or not a whole number for an
+            integer column
+
+    """
+    for name, value in row.items():
+        if value is None:
+            continue
+        column_type = Application.__table__.c[name].type
+        if isinstance(column_type, (Integer, Float)):
+            number = float(value)
+            if not math.isfinite(number):
+                raise ValueError('%s must be a finite number, got %r' % (name, value))
+            if isinstance(column_type, Integer):
+                if not number.is_integer():
+                    raise ValueError('%s must be a whole number, got %r' % (name, value))
+                number = int(number)
+            row[name] = number
+    return row
+
+
+def _is_transient(error):
+    """Whether a database error may go away when retried, e.g. a lost connection or a lock
+    timeout, unlike a row the database rejects, e.g. a duplicate key or a malformed value"""
+    if getattr(error, 'connection_invalidated', False):
+        return True
+    return isinstance(error, (sqlalchemy.exc.OperationalError, sqlalchemy.exc.InterfaceError,
+                              sqlalchemy.exc.TimeoutError))
+
+
+def _parse_datetime(value):
+    """Parse a datetime written with str(), with or without microseconds"""
+    fmt = '%Y-%m-%d %H:%M:%S.%f' if '.' in value else '%Y-%m-%d %H:%M:%S'
+    return datetime.datetime.strptime(value, fmt)
+
+
+# names of the add_application arguments that differ from the table columns
+ARGUMENT_COLUMNS = {'age': 'Age', 'years_employed': 'Years_Employed',
+                    'years_id_publish': 'Years_ID_Publish', 'employed': 'Employed'}
+
+
+def read_application_chunks(path, chunksize):
+    """Read a file of applications chunk by chunk, keeping only the columns of the table
+
+    Args:
+        path (str): path to a .csv or .parquet file whose columns are named like the table
+            columns (e.g. 'Age') or like the `ingest` arguments (e.g. 'age')
+        chunksize (int): number of rows per chunk
+
+    Yields:
+        rows (:obj:`list` of dict): the rows of a chunk, with None for missing values
+
+    """
+    fmt = artifact_format(path)
+    if fmt == 'csv':
+        chunks = pd.read_csv(path, chunksize=chunksize)
+    elif fmt == 'parquet':
+        import pyarrow.parquet
+        chunks = (batch.to_pandas()
+                  for batch in pyarrow.parquet.ParquetFile(path).iter_batches(chunksize))
+    else:
+        logger.error('Applications can be ingested from .csv or .parquet files, not %s', path)
+        raise ValueError('Unsupported application file: %s' % path)
+    columns = set(Application.__table__.columns.keys())
+    for chunk in chunks:
+        chunk = chunk.rename(columns=ARGUMENT_COLUMNS)
+        chunk = chunk[[col for col in chunk.columns if col in columns]]
+        yield chunk.astype(object).where(chunk.notna(), None).to_dict('records')
+
+
+def bulk_ingest(engine_string, path, batch_size=10000):
+    """Load a file of applications into the applications table in batches
+
+    Every batch is inserted with a single statement: a multi-row INSERT ... VALUES on
+    MySQL, and an executemany on other databases. On SQLite the whole file is loaded in
+    one transaction; elsewhere every batch is committed on its own, so that a failure
+    only loses the batch being inserted.
+
+    Args:
+        engine_string (str): SQLAlchemy connection URI for the database
+        path (str): path to a .csv or .parquet file of applications,
+            see `read_application_chunks`
+        batch_size (int): number of rows read and inserted at a time
+
+    Returns:
+        n_rows (int): number of rows inserted
+
+    """
+    engine = get_engine(engine_string)
+    Base.metadata.create_all(engine)
+    table = Application.__table__
+    dialect = engine.dialect.name
+
+    def insert(connection, rows):
+        if dialect == 'mysql':
+            connection.execute(table.insert().values(rows))
+        else:
+            connection.execute(table.insert(), rows)
+
+    n_rows = 0
+    start = time.time()
+    if dialect == 'sqlite':
+        with engine.begin() as connection:
+            for rows in read_application_chunks(path, batch_size):
+                insert(connection, rows)
+                n_rows += len(rows)
+                logger.debug('%i applications inserted', n_rows)
+    else:
+        for rows in read_application_chunks(path, batch_size):
+            with engine.begin() as connection:
+                insert(connection, rows)
+            n_rows += len(rows)
+            logger.debug('%i applications inserted', n_rows)
+    elapsed = time.time() - start
+    logger.info('%i applications inserted in %0.1f seconds (%0.0f rows/sec)',
+                n_rows, elapsed, n_rows / elapsed if elapsed > 0 else float('inf'))
+    engine.dispose()
+    return n_rows
+
+
+class ApplicationWriter:
+    """Write-behind queue that inserts application rows into the database in bulk
+
+    Rows are appended to a local spool file and buffered in memory, and a background
+    thread inserts them with one executemany per batch, once `batch_size` rows are
+    buffered or `flush_interval` seconds have passed. Each batch has its own spool
+    segment, which is deleted only after the batch is committed, so rows of a process
+    that crashed are inserted by the background thread of the next writer that starts on
+    the same spool directory (a crash between the commit and the deletion inserts that
+    batch twice).
+    Segments of live writers in other processes are locked and left alone.
+
+    When the database is unavailable, batches stay spooled and are retried with an
+    exponential backoff. When it rejects a batch for good, e.g. for a duplicate key or a
+    value that does not fit its column, the batch is split until the rejected rows are
+    isolated; they are moved to a dead-letter file and the other rows are inserted.
+    """
+
+    def __init__(self, engine, spool_dir, batch_size=100, flush_interval=1.0, fsync=False,
+                 max_retry_interval=60.0):
+        """
+        Args:
+            engine (:obj:`sqlalchemy.engine.Engine`): engine of the applications database
+            spool_dir (str): directory of the spool segments
+            batch_size (int): number of buffered rows that triggers a flush
+            flush_interval (float): maximum number of seconds a row stays buffered
+            fsync (bool): whether to fsync the spool file after every row, so that rows also
+                survive a power loss, not only a crash of the process (default = False)
+            max_retry_interval (float): maximum number of seconds between two attempts while
+                the database is unavailable (default = 60)
+        """
+        self.engine = engine
+        self.spool_dir = spool_dir
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.max_retry_interval = max_retry_interval
+        # rejected rows are kept out of the *.jsonl segments that are replayed on recovery
+        self.dead_letter_path = os.path.join(spool_dir, 'dead_letter', 'rejected.jsonl')
+        self.n_written = 0
+        self.n_batches = 0
+        self.n_failures = 0
+        self.n_rejected = 0
+        self.insert_seconds = 0.0
+        self._table = Application.__table__
+        self._cond = threading.Condition()
+        self._rows = []
+        self._pending = []
+        self._closing = False
+        self._n_segments = 0
+        self._retry_interval = 0.0
+        self._retry_at = 0.0
+        os.makedirs(spool_dir, exist_ok=True)
+        self._segment = self._open_segment()
+        self._thread = threading.Thread(target=self._run, name='application-writer', daemon=True)
+        self._thread.start()
+
+    def _open_segment(self):
+        """Create and lock a new spool segment, returning its path and open file"""
+        self._n_segments += 1
+        path = os.path.join(self.spool_dir, '%i-%i-%i.jsonl' % (os.getpid(), time.time() * 1e6,
+                                                                 self._n_segments))
+        spool = open(path, 'a')
+        if fcntl is not None:
+            fcntl.flock(spool, fcntl.LOCK_EX)
+        return path, spool
+
+    def _insert(self, rows):
+        """Insert rows in one transaction with a single executemany"""
+        start = time.perf_counter()
+        with self.engine.begin() as connection:
+            connection.execute(self._table.insert(), rows)
+        self.insert_seconds += time.perf_counter() - start
+        self.n_written += len(rows)
+        self.n_batches += 1
+
+    def _reject(self, row, error):
+        """Append a row the database rejected to the dead-letter file, with the reason"""
+        reason = str(getattr(error, 'orig', None) or error)
+        line = json.dumps({'rejected_at': _utcnow(), 'error': reason, 'row': row}, default=str)
+        os.makedirs(os.path.dirname(self.dead_letter_path), exist_ok=True)
+        with open(self.dead_letter_path, 'a') as f:
+            f.write(line + '\n')
+        self.n_rejected += 1
+        logger.error('An application row was rejected by the database (%s) and moved to %s',
+                     reason, self.dead_letter_path)
+
+    def _write(self, rows):
+        """Insert a batch, moving the rows the database rejects to the dead-letter file
+
+        A batch that fails for good is split in halves until every rejected row is inserted
+        on its own, so that one bad row does not hold back the rest of the batch.
+
+        Args:
+            rows (list of dict): the rows of the batch
+
+        Returns:
+            tuple of (list of dict, Exception): the rows left to insert when the database
+                became unavailable and the error it raised, or an empty list and None
+
+        """
+        chunks = [rows]
+        while chunks:
+            chunk = chunks.pop(0)
+            try:
+                self._insert(chunk)
+            except sqlalchemy.exc.SQLAlchemyError as error:
+                if _is_transient(error):
+                    return [row for rest in [chunk] + chunks for row in rest], error
+                if len(chunk) == 1:
+                    self._reject(chunk[0], error)
+                else:
+                    half = len(chunk) // 2
+                    chunks[:0] = [chunk[:half], chunk[half:]]
+        return [], None
+
+    def recover(self):
+        """Queue the rows of spool segments left behind by writers that are not running
+
+        Each segment stays locked and becomes a pending batch, inserted by the background
+        thread like the batches of this writer, so rows the database rejects go to the
+        dead-letter file and the others wait for the database if it is unavailable.
+
+        Returns:
+            n_rows (int): number of rows recovered
+
+        """
+        n_rows = 0
+        for name in sorted(os.listdir(self.spool_dir)):
+            path = os.path.join(self.spool_dir, name)
+            if not name.endswith('.jsonl') or path == self._segment[0]:
+                continue
+            try:
+                spool = open(path, 'r')
+            except FileNotFoundError:
+                continue
+            if fcntl is not None:
+                try:
+                    fcntl.flock(spool, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    # the segment belongs to a live writer
+                    spool.close()
+                    continue
+                # the owner may have committed and deleted it while we were waiting
+                if not os.path.exists(path) or \
+                        os.stat(path).st_ino != os.fstat(spool.fileno()).st_ino:
+                    spool.close()
+                    continue
+            rows = []
+            for line in spool:
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    # a torn last line means the row was never acknowledged
+                    logger.warning('Skipped an incomplete row in spool segment %s', path)
+                    continue
+                try:
+                    if row.get('created_at') is not None:
+                        row['created_at'] = _parse_datetime(row['created_at'])
+                except (AttributeError, TypeError, ValueError) as error:
+                    self._reject(row, error)
+                    continue
+                rows.append(row)
+            if rows:
+                with self._cond:
+                    self._pending.append(((path, spool), rows))
+            else:
+                os.remove(path)
+                spool.close()
+            n_rows += len(rows)
+        if n_rows:
+            logger.info('Recovered %i application rows from %s', n_rows, self.spool_dir)
+        return n_rows
+
+    def submit(self, row):
+        """Queue an application row for insertion
+
+        Args:
+            row (dict): values of the columns of the applications table
+
+        Returns:
+            None
+
+        """
+        row.setdefault('created_at', _utcnow())
+        line = json.dumps(row, default=str) + '\n'
+        with self._cond:
+            if self._closing:
+                raise RuntimeError('The application writer is closed')
+            spool = self._segment[1]
+            spool.write(line)
+            spool.flush()
+            if self.fsync:
+                os.fsync(spool.fileno())
+            self._rows.append(row)
+            if len(self._rows) >= self.batch_size:
+                self._cond.notify()
+
+    def _run(self):
+        """Background loop that flushes batches until the writer is closed"""
+        try:
+            self.recover()
+        except OSError:
+            logger.exception('Failed to recover the spool segments in %s', self.spool_dir)
+        self._flush_pending()
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._closing or len(self._rows) >= self.batch_size,
+                                    timeout=self.flush_interval)
+                if self._rows:
+                    # seal the segment of the batch and spool new rows to a fresh one
+                    self._pending.append((self._segment, self._rows))
+                    self._rows = []
+                    self._segment = self._open_segment()
+                closing = self._closing
+            # while the database is unavailable, batches pile up until the next attempt
+            if closing or time.monotonic() >= self._retry_at:
+                self._flush_pending()
+            if closing:
+                break
+
+    def _flush_pending(self):
+        """Insert the sealed batches in order, keeping them for a retry if the database fails"""
+        while self._pending:
+            (path, spool), rows = self._pending[0]
+            remaining, error = self._write(rows)
+            if remaining:
+                # rows written before the failure are not retried
+                self._pending[0] = ((path, spool), remaining)
+                self.n_failures += 1
+                self._retry_interval = min(self.max_retry_interval,
+                                           2 * self._retry_interval or self.flush_interval)
+                self._retry_at = time.monotonic() + self._retry_interval
+                logger.error('Failed to write %i application rows (%s), they stay spooled in %s '
+                             'and will be retried in %0.0f seconds', len(remaining),
+                             getattr(error, 'orig', None) or error, path, self._retry_interval)
+                return
+            os.remove(path)
+            spool.close()
+            self._pending.pop(0)
+            logger.debug('%i application rows written', len(rows))
+        self._retry_interval = 0.0
+
+    def stats(self):
+        """Get the counters of the writer
+
+        Returns:
+            dict: number of rows and batches written, of failed batch inserts, of rows moved
+                to the dead-letter file, seconds spent inserting, and number of rows waiting
+                to be inserted
+
+        """
+        with self._cond:
+            backlog = len(self._rows) + sum(len(rows) for _, rows in self._pending)
+        return {'written': self.n_written, 'batches': self.n_batches,
+                'failures': self.n_failures, 'rejected': self.n_rejected,
+                'insert_seconds': self.insert_seconds,
+                'backlog': backlog}
+
+    def close(self, timeout=None):
+        """Flush the buffered rows and stop the background thread
+
+        Args:
+            timeout (float): maximum number of seconds to wait for the last flush
+                (optional, default = None to wait until it is done)
+
+        Returns:
+            None
+
+        """
+        with self._cond:
+            if self._closing:
+                return
+            self._closing = True
+            self._cond.notify()
+        self._thread.join(timeout)
+        for (_, spool), _ in self._pending:
+            spool.close()
+        path, spool = self._segment
+        spool.close()
+        if os.path.exists(path) and os.path.getsize(path) == 0:
+            os.remove(path)
+        logger.info('Application writer closed after writing %i rows', self.n_written)
+
+
 class ApplicationManager:
 
     def __init__(self, app=None, engine_string=None):
         """
         Args:
-            app (Flask): Flask app
+            app (Flask): Flask app; the pool is configured by its DB_POOL_* settings, and when
+                its config sets WRITE_BEHIND, new applications are written by an
+                `ApplicationWriter` configured by the WRITE_BEHIND_* settings
             engine_string (str): Engine string
         """
+        self.writer = None
         if app:
+            app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(
+                app.config['SQLALCHEMY_DATABASE_URI'], **app.config.get('DB_POOL', {}))
             self.db = SQLAlchemy(app)
             self.session = self.db.session
+            with app.app_context():
+                self.engine = instrument_engine(self.db.engine)
+            if app.config.get('WRITE_BEHIND'):
+                self.writer = ApplicationWriter(
+                    self.engine, app.config['WRITE_BEHIND_SPOOL_DIR'],
+                    batch_size=app.config.get('WRITE_BEHIND_BATCH_SIZE', 100),
+                    flush_interval=app.config.get('WRITE_BEHIND_FLUSH_INTERVAL', 1.0),
+                    fsync=app.config.get('WRITE_BEHIND_FSYNC', False))
         elif engine_string:
-            engine = sqlalchemy.create_engine(engine_string)
-            Session = sessionmaker(bind=engine)
+            self.engine = get_engine(engine_string)
+            Session = sessionmaker(bind=self.engine)
             self.session = Session()
         else:
             raise ValueError("Need either an engine string or a Flask app to initialize")
 
     def close(self):
-        """Closes SQLAlchemy session
+        """Closes SQLAlchemy session, after flushing the write-behind queue if there is one
 
         Returns:
             None
 
         """
+        if self.writer is not None:
+            self.writer.close()
         self.session.close()
 
+    def _filters(self, since=None, until=None, contract_type=None, income_type=None,
+                 scored_only=False):
+        """Build the WHERE conditions shared by the query methods"""
+        table = Application.__table__
+        conditions = []
+        if since is not None:
+            conditions.append(table.c.created_at >= since)
+        if until is not None:
+            conditions.append(table.c.created_at < until)
+        if contract_type is not None:
+            conditions.append(table.c.contract_type == contract_type)
+        if income_type is not None:
+            conditions.append(table.c.income_type == income_type)
+        if scored_only:
+            conditions.append(table.c.pred_prob.isnot(None))
+        return conditions
+
+    def recent_applications(self, limit=100, before_id=None, **filters):
+        """Read the most recent applications one page at a time
+
+        Pages are selected by id (keyset pagination) rather than by offset, so reading
+        any page only reads the rows of that page from the primary key or the indexes.
+
+        Args:
+            limit (int): maximum number of applications in the page
+            before_id (int): id of the last application of the previous page
+                (optional, default = None for the first page)
+            **filters: `since` and `until` (datetime, on created_at), `contract_type`,
+                `income_type` (str) and `scored_only` (bool, only applications with
+                a prediction)
+
+        Returns:
+            applications (:obj:`list` of dict): the applications, newest first; pass the
+                id of the last one as `before_id` to get the next page
+
+        """
+        table = Application.__table__
+        conditions = self._filters(**filters)
+        if before_id is not None:
+            conditions.append(table.c.id < before_id)
+        query = table.select()
+        if conditions:
+            query = query.where(sqlalchemy.and_(*conditions))
+        query = query.order_by(table.c.id.desc()).limit(limit)
+        with self.engine.connect() as connection:
+            rows = connection.execute(query).fetchall()
+        return [dict(row._mapping) if hasattr(row, '_mapping') else dict(row) for row in rows]
+
+    def score_summary(self, group_by='contract_type', **filters):
+        """Aggregate the applications and their predictions
+
+        Args:
+            group_by (str): column to group by: 'contract_type', 'income_type' or 'pred_class'
+            **filters: the same filters as `recent_applications`
+
+        Returns:
+            summary (:obj:`list` of dict): for every group, the number of applications,
+                the number of scored ones, the mean predicted probability in percent and
+                the number predicted likely delinquent
+
+        """
+        table = Application.__table__
+        if group_by not in ('contract_type', 'income_type', 'pred_class'):
+            logger.error('Cannot group applications by %s', group_by)
+            raise ValueError('Unsupported group by column: %s' % group_by)
+        key = table.c[group_by]
+        query = _select(key,
+                        sqlalchemy.func.count().label('n_applications'),
+                        sqlalchemy.func.count(table.c.pred_prob).label('n_scored'),
+                        sqlalchemy.func.avg(table.c.pred_prob).label('mean_pred_prob'),
+                        sqlalchemy.func.sum(table.c.pred_class).label('n_pred_delinquent'))
+        conditions = self._filters(**filters)
+        if conditions:
+            query = query.where(sqlalchemy.and_(*conditions))
+        query = query.group_by(key).order_by(key)
+        with self.engine.connect() as connection:
+            rows = connection.execute(query).fetchall()
+        return [dict(row._mapping) if hasattr(row, '_mapping') else dict(row) for row in rows]
+
     def add_application(self, contract_type: str,
                         gender: str, own_car: str, own_realty: str,
                         num_children: int, income_total: float,
@@ -102,9 +796,14 @@ class ApplicationManager:
                         age: int, years_employed: int,
                         years_id_publish: int, phone_contactable: str,
                         cnt_family_members: int, amt_req_credit_bureau_day: int,
-                        employed: str):
+                        employed: str, pred_prob: float = None, pred_class: int = None):
         """Seeds an existing database with additional applications.
 
+        With a write-behind queue, the application is only spooled and queued here,
+        and it is inserted in bulk by the queue's background thread. Numerical values are
+        converted to the types of their columns first (see `coerce_row`), so a malformed
+        value raises a ValueError instead of being queued.
+
         Args:
             contract_type (str): Identification if loan is cash or revolving
             gender (str): Gender of the client
@@ -128,32 +827,45 @@ class ApplicationManager:
             amt_req_credit_bureau_day (int): Number of enquiries to
                 Credit Bureau about the client
             employed (str): Whether the applicant is employed
+            pred_prob (float): predicted probability of loan delinquency in percent
+                (optional, default = None if the applicant was not scored)
+            pred_class (int): predicted class, 1 if likely delinquent
+                (optional, default = None if the applicant was not scored)
 
         Returns:
             None
 
         """
+        row = dict(created_at=_utcnow(),
+                   contract_type=contract_type,
+                   gender=gender,
+                   own_car=own_car,
+                   own_realty=own_realty,
+                   num_children=num_children,
+                   income_total=income_total,
+                   amt_credit=amt_credit,
+                   amt_annuity=amt_annuity,
+                   amt_goods_price=amt_goods_price,
+                   income_type=income_type,
+                   edu_type=edu_type,
+                   family_status=family_status,
+                   Age=age,
+                   Years_Employed=years_employed,
+                   Years_ID_Publish=years_id_publish,
+                   phone_contactable=phone_contactable,
+                   cnt_family_members=cnt_family_members,
+                   amt_req_credit_bureau_day=amt_req_credit_bureau_day,
+                   Employed=employed,
+                   pred_prob=pred_prob,
+                   pred_class=pred_class)
+        coerce_row(row)
+        if self.writer is not None:
+            self.writer.submit(row)
+            logger.debug("A new customer queued for the database")
+            return
         try:
             session = self.session
-            applicant = Application(contract_type=contract_type,
-                                    gender=gender,
-                                    own_car=own_car,
-                                    own_realty=own_realty,
-                                    num_children=num_children,
-                                    income_total=income_total,
-                                    amt_credit=amt_credit,
-                                    amt_annuity=amt_annuity,
-                                    amt_goods_price=amt_goods_price,
-                                    income_type=income_type,
-                                    edu_type=edu_type,
-                                    family_status=family_status,
-                                    Age=age,
-                                    Years_Employed=years_employed,
-                                    Years_ID_Publish=years_id_publish,
-                                    phone_contactable=phone_contactable,
-                                    cnt_family_members=cnt_family_members,
-                                    amt_req_credit_bureau_day=amt_req_credit_bureau_day,
-                                    Employed=employed)
+            applicant = Application(**row)
             session.add(applicant)
             session.commit()
             logger.info("A new customer added to the database")
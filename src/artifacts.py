@@ -0,0 +1,223 @@
+"""
+This module contains multiple functions that offers
+saving and loading functionality for intermediate pipeline artifacts
+"""
+import json
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+FORMATS = {'.csv': 'csv', '.parquet': 'parquet', '.feather': 'feather', '.npz': 'npz'}
+
+
+def artifact_format(path):
+    """Get the artifact format from the extension of a path
+
+    Args:
+        path (str): path to the artifact, ending in .csv, .parquet, .feather or .npz
+
+    Returns:
+        fmt (str): one of 'csv', 'parquet', 'feather' or 'npz'
+
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in FORMATS:
+        logger.error('Artifact extension %s is not supported, use one of %s', ext, list(FORMATS))
+        raise ValueError('Unsupported artifact extension: %s' % ext)
+    return FORMATS[ext]
+
+
+def _require_pyarrow(fmt):
+    """Raise an informative ImportError if pyarrow is not installed"""
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        logger.error('Saving or loading %s artifacts requires pyarrow; '
+                     'install it or use a .npz artifact instead', fmt)
+        raise
+
+
+def _save_npz(df, path):
+    """Save a DataFrame column by column into a compressed NumPy archive
+
+    String and categorical columns are stored as integer codes plus their distinct
+    values, so that the archive never needs pickled objects.
+    """
+    arrays = {}
+    meta = []
+    for i, col in enumerate(df.columns):
+        series = df[col]
+        key = 'col_%i' % i
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            arrays[key + '_codes'] = series.cat.codes.to_numpy()
+            categories = series.cat.categories
+            if categories.dtype == object or pd.api.types.is_string_dtype(categories.dtype):
+                arrays[key + '_values'] = np.asarray(categories, dtype=str)
+            else:
+                arrays[key + '_values'] = categories.to_numpy()
+            meta.append({'name': col, 'kind': 'categorical', 'ordered': series.cat.ordered})
+        elif series.dtype == object or pd.api.types.is_string_dtype(series.dtype):
+            if pd.api.types.infer_dtype(series, skipna=True) not in ('string', 'empty'):
+                logger.error('Column %s mixes strings with other objects and '
+                             'cannot be saved to a .npz artifact', col)
+                raise ValueError('Column %s cannot be saved to a .npz artifact' % col)
+            codes, uniques = pd.factorize(series)
+            arrays[key + '_codes'] = codes
+            arrays[key + '_values'] = np.asarray(uniques, dtype=str)
+            meta.append({'name': col, 'kind': 'object', 'dtype': str(series.dtype)})
+        else:
+            arrays[key] = series.to_numpy()
+            meta.append({'name': col, 'kind': 'values'})
+    arrays['__meta__'] = np.array(json.dumps(meta))
+    np.savez_compressed(path, **arrays)
+
+
+def _load_npz(path):
+    """Load a DataFrame saved by `_save_npz`"""
+    with np.load(path, allow_pickle=False) as archive:
+        meta = json.loads(str(archive['__meta__']))
+        columns = {}
+        for i, info in enumerate(meta):
+            key = 'col_%i' % i
+            if info['kind'] == 'values':
+                columns[info['name']] = archive[key]
+                continue
+            codes = archive[key + '_codes']
+            values = archive[key + '_values']
+            if info['kind'] == 'categorical':
+                columns[info['name']] = pd.Categorical.from_codes(codes, values.tolist(),
+                                                                  ordered=info['ordered'])
+            else:
+                decoded = np.asarray(values, dtype=object)[codes]
+                decoded[codes == -1] = np.nan
+                columns[info['name']] = pd.Series(decoded, dtype=object).astype(info['dtype'])
+    return pd.DataFrame(columns)
+
+
+def save_artifact(df, path):
+    """Save an intermediate DataFrame in the format given by the file extension
+
+    Args:
+        df (:obj:`DataFrame <pandas.DataFrame>`): the DataFrame to save; the index is not saved
+        path (str): path to save to; '.csv' for text, '.parquet' or '.feather' for compressed
+            columnar files (require pyarrow), '.npz' for a compressed NumPy archive
+
+    Returns:
+        None
+
+    """
+    fmt = artifact_format(path)
+    if fmt == 'csv':
+        df.to_csv(path, index=False)
+    elif fmt == 'parquet':
+        _require_pyarrow(fmt)
+        df.to_parquet(path, index=False)
+    elif fmt == 'feather':
+        _require_pyarrow(fmt)
+        df.reset_index(drop=True).to_feather(path)
+    else:
+        _save_npz(df, path)
+    logger.info("Artifact saved to %s", path)
+
+
+def load_artifact(path):
+    """Load an intermediate DataFrame in the format given by the file extension
+
+    Args:
+        path (str): path of an artifact saved by `save_artifact` (or any CSV file)
+
+    Returns:
+        df (:obj:`DataFrame <pandas.DataFrame>`): the loaded DataFrame
+
+    """
+    fmt = artifact_format(path)
+    if fmt == 'csv':
+        df = pd.read_csv(path)
+    elif fmt == 'parquet':
+        _require_pyarrow(fmt)
+        df = pd.read_parquet(path)
+    elif fmt == 'feather':
+        _require_pyarrow(fmt)
+        df = pd.read_feather(path)
+    else:
+        df = _load_npz(path)
+    logger.info("Artifact loaded from %s", path)
+    return df
+
+
+class ArtifactWriter:
+    """Append DataFrames chunk by chunk to an artifact in the format given by the file extension
+
+    CSV and Parquet artifacts are appended to on disk, so memory is bounded by the chunk
+    size. Feather and NumPy artifacts cannot be appended to; their chunks are collected
+    and written once when the writer is closed.
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+            path (str): path of the artifact to write
+        """
+        self.path = path
+        self.fmt = artifact_format(path)
+        self.n_rows = 0
+        self._parquet_writer = None
+        self._chunks = []
+        if self.fmt in ('parquet', 'feather'):
+            _require_pyarrow(self.fmt)
+        if self.fmt in ('feather', 'npz'):
+            logger.warning('%s artifacts cannot be appended to, chunks are kept in memory '
+                           'until %s is closed', self.fmt, path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, df):
+        """Append a chunk to the artifact
+
+        Args:
+            df (:obj:`DataFrame <pandas.DataFrame>`): the chunk to append; the index is not saved
+
+        Returns:
+            None
+
+        """
+        if self.fmt == 'csv':
+            df.to_csv(self.path, index=False, mode='w' if self.n_rows == 0 else 'a',
+                      header=self.n_rows == 0)
+        elif self.fmt == 'parquet':
+            import pyarrow
+            import pyarrow.parquet
+            if self._parquet_writer is None:
+                table = pyarrow.Table.from_pandas(df, preserve_index=False)
+                self._parquet_writer = pyarrow.parquet.ParquetWriter(self.path, table.schema)
+            else:
+                table = pyarrow.Table.from_pandas(df, schema=self._parquet_writer.schema,
+                                                  preserve_index=False)
+            self._parquet_writer.write_table(table)
+        else:
+            self._chunks.append(df)
+        self.n_rows += len(df)
+        logger.debug('%i rows written to %s', self.n_rows, self.path)
+
+    def close(self):
+        """Finish writing the artifact
+
+        Returns:
+            None
+
+        """
+        if self._parquet_writer is not None:
+            self._parquet_writer.close()
+            self._parquet_writer = None
+        elif self._chunks:
+            save_artifact(pd.concat(self._chunks, ignore_index=True), self.path)
+            self._chunks = []
+        logger.info("%i rows saved to %s", self.n_rows, self.path)
@@ -0,0 +1,204 @@
+"""
+This module contains multiple functions that offers
+caching functionality for the outputs of the model pipeline stages
+"""
+import hashlib
+import inspect
+import json
+import logging
+import os
+
+import joblib
+import pandas as pd
+
+from src.artifacts import load_artifact, save_artifact
+
+logger = logging.getLogger(__name__)
+
+
+def hash_file(path, block_size=1 << 20):
+    """Compute the SHA-256 hash of the content of a file
+
+    Args:
+        path (str): path to the file
+        block_size (int): number of bytes read at a time
+
+    Returns:
+        str: hexadecimal digest
+
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def hash_dataframe(df):
+    """Compute a hash of the content, columns and dtypes of a DataFrame
+
+    Args:
+        df (:obj:`DataFrame <pandas.DataFrame>`): the DataFrame to hash
+
+    Returns:
+        str: hexadecimal digest
+
+    """
+    digest = hashlib.sha256()
+    digest.update(json.dumps([[str(col), str(dtype)] for col, dtype in df.dtypes.items()])
+                  .encode())
+    digest.update(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def code_version(*modules):
+    """Compute a hash of the source code of the modules that implement a stage
+
+    Args:
+        *modules (module): the modules whose source code defines the stage
+
+    Returns:
+        str: hexadecimal digest
+
+    """
+    digest = hashlib.sha256()
+    for module in modules:
+        digest.update(inspect.getsource(module).encode())
+    return digest.hexdigest()
+
+
+class StageCache:
+    """Local directory of stage outputs addressed by a fingerprint of everything they depend on
+
+    A stage's fingerprint combines the stage name, the hash of its input, its configuration
+    sub-section and the version of its code. DataFrames are stored as .npz artifacts and any
+    other output with joblib. When the directory grows over `max_size_mb`, the least recently
+    used entries are evicted.
+    """
+
+    def __init__(self, cache_dir, max_size_mb):
+        """
+        Args:
+            cache_dir (str): directory holding the cached outputs
+            max_size_mb (float): maximum total size of the cached outputs in megabytes
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = int(max_size_mb * 1024 * 1024)
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def fingerprint(stage, input_hash, params, code):
+        """Compute the fingerprint of a stage run
+
+        Args:
+            stage (str): name of the stage
+            input_hash (str): hash of the stage's input
+            params (dict): configuration sub-section of the stage
+            code (str): version of the stage's code, e.g. from `code_version`
+
+        Returns:
+            str: hexadecimal digest
+
+        """
+        payload = json.dumps([stage, input_hash, params, code], sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def _entry(self, key):
+        """Return the path of the cached output for a fingerprint, or None if missing"""
+        for ext in ('.npz', '.joblib'):
+            path = os.path.join(self.cache_dir, key + ext)
+            if os.path.exists(path):
+                return path
+        return None
+
+    def get(self, key):
+        """Get a cached stage output
+
+        Args:
+            key (str): fingerprint of the stage run
+
+        Returns:
+            tuple of (bool, object): whether the output was found, and the output itself
+
+        """
+        path = self._entry(key)
+        if path is None:
+            return False, None
+        # mark the entry as recently used for eviction
+        os.utime(path)
+        if path.endswith('.npz'):
+            return True, load_artifact(path)
+        return True, joblib.load(path)
+
+    def put(self, key, output):
+        """Store a stage output and evict old entries if the cache is over its size limit
+
+        Args:
+            key (str): fingerprint of the stage run
+            output: DataFrame or any object that can be dumped with joblib
+
+        Returns:
+            None
+
+        """
+        ext = '.npz' if isinstance(output, pd.DataFrame) else '.joblib'
+        path = os.path.join(self.cache_dir, key + ext)
+        tmp_path = os.path.join(self.cache_dir, '%s.tmp-%i%s' % (key, os.getpid(), ext))
+        try:
+            if ext == '.npz':
+                save_artifact(output, tmp_path)
+            else:
+                joblib.dump(output, tmp_path)
+        except ValueError:
+            logger.warning('Stage output cannot be cached, continuing without cache')
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries until the cache fits in its size limit
+
+        Returns:
+            None
+
+        """
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if os.path.isfile(path) and '.tmp-' not in name:
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(path)
+            total -= size
+            logger.info('Evicted %s from the stage cache', path)
+
+    def run(self, stage, input_hash, params, code, func, *args):
+        """Run a stage through the cache
+
+        Args:
+            stage (str): name of the stage
+            input_hash (str): hash of the stage's input
+            params (dict): configuration sub-section of the stage
+            code (str): version of the stage's code
+            func (callable): the stage itself, called as func(*args) on a cache miss
+            *args: arguments of the stage
+
+        Returns:
+            tuple of (object, str): the stage output and its fingerprint, which can be used
+                as the input hash of the next stage
+
+        """
+        key = self.fingerprint(stage, input_hash, params, code)
+        found, output = self.get(key)
+        if found:
+            logger.info('Stage %s loaded from cache (%s)', stage, key[:12])
+            return output, key
+        output = func(*args)
+        self.put(key, output)
+        return output, key
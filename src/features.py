@@ -7,6 +7,8 @@ import logging
 import pandas as pd
 import numpy as np
 
+from src.instrument import instrument
+
 logger = logging.getLogger(__name__)
 
 pd.options.mode.chained_assignment = None
@@ -28,7 +30,7 @@ def day_to_year(df, new_cols_dict):
 
     """
     for key, value in new_cols_dict.items():
-        df.loc[:, key] = df[value].apply(lambda x: np.round(x/365))
+        df[key] = np.round(df[value] / 365)
         logger.info('New column %s created based on original column %s', key, value)
     return df
 
@@ -45,11 +47,14 @@ def create_new_col(df, old_col, new_col):
         df (:obj:`DataFrame <pandas.DataFrame>`): a resulting DataFrame with the new column created
 
     """
-    df.loc[:, new_col] = ['Yes' if i >= 0 else 'No' for i in df[old_col]]
+    # index into the two labels with the boolean mask instead of building strings per row
+    labels = np.array(['No', 'Yes'], dtype=object)
+    df[new_col] = labels[(df[old_col] >= 0).to_numpy().astype(np.intp)]
     logger.info('New column %s created based on original column %s', new_col, old_col)
     return df
 
 
+@instrument()
 def featurize(df, dty_cols_dict, old_col, new_col):
     """Generate new features with the given DataFrame
 
@@ -75,6 +80,7 @@ def featurize(df, dty_cols_dict, old_col, new_col):
     return df_featurized
 
 
+@instrument()
 def get_ohe_data(df, cat_vars, num_vars, target_col):
     """One Hot Encode categorical variables in a DataFrame to prepare for modeling
 
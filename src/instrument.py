@@ -0,0 +1,274 @@
+"""
+This module contains multiple functions that offers
+timing and memory instrumentation for the stages of the model pipeline
+"""
+import collections
+import datetime
+import functools
+import inspect
+import json
+import logging
+import os
+import resource
+import sys
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# ru_maxrss is in bytes on macOS and in kilobytes on Linux
+_MAXRSS_UNIT = 1 if sys.platform == 'darwin' else 1024
+
+
+def _read_status():
+    """Read the current and peak resident set size of this process in bytes from /proc
+
+    Returns:
+        tuple of (int, int): current and peak resident set size, or None on systems
+            without /proc
+    """
+    try:
+        with open('/proc/self/status') as f:
+            fields = dict(line.split(':', 1) for line in f if line.startswith('Vm'))
+        return (int(fields['VmRSS'].split()[0]) * 1024, int(fields['VmHWM'].split()[0]) * 1024)
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def _reset_peak():
+    """Reset the peak resident set size of this process to its current size (Linux only)
+
+    Returns:
+        bool: whether the peak was reset
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def _max_rss():
+    """Peak resident set size of this process in bytes since it started"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * _MAXRSS_UNIT
+
+
+def count_rows(obj):
+    """Count the rows of a DataFrame, array or stage output
+
+    For a list or tuple, e.g. the [rf, X_test, y_test] output of `train_model`, the rows of
+    its first element that has a shape are counted.
+
+    Args:
+        obj: a DataFrame, Series, NumPy array, list or tuple of them, or any other object
+
+    Returns:
+        int: the number of rows, or None if `obj` has no rows
+    """
+    if isinstance(obj, (list, tuple)):
+        obj = next((item for item in obj if hasattr(item, 'shape')), None)
+    shape = getattr(obj, 'shape', None)
+    if shape:
+        return int(shape[0])
+    return None
+
+
+class RunSummary:
+    """Collects the measurements of the stages of one run and writes them to a JSON file
+
+    Totals per stage name cover every measurement, but only the last `max_records`
+    measurements are kept one by one, so a long-running process does not grow without bound.
+    """
+
+    def __init__(self, max_records=1000):
+        """
+        Args:
+            max_records (int): number of stage measurements kept one by one
+        """
+        self.max_records = max_records
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Forget the measurements recorded so far and restart the run clock
+
+        Returns:
+            None
+
+        """
+        with self.lock:
+            self.records = collections.deque(maxlen=self.max_records)
+            self.totals = {}
+            self.peak_rss_mb = 0.0
+            self.started_at = datetime.datetime.now(datetime.timezone.utc).isoformat()
+            self.start_wall = time.perf_counter()
+            self.start_cpu = time.process_time()
+
+    def add(self, record):
+        """Record the measurements of a stage
+
+        Args:
+            record (dict): the measurements of the stage, as produced by `StageMeter`
+
+        Returns:
+            None
+
+        """
+        with self.lock:
+            self.records.append(record)
+            self.peak_rss_mb = max(self.peak_rss_mb, record['peak_rss_mb'])
+            total = self.totals.setdefault(record['stage'], {
+                'calls': 0, 'wall_s': 0.0, 'cpu_s': 0.0, 'rows_in': 0, 'rows_out': 0,
+                'peak_delta_mb': 0.0})
+            total['calls'] += 1
+            total['wall_s'] += record['wall_s']
+            total['cpu_s'] += record['cpu_s']
+            total['rows_in'] += record['rows_in'] or 0
+            total['rows_out'] += record['rows_out'] or 0
+            total['peak_delta_mb'] = max(total['peak_delta_mb'], record['peak_delta_mb'])
+
+    def summary(self, **info):
+        """Summarize the run: every stage record and totals per stage name
+
+        Args:
+            **info: extra fields describing the run, e.g. the pipeline step
+
+        Returns:
+            dict: the run summary
+        """
+        with self.lock:
+            records = list(self.records)
+            totals = {stage: dict(total) for stage, total in self.totals.items()}
+            # resetting the peak of a stage also resets the peak of the process
+            max_rss_mb = max(self.peak_rss_mb, _max_rss() / 2 ** 20)
+        return dict(info, started_at=self.started_at,
+                    wall_s=time.perf_counter() - self.start_wall,
+                    cpu_s=time.process_time() - self.start_cpu,
+                    max_rss_mb=max_rss_mb, totals=totals, stages=records)
+
+    def write(self, path, **info):
+        """Write the run summary to a JSON file
+
+        Args:
+            path (str): path of the JSON file, e.g. next to the evaluation results
+            **info: extra fields describing the run, e.g. the pipeline step
+
+        Returns:
+            dict: the run summary
+        """
+        summary = self.summary(**info)
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(summary, f, indent=2)
+        logger.info('Run summary saved to %s', path)
+        return summary
+
+
+# measurements of the current process, written out by run.py at the end of a pipeline step
+run_summary = RunSummary()
+_local = threading.local()
+
+
+class StageMeter:
+    """Context manager measuring the wall time, CPU time, peak memory and rows of a stage
+
+    The peak memory delta is how far the resident set size of the process rose above its
+    size at the start of the stage. On Linux, the peak is reset at the start of every stage
+    (through /proc/self/clear_refs), so it is the stage's own peak; elsewhere, it is how far
+    the stage raised the peak of the whole process. Measurements cost a few system calls,
+    so stages can be measured in production. On exit, the measurements are logged as one
+    JSON object and added to `run_summary`.
+
+    Example:
+        with StageMeter('clean', rows_in=len(df)) as stage:
+            cleaned = clean(df, **conf)
+            stage.rows_out = len(cleaned)
+    """
+
+    def __init__(self, stage, rows_in=None, summary=None):
+        """
+        Args:
+            stage (str): name of the stage
+            rows_in (int): number of rows the stage reads (optional, default = None)
+            summary (:obj:`RunSummary`): where to record the measurements
+                (optional, default = None for `run_summary`)
+        """
+        self.stage = stage
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.summary = run_summary if summary is None else summary
+        self.record = None
+
+    def __enter__(self):
+        stack = getattr(_local, 'stack', None)
+        if stack is None:
+            stack = _local.stack = []
+        status = _read_status()
+        # the peak reached so far belongs to the enclosing stage before it is reset
+        if stack and status is not None:
+            stack[-1].child_peak = max(stack[-1].child_peak, status[1])
+        self.exact = status is not None and _reset_peak()
+        self.rss_start = status[0] if status is not None else None
+        self.max_rss_start = _max_rss()
+        self.child_peak = 0
+        stack.append(self)
+        self.start_cpu = time.process_time()
+        self.start_wall = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        wall = time.perf_counter() - self.start_wall
+        cpu = time.process_time() - self.start_cpu
+        _local.stack.pop()
+        if self.exact:
+            peak = max(_read_status()[1], self.child_peak)
+            peak_delta = max(0, peak - self.rss_start)
+            if _local.stack:
+                _local.stack[-1].child_peak = max(_local.stack[-1].child_peak, peak)
+        else:
+            peak = _max_rss()
+            peak_delta = max(0, peak - self.max_rss_start)
+
+        # stages that read no DataFrame, like import_data, are rated on the rows they produce
+        rows = self.rows_in or self.rows_out
+        self.record = {'stage': self.stage, 'status': 'ok' if exc_type is None else 'error',
+                       'wall_s': wall, 'cpu_s': cpu, 'peak_rss_mb': peak / 2 ** 20,
+                       'peak_delta_mb': peak_delta / 2 ** 20,
+                       'rows_in': self.rows_in, 'rows_out': self.rows_out,
+                       'rows_per_sec': rows / wall if rows and wall > 0 else None}
+        logger.info(json.dumps(self.record))
+        self.summary.add(self.record)
+        return False
+
+
+def instrument(stage=None, rows_arg=None):
+    """Decorate a pipeline function to measure every call to it with `StageMeter`
+
+    The rows in are counted on one argument and the rows out on the return value
+    with `count_rows`.
+
+    Args:
+        stage (str): name of the stage (optional, default = None for the function name)
+        rows_arg (str): name of the argument holding the input rows
+            (optional, default = None for the first argument)
+
+    Returns:
+        callable: the decorator
+    """
+    def decorator(func):
+        name = stage or func.__name__
+        signature = inspect.signature(func)
+        arg = rows_arg or next(iter(signature.parameters))
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            rows_in = count_rows(signature.bind_partial(*args, **kwargs).arguments.get(arg))
+            with StageMeter(name, rows_in=rows_in) as record:
+                output = func(*args, **kwargs)
+                record.rows_out = count_rows(output)
+            return output
+        return wrapper
+    return decorator
@@ -0,0 +1,251 @@
+"""
+This module contains multiple functions that offers
+in-process counters and latency histograms exposed in the Prometheus text format
+"""
+import bisect
+import logging
+import math
+import threading
+
+logger = logging.getLogger(__name__)
+
+# content type of the Prometheus text exposition format
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# upper bounds in seconds of the latency histogram buckets, from 1 ms to 10 s
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_value(value):
+    """Format a sample value the way Prometheus parses it"""
+    if value == math.inf:
+        return '+Inf'
+    if value == -math.inf:
+        return '-Inf'
+    if isinstance(value, bool):
+        value = int(value)
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _format_labels(labels):
+    """Format a dict of labels as {name="value",...}, escaping the values"""
+    if not labels:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (name, str(value).replace('\\', r'\\').replace('"', r'\"')
+                     .replace('\n', r'\n'))
+        for name, value in labels.items())
+
+
+class _Metric:
+    """Base class of the metrics: a name, a help text and label names"""
+
+    metric_type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        """Return the label values in the order of the label names"""
+        if set(labels) != set(self.labelnames):
+            raise ValueError('Metric %s expects the labels %s, got %s'
+                             % (self.name, self.labelnames, tuple(labels)))
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self):
+        """Return the samples of the metric as (suffix, labels, value) tuples"""
+        raise NotImplementedError
+
+    def render(self):
+        """Render the metric in the Prometheus text format
+
+        Returns:
+            str: the HELP and TYPE lines followed by one line per sample
+
+        """
+        lines = ['# HELP %s %s' % (self.name, self.documentation.replace('\n', ' ')),
+                 '# TYPE %s %s' % (self.name, self.metric_type)]
+        for suffix, labels, value in self.samples():
+            lines.append('%s%s%s %s' % (self.name, suffix, _format_labels(labels),
+                                        _format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+
+class Counter(_Metric):
+    """Monotonic counter, e.g. of requests handled, with one value per combination of labels"""
+
+    metric_type = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        """Increase the counter
+
+        Args:
+            amount (float): how much to add; must not be negative
+            **labels: the value of every label of the counter
+
+        Returns:
+            None
+
+        """
+        if amount < 0:
+            raise ValueError('Counter %s can only increase' % self.name)
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        """Get the current value of the counter for some labels"""
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return [('', dict(zip(self.labelnames, key)), value) for key, value in values]
+
+
+class Histogram(_Metric):
+    """Distribution of observed values, e.g. latencies, counted in cumulative buckets
+
+    Tail latencies are estimated from the buckets, e.g. with `histogram_quantile(0.99, ...)`
+    in Prometheus.
+    """
+
+    metric_type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}
+
+    def observe(self, value, **labels):
+        """Count an observed value in its bucket
+
+        Args:
+            value (float): the observed value, e.g. a duration in seconds
+            **labels: the value of every label of the histogram
+
+        Returns:
+            None
+
+        """
+        key = self._key(labels)
+        # a value equal to an upper bound belongs to that bucket
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(key, (None, 0.0))
+            if counts is None:
+                counts = [0] * (len(self.buckets) + 1)
+            counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    def samples(self):
+        with self._lock:
+            values = sorted((key, list(counts), total)
+                            for key, (counts, total) in self._values.items())
+        samples = []
+        for key, counts, total in values:
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                samples.append(('_bucket', dict(labels, le=_format_value(bound)), cumulative))
+            samples.append(('_sum', labels, total))
+            samples.append(('_count', labels, cumulative))
+        return samples
+
+
+class CallbackMetric(_Metric):
+    """Metric whose samples are read from the application when the metrics are rendered
+
+    It exposes values kept elsewhere, e.g. the counters of the prediction cache or the state
+    of the connection pool, without updating them on every change.
+    """
+
+    def __init__(self, name, documentation, func, metric_type='gauge'):
+        """
+        Args:
+            name (str): name of the metric
+            documentation (str): help text of the metric
+            func (callable): returns the value of the metric, or a list of (labels, value)
+                tuples with a dict of labels per value; None or an empty list renders no sample
+            metric_type (str): 'gauge' for a value that goes up and down, or 'counter'
+        """
+        super().__init__(name, documentation)
+        self.func = func
+        self.metric_type = metric_type
+
+    def samples(self):
+        values = self.func()
+        if values is None:
+            return []
+        if not isinstance(values, list):
+            values = [({}, values)]
+        return [('', labels, value) for labels, value in values if value is not None]
+
+
+class MetricsRegistry:
+    """Collection of metrics rendered together in the Prometheus text format
+
+    Metrics are kept in the memory of the process, so when the app runs as several worker
+    processes, each worker reports its own metrics.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        """Add a metric to the registry
+
+        Args:
+            metric: the metric; its name must be unique in the registry
+
+        Returns:
+            the metric
+
+        """
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError('Metric %s is already registered' % metric.name)
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        """Create and register a `Counter`"""
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        """Create and register a `Histogram`"""
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def callback(self, name, documentation, func, metric_type='gauge'):
+        """Create and register a `CallbackMetric`"""
+        return self.register(CallbackMetric(name, documentation, func, metric_type))
+
+    def render(self):
+        """Render all metrics in the Prometheus text format
+
+        A metric whose callback fails is left out, so that one broken source does not hide
+        the other metrics.
+
+        Returns:
+            str: the metrics, to be served with the CONTENT_TYPE content type
+
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        parts = []
+        for metric in metrics:
+            try:
+                parts.append(metric.render())
+            except Exception:
+                logger.exception('Not able to collect metric %s', metric.name)
+        return ''.join(parts)
@@ -2,19 +2,86 @@
 This module contains multiple functions that offers
 model training and model evaluation functionality
 """
+import copy
+import json
 import logging
+import os
 
+import numpy as np
 import pandas as pd
 import sklearn
 import sklearn.ensemble
+import sklearn.model_selection
 from imblearn.over_sampling import RandomOverSampler
 
+from src.instrument import instrument
+
 logger = logging.getLogger(__name__)
 
 
-def train_model(data, target_colname, sample_strat, ts, n_estimat, max_dep, rand_state):
+def get_sample_weight(y_train, sample_strat, resample, rand_state):
+    """ Weigh the training rows so that the minor class counts as if it was oversampled
+
+    No row is copied: with `resample` 'weight', every minor class row gets the same
+    fractional weight; with 'oversample', the rows a random oversampler would duplicate
+    are drawn by index and every row is weighted by the number of times it was drawn.
+
+    Args:
+        y_train (:obj:`ndarray <numpy.ndarray>`): the target of the training rows
+        sample_strat (float): ratio of the (weighted) minor class count to the major class
+            count after resampling
+        resample (str): 'weight' or 'oversample'
+        rand_state (int): set "random_state" to ensure reproducibility
+
+    Returns:
+        sample_weight (:obj:`ndarray <numpy.ndarray>`): one weight per training row
+
+    """
+    n_minor = int((y_train == 1).sum())
+    n_major = int((y_train == 0).sum())
+    if resample == 'weight':
+        sample_weight = np.ones(len(y_train))
+        if n_minor > 0:
+            sample_weight[y_train == 1] = max(1.0, sample_strat * n_major / n_minor)
+    elif resample == 'oversample':
+        # resample the row positions only, which costs one integer per row
+        positions = np.arange(len(y_train)).reshape(-1, 1)
+        oversample = RandomOverSampler(sampling_strategy=sample_strat, random_state=rand_state)
+        drawn, _ = oversample.fit_resample(positions, y_train)
+        sample_weight = np.bincount(drawn.ravel(), minlength=len(y_train)).astype(float)
+    else:
+        logger.error('Resampling %s is not supported, use "weight" or "oversample"', resample)
+        raise ValueError('Unsupported resampling: %s' % resample)
+    logger.info('Minor class weighted count: %0.1f', sample_weight[y_train == 1].sum())
+    return sample_weight
+
+
+def train_test_positions(target, ts, rand_state):
+    """ Split the row positions into train and test sets, stratified on the target
+
+    Args:
+        target (:obj:`ndarray <numpy.ndarray>`): the target of every row
+        ts (float): "test_size" argument for train test split
+        rand_state (int): set "random_state" to ensure reproducibility
+
+    Returns:
+        [train_idx, test_idx] (:obj:`list`): the positions of the training rows and of the
+            held out test rows
+
+    """
+    return sklearn.model_selection.train_test_split(np.arange(len(target)), test_size=ts,
+                                                    random_state=rand_state, stratify=target)
+
+
+@instrument()
+def train_model(data, target_colname, sample_strat, ts, n_estimat, max_dep, rand_state,
+                n_jobs=None, resample='weight', **rf_params):
     """ Build a Random Forest Classifier with the data and hyper parameters given
 
+    The data is split into train and test sets first, and the class imbalance is only
+    corrected on the training rows, with sample weights instead of duplicated rows, so that
+    the test set is an honest holdout and no copy of the oversampled data is held in memory.
+
     Args:
         data (:obj:`DataFrame <pandas.DataFrame>`): a dataframe of the cloud data
         target_colname (str): the name of the "target" column; default is "target"
@@ -28,6 +95,12 @@ def train_model(data, target_colname, sample_strat, ts, n_estimat, max_dep, rand
             default is 10 (specified in config.yaml)
         rand_state (int): set "random_state" to ensure reproducibility;
             default is 0 (specified in config.yaml)
+        n_jobs (int): number of cores used to grow the trees, -1 for all cores;
+            does not change the trained model for a fixed "random_state" (config.yaml)
+        resample (str): how the minor class of the training rows is oversampled, see
+            `get_sample_weight` (optional, default = 'weight')
+        **rf_params: other arguments of the random forest classifier, e.g. hyperparameters
+            picked by `tune_model` (optional)
 
     Returns:
         [rf, X_test, y_test] (:obj:`list`): the first object in the list is
@@ -37,51 +110,61 @@ def train_model(data, target_colname, sample_strat, ts, n_estimat, max_dep, rand
             we are classifying (target))
 
     """
-    features = data.drop([target_colname], axis=1)
-    target = data[[target_colname]].values.ravel()
+    x_cols = [i for i, col in enumerate(data.columns) if col != target_colname]
+    target = data[target_colname].to_numpy()
     logger.info('Target column name: %s', target_colname)
     logger.info('Minor class initial count: %i', target[target == 1].shape[0])
     logger.info('Major class initial count: %i', target[target == 0].shape[0])
 
-    # define oversampling strategy
-    oversample = RandomOverSampler(sampling_strategy=sample_strat, random_state=rand_state)
+    # train test split on row positions, so that the features are copied only once
+    train_idx, test_idx = train_test_positions(target, ts, rand_state)
+    X_train = data.iloc[train_idx, x_cols]
+    X_test = data.iloc[test_idx, x_cols]
+    y_train = target[train_idx]
+    y_test = target[test_idx]
 
-    # fit and apply the transform
-    X_over, y_over = oversample.fit_resample(features, target)
-    logger.info('Minor class oversampled count: %i', y_over[y_over == 1].shape[0])
-
-    # train test split
-    X_train, X_test, y_train, y_test = sklearn.model_selection.train_test_split(X_over,
-                                                                                y_over,
-                                                                                test_size=ts,
-                                                                                random_state=rand_state)
-    x_names = X_train.columns
+    # oversample the minor class of the training rows only
+    sample_weight = get_sample_weight(y_train, sample_strat, resample, rand_state)
 
     # random forest model
     rf = sklearn.ensemble.RandomForestClassifier(n_estimators=n_estimat,
                                                  max_depth=max_dep,
-                                                 random_state=rand_state)
-    rf.fit(X_train[x_names], y_train)
+                                                 random_state=rand_state,
+                                                 n_jobs=n_jobs,
+                                                 **rf_params)
+    rf.fit(X_train, y_train, sample_weight=sample_weight)
     logger.info('Random Forest Classifier successfully trained')
     return [rf, X_test, y_test]
 
 
-def evaluate(rf_model, X_test, y_test, save_path):
+@instrument(rows_arg='X_test')
+def evaluate(rf_model, X_test, y_test, save_path, n_jobs=None):
     """ Score the random forest model and evaluate the model performance
 
     Args:
         rf_model (:obj:`RandomForestClassifier`): trained random forest model object
         X_test(:obj:`DataFrame <pandas.DataFrame>`): the test dataframe to generate predictions on
         y_test(:obj:`Series <pandas.Series>`): the result series that we are classifying (target)
+        save_path (str): path to save the evaluation results to
+        n_jobs (int): number of cores used to score the test set, -1 for all cores
+            (optional, default = None to keep the setting the model was trained with)
 
     Returns:
         None
 
     """
-    # predict probability and class for each sample in the test set
+    if n_jobs is not None:
+        # a shallow copy with the new setting, so that the caller's model (which may be saved
+        # afterwards) keeps the setting it was trained with
+        rf_model = copy.copy(rf_model)
+        rf_model.n_jobs = n_jobs
+
+    # predict probability for each sample in the test set and derive the class from it,
+    # the same way RandomForestClassifier.predict does, instead of scoring the forest twice
     x_names = X_test.columns
-    ypred_proba_test = rf_model.predict_proba(X_test[x_names])[:, 1]
-    ypred_bin_test = rf_model.predict(X_test[x_names])
+    proba_test = rf_model.predict_proba(X_test[x_names])
+    ypred_proba_test = proba_test[:, 1]
+    ypred_bin_test = rf_model.classes_.take(np.argmax(proba_test, axis=1))
 
     # calculate metrics
     test_auc = sklearn.metrics.roc_auc_score(y_test, ypred_proba_test)
@@ -99,3 +182,72 @@ def evaluate(rf_model, X_test, y_test, save_path):
     except ValueError:
         logger.error("Failed to save the evaluation results because "
                      "the DataFrame of evaluation results cannot be appropriately called")
+
+
+@instrument()
+def export_forest(rf_model, save_dir):
+    """ Flatten a trained random forest into plain NumPy arrays for serving
+
+    The nodes of all trees are concatenated into one set of arrays (split feature,
+    threshold, children, normalized class probabilities), saved as .npy files that can be
+    loaded, or memory-mapped, without sklearn. The children of node i are stored at
+    2 * i (right) and 2 * i + 1 (left), so that scoring needs no copy of the arrays.
+    Leaves point to themselves, so that `FlatForest` in predict.py can walk every tree for
+    a fixed number of steps.
+
+    Args:
+        rf_model (:obj:`RandomForestClassifier`): trained random forest model object
+        save_dir (str): directory to save the arrays and their metadata (meta.json) to
+
+    Returns:
+        None
+
+    """
+    if rf_model.n_outputs_ != 1:
+        logger.error('Only random forests with a single target can be exported')
+        raise ValueError('Only random forests with a single target can be exported')
+
+    arrays = {'feature': [], 'threshold': [], 'children': [], 'value': []}
+    roots = []
+    offset = 0
+    max_depth = 0
+    for estimator in rf_model.estimators_:
+        tree = estimator.tree_
+        nodes = np.arange(tree.node_count)
+        is_leaf = tree.children_left == -1
+        arrays['feature'].append(np.where(is_leaf, 0, tree.feature))
+        arrays['threshold'].append(np.where(is_leaf, 0.0, tree.threshold))
+        left = np.where(is_leaf, nodes, tree.children_left) + offset
+        right = np.where(is_leaf, nodes, tree.children_right) + offset
+        arrays['children'].append(np.stack([right, left], axis=1).ravel())
+        # class counts (or fractions, depending on the sklearn version) to probabilities
+        value = tree.value[:, 0, :]
+        normalizer = value.sum(axis=1, keepdims=True)
+        normalizer[normalizer == 0.0] = 1.0
+        arrays['value'].append(value / normalizer)
+        roots.append(offset)
+        offset += tree.node_count
+        max_depth = max(max_depth, tree.max_depth)
+
+    os.makedirs(save_dir, exist_ok=True)
+    dtypes = {'feature': np.int64, 'threshold': np.float64, 'children': np.int64,
+              'value': np.float64}
+    arrays = {name: np.ascontiguousarray(np.concatenate(parts), dtype=dtypes[name])
+              for name, parts in arrays.items()}
+    arrays['roots'] = np.array(roots, dtype=np.int64)
+    # each file is replaced atomically and meta.json last, so that a server reloading
+    # the export never sees a mix of old and new arrays
+    for name, array in arrays.items():
+        tmp_path = os.path.join(save_dir, '%s.tmp-%i.npy' % (name, os.getpid()))
+        np.save(tmp_path, array)
+        os.replace(tmp_path, os.path.join(save_dir, name + '.npy'))
+    meta = {'n_features': int(rf_model.n_features_in_ if hasattr(rf_model, 'n_features_in_')
+                              else rf_model.n_features_),
+            'n_trees': len(roots), 'n_nodes': offset, 'max_depth': int(max_depth),
+            'classes': rf_model.classes_.tolist()}
+    tmp_path = os.path.join(save_dir, 'meta.tmp-%i.json' % os.getpid())
+    with open(tmp_path, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, os.path.join(save_dir, 'meta.json'))
+    logger.info('Random forest of %i trees and %i nodes exported to %s',
+                len(roots), offset, save_dir)
@@ -0,0 +1,162 @@
+"""
+This module contains multiple functions that offers
+the functionality to chain several stages of the model pipeline
+"""
+import logging
+
+import sklearn
+
+import src.acquire
+import src.features
+import src.model
+from src.acquire import import_data, import_data_chunks, clean
+from src.artifacts import ArtifactWriter, save_artifact
+from src.cache import code_version, hash_dataframe, hash_file
+from src.features import featurize, get_ohe_data
+from src.instrument import instrument
+from src.model import train_model, evaluate
+
+logger = logging.getLogger(__name__)
+
+
+@instrument()
+def stream_clean_featurize(conf, output_path):
+    """Clean and featurize the raw data chunk by chunk, appending every chunk to an artifact
+
+    Peak memory is bounded by the chunk size rather than by the size of the raw file.
+    The output holds the same rows as running the 'clean' step followed by `featurize`,
+    with only the renamed columns; one-hot encoding is left to the 'featurize' step
+    because it needs all categories.
+
+    Args:
+        conf (dict): the pipeline configuration loaded from config.yaml; uses
+            conf['acquire']['import_data'], conf['acquire']['stream'],
+            conf['acquire']['clean'] and conf['features']['featurize']
+        output_path (str): path of the output artifact; .csv and .parquet are appended
+            to on disk
+
+    Returns:
+        n_rows (int): number of cleaned rows written
+
+    """
+    chunks = import_data_chunks(colnames_dict=conf['acquire']['import_data']['colnames_dict'],
+                                path=conf['acquire']['import_data']['path'],
+                                **conf['acquire']['stream'])
+    with ArtifactWriter(output_path) as writer:
+        for i, chunk in enumerate(chunks):
+            cleaned = clean(chunk, **conf['acquire']['clean'])
+            writer.write(featurize(cleaned, **conf['features']['featurize']))
+            logger.info('Chunk %i cleaned and featurized', i)
+    return writer.n_rows
+
+
+def clean_stage(conf, cache=None):
+    """Import and clean the raw data, reusing the cached output if nothing it depends on changed
+
+    Args:
+        conf (dict): the pipeline configuration loaded from config.yaml
+        cache (:obj:`StageCache`): the stage cache (optional, default = None for no caching)
+
+    Returns:
+        tuple of (cleaned, key): the cleaned DataFrame and the stage fingerprint
+            (None without cache)
+
+    """
+    def compute():
+        return clean(import_data(**conf['acquire']['import_data']), **conf['acquire']['clean'])
+
+    if cache is None:
+        return compute(), None
+    # the raw file is identified by its content hash rather than by its path
+    params = {'colnames_dict': conf['acquire']['import_data']['colnames_dict'],
+              'clean': conf['acquire']['clean']}
+    return cache.run('clean', hash_file(conf['acquire']['import_data']['path']), params,
+                     code_version(src.acquire), compute)
+
+
+def featurize_stage(cleaned, conf, cache=None, input_hash=None):
+    """Generate new features and one-hot encode, reusing the cached output if possible
+
+    Args:
+        cleaned (:obj:`DataFrame <pandas.DataFrame>`): the cleaned data
+        conf (dict): the pipeline configuration loaded from config.yaml
+        cache (:obj:`StageCache`): the stage cache (optional, default = None for no caching)
+        input_hash (str): hash identifying `cleaned`, e.g. the fingerprint of the clean stage
+            (optional, default = None to hash the DataFrame)
+
+    Returns:
+        tuple of (featurized, key): the one-hot encoded DataFrame and the stage fingerprint
+            (None without cache)
+
+    """
+    def compute():
+        return get_ohe_data(featurize(cleaned, **conf['features']['featurize']),
+                            **conf['features']['get_ohe_data'])
+
+    if cache is None:
+        return compute(), None
+    if input_hash is None:
+        input_hash = hash_dataframe(cleaned)
+    return cache.run('featurize', input_hash, conf['features'], code_version(src.features),
+                     compute)
+
+
+def model_stage(featurized, conf, cache=None, input_hash=None):
+    """Train the model, reusing the cached model if nothing it depends on changed
+
+    Args:
+        featurized (:obj:`DataFrame <pandas.DataFrame>`): the one-hot encoded data
+        conf (dict): the pipeline configuration loaded from config.yaml
+        cache (:obj:`StageCache`): the stage cache (optional, default = None for no caching)
+        input_hash (str): hash identifying `featurized`, e.g. the fingerprint of the
+            featurize stage (optional, default = None to hash the DataFrame)
+
+    Returns:
+        tuple of ([rf, X_test, y_test], key): the output of `train_model` and the stage
+            fingerprint (None without cache)
+
+    """
+    def compute():
+        return train_model(featurized, **conf['model']['train_model'])
+
+    if cache is None:
+        return compute(), None
+    if input_hash is None:
+        input_hash = hash_dataframe(featurized)
+    # the number of cores does not change the trained model
+    params = {key: value for key, value in conf['model']['train_model'].items() if key != 'n_jobs'}
+    return cache.run('model', input_hash, params,
+                     code_version(src.model) + sklearn.__version__, compute)
+
+
+def run_all(conf, cleaned_path=None, featurized_path=None, cache=None):
+    """Run every stage of the model pipeline in one process, handing DataFrames between stages
+
+    Chains import_data, clean, featurize, get_ohe_data, train_model and evaluate without
+    writing or re-reading intermediate artifacts, unless their paths are given. With a
+    stage cache, a stage is skipped when its input, configuration and code are unchanged.
+
+    Args:
+        conf (dict): the pipeline configuration loaded from config.yaml
+        cleaned_path (str): path to also save the cleaned data to (optional, default = None)
+        featurized_path (str): path to also save the featurized data to
+            (optional, default = None)
+        cache (:obj:`StageCache`): the stage cache (optional, default = None for no caching)
+
+    Returns:
+        rf (:obj:`RandomForestClassifier`): the trained random forest model
+
+    """
+    cleaned, key = clean_stage(conf, cache)
+    if cleaned_path is not None:
+        save_artifact(cleaned, cleaned_path)
+
+    featurized, key = featurize_stage(cleaned, conf, cache, input_hash=key)
+    del cleaned
+    if featurized_path is not None:
+        save_artifact(featurized, featurized_path)
+
+    (rf, X_test, y_test), key = model_stage(featurized, conf, cache, input_hash=key)
+    evaluate(rf, X_test, y_test, **conf['model']['evaluate'])
+    logger.info('Model pipeline completed')
+    return rf
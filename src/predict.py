@@ -2,7 +2,16 @@
 This module contains multiple functions that offers
 user input transformation and prediction functionality
 """
+import copy
+import csv
+import hashlib
+import itertools
+import json
 import logging
+import os
+import threading
+import time
+from collections import OrderedDict, namedtuple
 
 import joblib
 import pandas as pd
@@ -10,6 +19,309 @@ import numpy as np
 
 logger = logging.getLogger(__name__)
 
+Prediction = namedtuple('Prediction', ['pred_prob', 'pred_bin', 'pred_class'])
+
+
+class FlatForest:
+    """Random forest scored from the flat NumPy arrays written by `export_forest` in model.py
+
+    Scoring only needs NumPy: all rows walk all trees at once, one tree level per step,
+    and the leaf probabilities are averaged over the trees like
+    `RandomForestClassifier.predict_proba`.
+    """
+
+    ARRAYS = ('feature', 'threshold', 'children', 'value', 'roots')
+
+    def __init__(self, feature, threshold, children, value, roots, max_depth, classes):
+        """
+        Args:
+            feature (:obj:`numpy.ndarray`): split feature of every node (0 for leaves)
+            threshold (:obj:`numpy.ndarray`): split threshold of every node
+            children (:obj:`numpy.ndarray`): right child of node i at 2 * i and left child
+                at 2 * i + 1 (the node itself for leaves)
+            value (:obj:`numpy.ndarray`): class probabilities of every node, one column per class
+            roots (:obj:`numpy.ndarray`): root node of every tree
+            max_depth (int): depth of the deepest tree
+            classes (:obj:`list`): the class labels, in the order of the columns of `value`
+        """
+        self.feature = feature
+        self.threshold = threshold
+        self.children = children
+        self.value = value
+        self.roots = roots
+        self.max_depth = max_depth
+        self.classes_ = np.asarray(classes)
+
+    @classmethod
+    def load(cls, save_dir, mmap_mode=None):
+        """Load a forest exported by `export_forest`
+
+        Args:
+            save_dir (str): the directory of the export
+            mmap_mode (str): None to read the arrays into memory, or 'r' to memory-map them
+                read-only, so that all processes scoring the same export share one copy
+                in the page cache (optional, default = None)
+
+        Returns:
+            :obj:`FlatForest`: the forest
+
+        """
+        with open(os.path.join(save_dir, 'meta.json')) as f:
+            meta = json.load(f)
+        arrays = {name: np.load(os.path.join(save_dir, name + '.npy'), mmap_mode=mmap_mode,
+                                allow_pickle=False)
+                  for name in cls.ARRAYS}
+        forest = cls(max_depth=meta['max_depth'], classes=meta['classes'], **arrays)
+        forest.n_features_in_ = meta['n_features']
+        return forest
+
+    def predict_proba(self, X):
+        """Predict class probabilities
+
+        Args:
+            X (:obj:`numpy.ndarray` or :obj:`DataFrame <pandas.DataFrame>`): feature rows,
+                with the columns in the order the forest was trained with
+
+        Returns:
+            proba (:obj:`numpy.ndarray`): array of shape (n_rows, n_classes)
+
+        """
+        # sklearn compares the features as float32 against float64 thresholds
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim != 2 or X.shape[1] != self.n_features_in_:
+            logger.error('Expected %i features, got an array of shape %s',
+                         self.n_features_in_, X.shape)
+            raise ValueError('Input does not match the features of the model')
+        # walk the trees with one row of nodes per tree, reading the features
+        # from the transposed input so that each level gathers from contiguous columns
+        n_rows = X.shape[0]
+        columns = np.ascontiguousarray(X.T).ravel()
+        rows = np.arange(n_rows)[np.newaxis, :]
+        node = np.repeat(self.roots[:, np.newaxis], n_rows, axis=1)
+        for _ in range(self.max_depth):
+            go_left = columns[self.feature[node] * n_rows + rows] <= self.threshold[node]
+            node = self.children[2 * node + go_left]
+        return self.value[node].sum(axis=0) / len(self.roots)
+
+
+class ModelRegistry:
+    """Keep trained models in memory so that they are unpickled only once per process
+
+    Models are keyed by their absolute path and the modification time and size of
+    the file on disk. When the file changes (e.g. a retrained model is saved to the
+    same path), the next lookup transparently reloads it. A directory is loaded as a
+    `FlatForest` export, whose meta.json file is written last and stands for the export.
+    A model loaded with a `mmap_mode` keeps that mode when it is reloaded. When a `.forest`
+    export does not exist (yet), the `.joblib` model it is exported from is loaded instead.
+    """
+
+    def __init__(self):
+        self._models = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _signature(model_path):
+        """Return the (mtime, size) signature of the model file; raises OSError if missing"""
+        if os.path.isdir(model_path):
+            model_path = os.path.join(model_path, 'meta.json')
+        stat = os.stat(model_path)
+        return stat.st_mtime_ns, stat.st_size
+
+    @staticmethod
+    def _resolve(model_path):
+        """Return the absolute path of the model to load, falling back from a missing
+        export, e.g. models/randomforest.forest, to models/randomforest.joblib"""
+        key = os.path.abspath(model_path)
+        if key.endswith('.forest') and not os.path.exists(key):
+            fallback = os.path.splitext(key)[0] + '.joblib'
+            if os.path.exists(fallback):
+                return fallback
+        return key
+
+    def get(self, model_path, mmap_mode=None):
+        """Return a warm model object for the given path, loading it if needed
+
+        Args:
+            model_path (str): the path to the trained model, or to the directory
+                of a forest exported by `export_forest`
+            mmap_mode (str): 'r' to memory-map the arrays of the model read-only instead of
+                reading them into memory (optional, default = None to keep the mode the
+                model was first loaded with)
+
+        Returns:
+            model: the deserialized model object
+
+        """
+        key = self._resolve(model_path)
+        signature = self._signature(key)
+        entry = self._models.get(key)
+        if entry is not None and entry[0] == signature and mmap_mode in (None, entry[2]):
+            return entry[1]
+
+        with self._lock:
+            # another thread may have loaded the model while we were waiting
+            entry = self._models.get(key)
+            if mmap_mode is None and entry is not None:
+                mmap_mode = entry[2]
+            if entry is None or entry[0] != signature or entry[2] != mmap_mode:
+                if os.path.isdir(key):
+                    model = FlatForest.load(key, mmap_mode=mmap_mode)
+                else:
+                    model = joblib.load(key, mmap_mode=mmap_mode)
+                self._models[key] = (signature, model, mmap_mode)
+                if entry is None:
+                    logger.info('Loaded model from %s', key)
+                else:
+                    logger.info('Model file %s changed on disk, reloaded', model_path)
+            return self._models[key][1]
+
+    def fingerprint(self, model_path):
+        """Return a string identifying the version of the model currently loaded from a path
+
+        Args:
+            model_path (str): the path to the trained model
+
+        Returns:
+            str: fingerprint built from the path, modification time and size of the model file
+
+        """
+        key = self._resolve(model_path)
+        self.get(key)
+        mtime, size = self._models[key][0]
+        return '%s:%d:%d' % (key, mtime, size)
+
+    def clear(self):
+        """Drop all loaded models
+
+        Returns:
+            None
+
+        """
+        with self._lock:
+            self._models.clear()
+
+
+model_registry = ModelRegistry()
+
+
+def load_model(model_path, mmap_mode=None):
+    """Get a trained model from the process-wide model registry
+
+    Args:
+        model_path (str): the path to the trained model
+        mmap_mode (str): 'r' to memory-map the arrays of the model read-only
+            (optional, default = None to keep the mode the model was first loaded with)
+
+    Returns:
+        model: the trained model, unpickled at most once per version of the file
+
+    """
+    return model_registry.get(model_path, mmap_mode=mmap_mode)
+
+
+class InputEncoder:
+    """One-hot encoder for user input, compiled once from the columns of the trained model
+
+    Every numerical column and every (categorical column, value) pair is mapped up front
+    to its position in `ohe_cols`, so encoding an applicant only fills slots of a
+    preallocated NumPy vector.
+    """
+
+    def __init__(self, cat_cols, ohe_cols):
+        """
+        Args:
+            cat_cols (:obj: `list`): a list of categorical columns in the initial input
+            ohe_cols (:obj: `list`): a list of required columns in the transformed user input
+        """
+        self.cat_cols = list(cat_cols)
+        self.ohe_cols = list(ohe_cols)
+        self._cat_set = frozenset(self.cat_cols)
+        self._num_slots = {}
+        self._cat_slots = {}
+        for slot, name in enumerate(self.ohe_cols):
+            for col in self.cat_cols:
+                if name.startswith(col + '_'):
+                    self._cat_slots[(col, name[len(col) + 1:])] = slot
+                    break
+            else:
+                self._num_slots[name] = slot
+        self._template = np.zeros(len(self.ohe_cols))
+
+    def fill(self, row, ui_dict):
+        """Write the encoded user input into an existing zeroed row
+
+        Args:
+            row (:obj:`numpy.ndarray`): 1-D float array of length len(ohe_cols)
+            ui_dict (dict): a dictionary of user input, collected from the app
+
+        Returns:
+            row (:obj:`numpy.ndarray`): the same array with the input encoded
+
+        """
+        for col, value in ui_dict.items():
+            if col in self._cat_set:
+                # categories dropped during one-hot encoding have no slot and stay all zero
+                slot = self._cat_slots.get((col, str(value)))
+                if slot is not None:
+                    row[slot] = 1.0
+            else:
+                slot = self._num_slots.get(col)
+                if slot is not None:
+                    row[slot] = float(value)
+        return row
+
+    def encode(self, ui_dict):
+        """Encode one applicant into a feature row for the trained model
+
+        Args:
+            ui_dict (dict): a dictionary of user input, collected from the app
+
+        Returns:
+            row (:obj:`numpy.ndarray`): float array of shape (1, len(ohe_cols))
+
+        """
+        if not isinstance(ui_dict, dict):
+            logger.error('User input must be a dictionary, got %s', type(ui_dict).__name__)
+            raise ValueError('User input must be a dictionary')
+        row = self.fill(self._template.copy(), ui_dict)
+        return row.reshape(1, -1)
+
+    def encode_batch(self, records):
+        """Encode many applicants into one feature matrix for the trained model
+
+        Args:
+            records (:obj:`list` of dict): user input records with the same keys as `encode`
+
+        Returns:
+            matrix (:obj:`numpy.ndarray`): float array of shape (len(records), len(ohe_cols))
+
+        """
+        matrix = np.zeros((len(records), len(self.ohe_cols)))
+        for row, ui_dict in zip(matrix, records):
+            self.fill(row, ui_dict)
+        return matrix
+
+
+_encoders = {}
+
+
+def get_encoder(cat_cols, ohe_cols):
+    """Get the compiled encoder for a column layout, compiling it on first use
+
+    Args:
+        cat_cols (:obj: `list`): a list of categorical columns in the initial input
+        ohe_cols (:obj: `list`): a list of required columns in the transformed user input
+
+    Returns:
+        :obj:`InputEncoder`: the compiled encoder
+
+    """
+    key = (tuple(cat_cols), tuple(ohe_cols))
+    encoder = _encoders.get(key)
+    if encoder is None:
+        encoder = _encoders.setdefault(key, InputEncoder(cat_cols, ohe_cols))
+    return encoder
+
 
 def transform_input(ui_dict, cat_cols, ohe_cols):
     """Transform the user input from the app to get predictions using the trained model
@@ -24,54 +336,271 @@ def transform_input(ui_dict, cat_cols, ohe_cols):
             stores the transformed user input
 
     """
-    # transform the user input into a pandas DataFrame
-    input_df = pd.DataFrame(ui_dict, index=[0])
-    logger.debug('Initial Input column names: %s', input_df.columns)
-
-    # change column names to match the one-hot-encoded column names
-    for col in cat_cols:
-        input_df = input_df.rename(columns={col: col + '_' + str(input_df[col].values[0])})
-
-    # change value to 1 to simulate one-hot encoded result
-    for col in input_df.columns:
-        if str.isdigit(str(input_df[col].values[0])):
-            pass
-        else:
-            input_df[col] = 1
-
-    # create an empty DataFrame with the required columns in the model
-    ohe_empty = pd.DataFrame(columns=ohe_cols)
-    input_new = ohe_empty.T.join(input_df.T).fillna(0).T
+    row = get_encoder(cat_cols, ohe_cols).encode(ui_dict)
+    input_new = pd.DataFrame(row, index=[0], columns=ohe_cols)
     logger.debug('Column names after all transformation steps: %s', input_new.columns)
     return input_new
 
 
-def get_prediction(input_ohe, model_path, ohe_cols):
+class PredictionCache:
+    """Bounded LRU cache of predictions with a time to live
+
+    A prediction only depends on the encoded applicant, the model and the threshold, so
+    entries are keyed on a hash of the encoded feature vector, the fingerprint of the
+    model file and the threshold. When the model fingerprint changes (the model file
+    was replaced and reloaded), all entries are dropped.
+    """
+
+    def __init__(self, max_size=10000, ttl=3600):
+        """
+        Args:
+            max_size (int): maximum number of predictions kept; the least recently used
+                ones are evicted first
+            ttl (float): number of seconds a prediction is kept
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._fingerprint = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(row, threshold):
+        """Hash an encoded feature vector and the threshold into a cache key
+
+        Args:
+            row (:obj:`numpy.ndarray`): the encoded applicant
+            threshold (float): the probability cutoff of the prediction
+
+        Returns:
+            str: hexadecimal digest
+
+        """
+        digest = hashlib.sha1(np.ascontiguousarray(row, dtype=np.float64).tobytes())
+        digest.update(repr(float(threshold)).encode())
+        return digest.hexdigest()
+
+    def get(self, key, fingerprint):
+        """Get a cached prediction
+
+        Args:
+            key (str): key from `PredictionCache.key`
+            fingerprint (str): fingerprint of the model currently loaded,
+                from `ModelRegistry.fingerprint`
+
+        Returns:
+            :obj:`Prediction`: the cached prediction, or None if missing or expired
+
+        """
+        with self._lock:
+            if fingerprint != self._fingerprint:
+                if self._entries:
+                    logger.info('Model changed, %i cached predictions dropped', len(self._entries))
+                self._entries.clear()
+                self._fingerprint = fingerprint
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, fingerprint, prediction):
+        """Cache a prediction
+
+        Args:
+            key (str): key from `PredictionCache.key`
+            fingerprint (str): fingerprint of the model that made the prediction
+            prediction (:obj:`Prediction`): the prediction
+
+        Returns:
+            None
+
+        """
+        with self._lock:
+            if fingerprint != self._fingerprint:
+                return
+            self._entries[key] = (time.monotonic() + self.ttl, prediction)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        """Get the counters of the cache
+
+        Returns:
+            dict: number of hits, misses, evictions and entries, and the hit rate
+
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'size': len(self._entries),
+                    'hit_rate': self.hits / lookups if lookups else 0.0}
+
+    def clear(self):
+        """Drop all cached predictions
+
+        Returns:
+            None
+
+        """
+        with self._lock:
+            self._entries.clear()
+
+
+def _with_n_jobs(model, n_jobs):
+    """Get the model set to score with `n_jobs` cores, without changing the shared model
+
+    The model of the registry is shared by concurrent requests, so a shallow copy with the
+    new setting is returned instead; it shares the fitted trees and only copies the
+    parameters of the model.
+    """
+    if n_jobs is None or getattr(model, 'n_jobs', n_jobs) == n_jobs:
+        return model
+    model = copy.copy(model)
+    model.n_jobs = n_jobs
+    return model
+
+
+def get_prediction(input_ohe, model_path, ohe_cols, threshold=0.5, n_jobs=None, cache=None):
     """Get loan delinquency prediction for new user input
 
+    The probability is computed with a single pass through the forest and the
+    predicted class is derived from it, instead of calling `predict` separately.
+
     Args:
-        input_ohe (:obj:`DataFrame <pandas.DataFrame>`): a DataFrame of the transformed user input
+        input_ohe (:obj:`DataFrame <pandas.DataFrame>` or :obj:`numpy.ndarray`): the transformed
+            user input, either as a DataFrame or as a row from `InputEncoder.encode`
         model_path (str): the path to trained model;
-            default is 'models/randomforest.joblib' (config.yaml)
+            default is 'models/randomforest.forest' (config.yaml)
         ohe_cols (:obj:`list`): the required columns used in the trained Random Forest Classifier
+        threshold (float): the applicant is classified as likely delinquent when the
+            predicted probability is above this cutoff; default is 0.5 (config.yaml),
+            which matches `RandomForestClassifier.predict`
+        n_jobs (int): number of cores used to score the forest (optional, default = None
+            to keep the setting the model was trained with); 1 is fastest for one applicant
+        cache (:obj:`PredictionCache`): cache of earlier predictions to look the applicant
+            up in (optional, default = None for no caching)
 
     Returns:
-        [pred_prob, pred_bin] (:obj:`list`): the first object in the list is
-            the predicted probability of loan delinquency where the second object
-            in the list is the predicted class for the applicant
+        :obj:`Prediction`: named tuple of (pred_prob, pred_bin, pred_class) where
+            pred_prob is the predicted probability of loan delinquency in percent,
+            pred_bin is the predicted class for the applicant as a readable message
+            and pred_class is the predicted class as 0 or 1
 
     """
-    # load pre-trained model
+    # get pre-trained model from the registry (only unpickled when the file changes)
     try:
-        loaded_rf = joblib.load(model_path)
-        logger.info('Loaded model from %s', model_path)
+        loaded_rf = load_model(model_path)
     except OSError:
         logger.error('Model is not found from %s', model_path)
+        raise
+    loaded_rf = _with_n_jobs(loaded_rf, n_jobs)
+    if isinstance(input_ohe, pd.DataFrame):
+        input_ohe = input_ohe[ohe_cols]
+    if cache is not None:
+        key = cache.key(input_ohe, threshold)
+        fingerprint = model_registry.fingerprint(model_path)
+        prediction = cache.get(key, fingerprint)
+        if prediction is not None:
+            return prediction
     # predict probability of loan_delinquency with the new user input
-    pred_prob = np.round(100 * loaded_rf.predict_proba(input_ohe[ohe_cols])[:, 1][0], 2)
-    # predict the class with the new user input
-    if loaded_rf.predict(input_ohe[ohe_cols]) == 1:
+    prob = loaded_rf.predict_proba(input_ohe)[:, 1][0]
+    pred_prob = np.round(100 * prob, 2)
+    # derive the class from the same probability
+    pred_class = int(prob > threshold)
+    if pred_class == 1:
         pred_bin = "the applicant IS LIKELY to have delinquent payment"
     else:
         pred_bin = "the applicant IS NOT LIKELY to have delinquent payment"
-    return [pred_prob, pred_bin]
+    prediction = Prediction(pred_prob, pred_bin, pred_class)
+    if cache is not None:
+        cache.put(key, fingerprint, prediction)
+    return prediction
+
+
+def read_applicants(file, fmt):
+    """Parse applicant records from an open text file
+
+    Args:
+        file (file-like): text stream of applicant records whose keys are the
+            user input names used by the app (e.g. 'Age', 'Employed')
+        fmt (str): 'jsonl' for one JSON object per line, or 'csv' for a file with a header row
+
+    Yields:
+        dict: one applicant record at a time; empty CSV fields are left out
+
+    Raises:
+        ValueError: if a JSON line is not a JSON object
+
+    """
+    if fmt == 'csv':
+        for row in csv.DictReader(file):
+            yield {key: value for key, value in row.items() if value != ''}
+    elif fmt == 'jsonl':
+        for line in file:
+            line = line.strip()
+            if line:
+                record = json.loads(line)
+                if not isinstance(record, dict):
+                    raise ValueError('Applicant record must be a JSON object, got %s'
+                                     % type(record).__name__)
+                yield record
+    else:
+        raise ValueError('Unsupported applicant record format: %s' % fmt)
+
+
+def score_batch(records, encoder, model_path, threshold=0.5, chunk_size=1000, n_jobs=None):
+    """Get loan delinquency predictions for many applicants, one forest call per chunk
+
+    The model is loaded when this function is called, so that a missing or unreadable
+    model raises here, before any prediction is consumed; the records are scored lazily.
+
+    Args:
+        records (iterable of dict): applicant records, e.g. from `read_applicants`
+        encoder (:obj:`InputEncoder`): the compiled encoder for the model's columns
+        model_path (str): the path to trained model;
+            default is 'models/randomforest.forest' (config.yaml)
+        threshold (float): probability cutoff above which the applicant is
+            classified as likely delinquent; default is 0.5 (config.yaml)
+        chunk_size (int): number of applicants encoded and scored together;
+            default is 1000 (config.yaml)
+        n_jobs (int): number of cores used to score each chunk, -1 for all cores
+            (optional, default = None to keep the setting the model was trained with)
+
+    Returns:
+        iterator of dict: 'pred_prob' (probability of delinquency in percent) and
+            'pred_class' (0 or 1) for each record in input order, with the record's 'id'
+            passed through if present
+
+    """
+    loaded_rf = _with_n_jobs(load_model(model_path), n_jobs)
+    return _score_chunks(loaded_rf, records, encoder, threshold, chunk_size)
+
+
+def _score_chunks(loaded_rf, records, encoder, threshold, chunk_size):
+    """Score the records chunk by chunk with a loaded model, see `score_batch`"""
+    records = iter(records)
+    n_scored = 0
+    while True:
+        chunk = list(itertools.islice(records, chunk_size))
+        if not chunk:
+            break
+        probs = loaded_rf.predict_proba(encoder.encode_batch(chunk))[:, 1]
+        for record, prob in zip(chunk, probs):
+            result = {'pred_prob': float(np.round(100 * prob, 2)),
+                      'pred_class': int(prob > threshold)}
+            if 'id' in record:
+                result = dict(id=record['id'], **result)
+            yield result
+        n_scored += len(chunk)
+        logger.debug('%i applicants scored', n_scored)
+    logger.info('Batch scoring completed for %i applicants', n_scored)
@@ -0,0 +1,170 @@
+"""
+This module contains multiple functions that offers
+per-request profiling of the app, written as folded stacks for flame graphs
+"""
+import collections
+import itertools
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class StackProfiler:
+    """Record the time spent in every call stack of the calling thread
+
+    Every Python and C function call and return of the thread is traced with
+    `sys.setprofile`, which only affects the thread that starts the profiler, and the time
+    between two events is added to the stack that was running. Unlike a sampling profiler,
+    this sees every call of a request that takes a few milliseconds, at the price of slowing
+    down the profiled code, so only the requests picked for profiling pay for it.
+    """
+
+    def __init__(self):
+        # nanoseconds spent in each stack, keyed by the tuple of its frames from the root
+        self.stacks = collections.Counter()
+        self._labels = {}
+        self._stack = ()
+        self._depth = 0
+        self._last = None
+
+    def _label(self, code):
+        """Name a Python function like 'get_prediction (predict.py:452)'"""
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = '%s (%s:%i)' % (
+                code.co_name, os.path.basename(code.co_filename), code.co_firstlineno)
+        return label
+
+    def _callback(self, frame, event, arg):
+        """Profile function called by the interpreter on every call and return"""
+        now = time.perf_counter_ns()
+        self.stacks[self._stack] += now - self._last
+        if event == 'call':
+            self._stack += (self._label(frame.f_code),)
+        elif event == 'c_call':
+            self._stack += ('%s.%s' % (getattr(arg, '__module__', None) or 'builtins',
+                                       getattr(arg, '__qualname__', repr(arg))),)
+        elif len(self._stack) > self._depth:
+            # return, c_return or c_exception; the frames that started profiling stay
+            self._stack = self._stack[:-1]
+        # the time spent in this function is not attributed to the profiled code
+        self._last = time.perf_counter_ns()
+
+    @contextmanager
+    def profile(self, *root):
+        """Profile the code run in the context on the calling thread
+
+        Args:
+            *root (str): frames to put at the root of the stacks recorded in the context,
+                e.g. the route and the stage of the request
+
+        """
+        previous = sys.getprofile()
+        self._stack = tuple(root)
+        self._depth = len(root)
+        self._last = time.perf_counter_ns()
+        sys.setprofile(self._callback)
+        try:
+            yield self
+        finally:
+            sys.setprofile(previous)
+            self.stacks[self._stack] += time.perf_counter_ns() - self._last
+            self._stack = ()
+
+    def folded(self):
+        """Format the recorded stacks as folded stacks
+
+        Returns:
+            str: one line per stack with its frames separated by ';' and the number of
+                microseconds spent in it, as read by flamegraph.pl, speedscope or inferno
+
+        """
+        lines = []
+        for stack, ns in sorted(self.stacks.items()):
+            if stack and ns >= 1000:
+                lines.append('%s %i\n' % (';'.join(frame.replace(';', ':') for frame in stack),
+                                          ns // 1000))
+        return ''.join(lines)
+
+
+class ProfileWriter:
+    """Decide which requests to profile and write their stacks to a directory with rotation"""
+
+    def __init__(self, output_dir, sample_every=0, max_files=200):
+        """
+        Args:
+            output_dir (str): directory of the folded stack files
+            sample_every (int): profile 1 in `sample_every` requests on top of the requests
+                that ask for it (default = 0 to only profile requests that ask for it)
+            max_files (int): number of most recent profiles kept in `output_dir`
+        """
+        self.output_dir = output_dir
+        self.sample_every = sample_every
+        self.max_files = max_files
+        self._requests = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def should_profile(self, requested=False):
+        """Decide whether to profile a request
+
+        Args:
+            requested (bool): whether the request asked for profiling and is allowed to
+
+        Returns:
+            bool: whether to profile the request
+
+        """
+        if requested:
+            return True
+        if not self.sample_every:
+            return False
+        return next(self._requests) % self.sample_every == 0
+
+    def write(self, profiler, name):
+        """Write the stacks of a profiler to a new file and remove the oldest files
+
+        Args:
+            profiler (:obj:`StackProfiler`): the profiler of the request
+            name (str): name of the profile, e.g. the route of the request
+
+        Returns:
+            str: path of the file written, or None if nothing was recorded
+
+        """
+        folded = profiler.folded()
+        if not folded:
+            return None
+        os.makedirs(self.output_dir, exist_ok=True)
+        safe_name = ''.join(c if c.isalnum() else '_' for c in name).strip('_')
+        # the time first, so that sorting the names sorts the files from oldest to newest
+        path = os.path.join(self.output_dir, '%.6f-%i-%i-%s.folded' % (
+            time.time(), os.getpid(), threading.get_ident(), safe_name))
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(folded)
+        os.replace(tmp_path, path)
+        logger.info('Profile of %s written to %s', name, path)
+        self.rotate()
+        return path
+
+    def rotate(self):
+        """Remove the oldest profiles until at most `max_files` are left
+
+        Returns:
+            None
+
+        """
+        with self._lock:
+            names = sorted(name for name in os.listdir(self.output_dir)
+                           if name.endswith('.folded'))
+            for name in names[:max(0, len(names) - self.max_files)]:
+                try:
+                    os.remove(os.path.join(self.output_dir, name))
+                except FileNotFoundError:
+                    # another process of the app removed it first
+                    pass
@@ -0,0 +1,194 @@
+"""
+This module contains multiple functions that offers
+hyperparameter tuning functionality for the Random Forest Classifier
+"""
+import logging
+import math
+
+import numpy as np
+import pandas as pd
+import sklearn
+import sklearn.ensemble
+import sklearn.metrics
+import sklearn.model_selection
+from joblib import Parallel, delayed
+
+from src.instrument import instrument
+from src.model import get_sample_weight, train_test_positions
+
+logger = logging.getLogger(__name__)
+
+# the minor class is already corrected by the sample weights of train_model
+_WEIGHTED_PARAMS = ('class_weight',)
+
+
+def _check_params(params):
+    """Reject hyperparameters that would correct the class imbalance a second time"""
+    conflicts = [name for name in _WEIGHTED_PARAMS if name in params]
+    if conflicts:
+        logger.error('%s cannot be tuned, the minor class is weighted by "resample" in '
+                     'train_model', ', '.join(conflicts))
+        raise ValueError('Hyperparameters conflicting with the sample weights: %s'
+                         % ', '.join(conflicts))
+
+
+def _fit_and_score(params, X, y, train_idx, test_idx, rand_state, sample_strat=None,
+                   resample=None):
+    """Fit a random forest on one fold and return its AUC on the held out part
+
+    With a `resample` method, the training rows of the fold are weighted like the training
+    rows of `train_model`, so that candidates are scored as they will be trained.
+    """
+    sample_weight = None
+    if resample is not None:
+        sample_weight = get_sample_weight(y[train_idx], sample_strat, resample, rand_state)
+    rf = sklearn.ensemble.RandomForestClassifier(random_state=rand_state, n_jobs=1, **params)
+    rf.fit(X[train_idx], y[train_idx], sample_weight=sample_weight)
+    return sklearn.metrics.roc_auc_score(y[test_idx], rf.predict_proba(X[test_idx])[:, 1])
+
+
+def get_candidates(param_grid, search, n_iter, rand_state):
+    """Build the list of hyperparameter candidates to try
+
+    Args:
+        param_grid (dict of {str : list}): Random Forest Classifier arguments and the values
+            to try for each of them (default in config.yaml)
+        search (str): 'grid' to try every combination, 'random' to sample `n_iter` of them
+        n_iter (int): number of candidates sampled for a random search
+        rand_state (int): set "random_state" to ensure reproducibility
+
+    Returns:
+        candidates (:obj:`list` of dict): the hyperparameter candidates
+
+    """
+    if search == 'grid':
+        return list(sklearn.model_selection.ParameterGrid(param_grid))
+    elif search == 'random':
+        return list(sklearn.model_selection.ParameterSampler(param_grid, n_iter,
+                                                             random_state=rand_state))
+    else:
+        logger.error('Search %s is not supported, use "grid" or "random"', search)
+        raise ValueError('Unsupported search: %s' % search)
+
+
+@instrument()
+def tune_model(data, target_colname, param_grid, search, n_iter, cv, factor,
+               min_samples, rand_state, n_jobs, leaderboard_path, train_kwargs=None):
+    """Search Random Forest hyperparameters with successive halving and k-fold cross validation
+
+    Every candidate is first cross validated on a small random sample of the rows; only the
+    best 1/`factor` of them are kept and cross validated again on `factor` times as many
+    rows, until one candidate is left or all rows are used. Folds of all candidates of a
+    round are fitted in parallel across a process pool.
+
+    With the arguments of `train_model`, only the training rows of its train/test split
+    are searched and every fold is weighted like its training rows, so that the test rows
+    it evaluates the tuned model on took no part in picking it. The best hyperparameters are
+    returned rather than a model, so that the final model is trained by `train_model`
+    with its train/test split and class weighting (see `train_model_args`).
+
+    Args:
+        data (:obj:`DataFrame <pandas.DataFrame>`): the featurized (one-hot-encoded) data
+        target_colname (str): the name of the "target" column; default is "target"
+            (specified in config.yaml)
+        param_grid (dict of {str : list}): Random Forest Classifier arguments and the values
+            to try for each of them (default in config.yaml)
+        search (str): 'grid' to try every combination, 'random' to sample `n_iter` of them
+        n_iter (int): number of candidates sampled for a random search
+        cv (int): number of cross validation folds
+        factor (int): only the best 1/factor candidates survive each round, and the next
+            round uses factor times as many rows
+        min_samples (int): number of rows used in the first round
+        rand_state (int): set "random_state" to ensure reproducibility
+        n_jobs (int): number of worker processes, -1 for all cores
+        leaderboard_path (str): path to save the leaderboard of every candidate and round to
+        train_kwargs (dict): arguments of `train_model` the tuned model is trained with
+            (optional, default = None to search all rows without sample weights)
+
+    Returns:
+        [best, leaderboard] (:obj:`list`): the first object in the list is the dict of the
+            best hyperparameters; the second object is the leaderboard DataFrame sorted
+            from the best candidate to the worst
+
+    """
+    X = data.drop([target_colname], axis=1).to_numpy(dtype=np.float64)
+    y = data[target_colname].to_numpy()
+    positions = np.arange(len(y))
+    sample_strat = resample = None
+    if train_kwargs is not None:
+        _check_params(param_grid)
+        # keep the test rows of train_model out of the search
+        positions, _ = train_test_positions(y, train_kwargs['ts'], train_kwargs['rand_state'])
+        sample_strat = train_kwargs['sample_strat']
+        resample = train_kwargs.get('resample', 'weight')
+    n_samples = len(positions)
+
+    candidates = get_candidates(param_grid, search, n_iter, rand_state)
+    n_rounds = 1 + math.ceil(math.log(len(candidates), factor)) if len(candidates) > 1 else 1
+    n_rows = max(min(min_samples, n_samples), n_samples // factor ** (n_rounds - 1))
+    logger.info('Tuning %i candidates in up to %i rounds starting from %i rows',
+                len(candidates), n_rounds, n_rows)
+
+    order = positions[np.random.RandomState(rand_state).permutation(n_samples)]
+    alive = list(range(len(candidates)))
+    records = []
+    for rnd in range(n_rounds):
+        rows = order[:n_rows]
+        folds = list(sklearn.model_selection.StratifiedKFold(
+            n_splits=cv, shuffle=True, random_state=rand_state).split(rows, y[rows]))
+        scores = Parallel(n_jobs=n_jobs)(
+            delayed(_fit_and_score)(candidates[c], X, y, rows[train], rows[test], rand_state,
+                                    sample_strat, resample)
+            for c in alive for train, test in folds)
+        scores = np.array(scores).reshape(len(alive), cv)
+
+        for c, fold_scores in zip(alive, scores):
+            records.append(dict(candidate=c, round=rnd, n_rows=n_rows,
+                                mean_auc=fold_scores.mean(), std_auc=fold_scores.std(),
+                                **{'param_' + key: value
+                                   for key, value in candidates[c].items()}))
+        logger.info('Round %i: %i candidates on %i rows, best AUC %0.3f',
+                    rnd, len(alive), n_rows, scores.mean(axis=1).max())
+
+        if len(alive) == 1 or n_rows == n_samples:
+            break
+        # keep the best 1/factor of the candidates for the next round
+        keep = max(1, len(alive) // factor)
+        ranked = np.argsort(-scores.mean(axis=1), kind='stable')
+        alive = [alive[i] for i in ranked[:keep]]
+        if len(alive) == 1:
+            break
+        n_rows = min(n_samples, n_rows * factor)
+
+    leaderboard = pd.DataFrame(records).sort_values(['round', 'mean_auc'],
+                                                    ascending=[False, False])
+    leaderboard.to_csv(leaderboard_path, index=False)
+    logger.info('Tuning leaderboard saved to %s', leaderboard_path)
+
+    best = candidates[int(leaderboard['candidate'].iloc[0])]
+    logger.info('Best hyperparameters: %s', best)
+    return [best, leaderboard]
+
+
+def train_model_args(train_kwargs, best):
+    """Combine the arguments of `train_model` with the hyperparameters picked by `tune_model`
+
+    Args:
+        train_kwargs (dict): arguments of `train_model` (default in config.yaml)
+        best (dict): the best hyperparameters returned by `tune_model`
+
+    Returns:
+        kwargs (dict): arguments of `train_model` where "n_estimat" and "max_dep" are the
+            tuned "n_estimators" and "max_depth", and the other tuned hyperparameters are
+            passed on to the random forest classifier
+
+    """
+    _check_params(best)
+    kwargs = dict(train_kwargs)
+    params = dict(best)
+    if 'n_estimators' in params:
+        kwargs['n_estimat'] = params.pop('n_estimators')
+    if 'max_depth' in params:
+        kwargs['max_dep'] = params.pop('max_depth')
+    kwargs.update(params)
+    return kwargs
@@ -6,7 +6,7 @@ import pytest
 import pandas as pd
 import numpy as np
 
-from src.acquire import filna, clean_column, neg_to_pos, replace_cat
+from src.acquire import filna, clean_column, neg_to_pos, replace_cat, clean, import_data_chunks
 
 
 def test_filna():
@@ -309,3 +309,91 @@ def test_replace_cat_non_df():
 
     with pytest.raises(TypeError):
         replace_cat(df_in, cat_dict)
+
+
+def _legacy_clean(df, filna_col, clean_col, clean_replace_dict, to_str_col, neg_cols, cat_dict):
+    """Row-by-row cleaning with Series.apply that the vectorized functions replaced"""
+    df.loc[:, filna_col] = df[filna_col].fillna(0)
+    df = df.dropna()
+    for key, value in clean_replace_dict.items():
+        df[clean_col] = df[clean_col].apply(lambda x: x.replace(key, value))
+    df[to_str_col] = df[to_str_col].astype(str)
+    for col in neg_cols:
+        df[col] = df[col].apply(lambda x: x*-1)
+    for col, values in cat_dict.items():
+        for old, new in values.items():
+            df[col] = df[col].apply(lambda x: x.replace(old, new))
+    return df
+
+
+def test_clean_matches_legacy():
+    """test9 (clean()): happy path giving identical output to the row-by-row implementation"""
+    rng = np.random.RandomState(0)
+    n = 1000
+    df_in = pd.DataFrame({
+        'edu_type': rng.choice(['Secondary / secondary special', 'Lower secondary',
+                                'Academic degree', 'Higher education', 'Incomplete higher'], n),
+        'phone_contactable': rng.choice([0, 1], n),
+        'own_car': rng.choice(['Y', 'N'], n),
+        'own_realty': rng.choice(['Y', 'N'], n),
+        'gender': rng.choice(['M', 'F', 'XNA'], n),
+        'days_birth': -rng.randint(7000, 25000, n),
+        'days_employed': rng.choice([-1000, -20, 365243], n),
+        'days_id_change': -rng.randint(0, 7000, n),
+        'amt_req_credit_bureau_day': rng.choice([0., 1., np.nan], n),
+        'amt_annuity': rng.choice([10000., 25000., np.nan], n, p=[0.5, 0.49, 0.01])},
+        index=rng.permutation(n))
+    kwargs = dict(filna_col='amt_req_credit_bureau_day',
+                  clean_col='edu_type',
+                  clean_replace_dict={'Secondary / secondary special': 'Secondary education',
+                                      'Lower secondary': 'Secondary education',
+                                      'Academic degree': 'Higher education'},
+                  to_str_col='phone_contactable',
+                  neg_cols=['days_birth', 'days_employed', 'days_id_change'],
+                  cat_dict={'own_car': {"Y": "Yes", "N": "No"},
+                            'own_realty': {"Y": "Yes", "N": "No"},
+                            'phone_contactable': {"1": "Yes", "0": "No"},
+                            'gender': {"M": "Male", "F": "Female", "XNA": "Not Provided"}})
+
+    df_true = _legacy_clean(df_in.copy(), **kwargs)
+    df_test = clean(df_in.copy(), **kwargs)
+
+    # Test that the true and test are the same
+    pd.testing.assert_frame_equal(df_test, df_true)
+
+
+def test_clean_column_categorical():
+    """test10 (clean_column()): happy path for a categorical column"""
+    df_in = pd.DataFrame({'edu_type': pd.Categorical(['Lower secondary', 'Higher education',
+                                                      'Lower secondary'])})
+
+    df_test = clean_column(df_in, 'edu_type', {'Lower secondary': 'Secondary education'})
+
+    assert list(df_test['edu_type']) == ['Secondary education', 'Higher education',
+                                         'Secondary education']
+
+
+def test_import_data_chunks(tmp_path):
+    """test11 (import_data_chunks()): happy path keeping only the renamed columns"""
+    path = str(tmp_path / 'raw.csv')
+    pd.DataFrame({'SK_ID_CURR': [1, 2, 3, 4, 5],
+                  'CODE_GENDER': ['M', 'F', 'F', 'XNA', 'M'],
+                  'UNUSED': ['a', 'b', 'c', 'd', 'e']}).to_csv(path, index=False)
+
+    chunks = list(import_data_chunks(path, {'SK_ID_CURR': 'id', 'CODE_GENDER': 'gender'},
+                                     chunksize=2, dtypes={'CODE_GENDER': 'category'}))
+
+    # Test that the chunks cover the file and only hold the renamed columns
+    assert [len(chunk) for chunk in chunks] == [2, 2, 1]
+    assert all(list(chunk.columns) == ['id', 'gender'] for chunk in chunks)
+    assert isinstance(chunks[0]['gender'].dtype, pd.CategoricalDtype)
+
+
+def test_import_data_chunks_missing_column(tmp_path):
+    """test12 (import_data_chunks()): unhappy path when a configured column is missing"""
+    path = str(tmp_path / 'raw.csv')
+    pd.DataFrame({'SK_ID_CURR': [1, 2]}).to_csv(path, index=False)
+
+    with pytest.raises(ValueError):
+        list(import_data_chunks(path, {'SK_ID_CURR': 'id', 'CODE_GENDER': 'gender'},
+                                chunksize=2))
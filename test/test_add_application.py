@@ -0,0 +1,283 @@
+"""
+Test add_application.py module
+"""
+import datetime
+import json
+import os
+
+import pytest
+
+import pandas as pd
+import sqlalchemy
+
+from src.add_application import Application, ApplicationManager, ApplicationWriter, \
+    TimedQueuePool, bulk_ingest, coerce_row, create_db, engine_options, instrument_engine, \
+    pool_status, upgrade_db
+
+
+def _row(i):
+    """Build an application row as it is queued by the app"""
+    return {'contract_type': 'Cash loans', 'gender': 'Female', 'num_children': i,
+            'income_total': 1000.0 * i, 'Age': 30 + i, 'Employed': 'Yes'}
+
+
+def _count(engine):
+    """Count the rows of the applications table"""
+    with engine.connect() as connection:
+        return connection.execute(sqlalchemy.text('SELECT COUNT(*) FROM applications')).scalar()
+
+
+@pytest.fixture
+def engine(tmp_path):
+    """SQLite database with the applications table"""
+    engine_string = 'sqlite:///%s' % (tmp_path / 'application.db')
+    create_db(engine_string)
+    return sqlalchemy.create_engine(engine_string)
+
+
+def test_application_writer_batches(engine, tmp_path):
+    """test1 (ApplicationWriter): happy path inserting queued rows in batches and on close"""
+    spool_dir = str(tmp_path / 'spool')
+    writer = ApplicationWriter(engine, spool_dir, batch_size=10, flush_interval=60)
+
+    for i in range(25):
+        writer.submit(_row(i))
+    writer.close()
+
+    # Test that all rows are inserted and that no spool segment is left behind
+    assert _count(engine) == 25
+    assert writer.n_written == 25
+    assert os.listdir(spool_dir) == []
+    stats = writer.stats()
+    assert (stats['written'], stats['failures'], stats['backlog']) == (25, 0, 0)
+    assert stats['batches'] >= 1
+
+
+def test_application_writer_recover(engine, tmp_path):
+    """test2 (ApplicationWriter.recover()): happy path inserting rows spooled before a crash"""
+    spool_dir = tmp_path / 'spool'
+    spool_dir.mkdir()
+    with open(str(spool_dir / '1-1-1.jsonl'), 'w') as f:
+        f.write(json.dumps(_row(1)) + '\n' + json.dumps(_row(2)) + '\n' + '{"gender": "Fe')
+
+    writer = ApplicationWriter(engine, str(spool_dir), batch_size=10, flush_interval=60)
+    writer.close()
+
+    # Test that the complete rows are recovered and the torn last row is skipped
+    assert _count(engine) == 2
+    assert os.listdir(str(spool_dir)) == []
+
+
+def test_application_writer_db_down(tmp_path):
+    """test3 (ApplicationWriter): unhappy path keeping the rows spooled when the insert fails"""
+    engine = sqlalchemy.create_engine('sqlite:///%s' % (tmp_path / 'no_table.db'))
+    spool_dir = str(tmp_path / 'spool')
+    writer = ApplicationWriter(engine, spool_dir, batch_size=2, flush_interval=60)
+
+    writer.submit(_row(1))
+    writer.submit(_row(2))
+    writer.close()
+
+    # Test that the batch is still in the spool to be recovered by the next writer
+    segments = os.listdir(spool_dir)
+    assert len(segments) == 1
+    with open(os.path.join(spool_dir, segments[0])) as f:
+        rows = [json.loads(line) for line in f]
+    assert [row.pop('created_at') is not None for row in rows] == [True, True]
+    assert rows == [_row(1), _row(2)]
+    # Test that the failed insert is counted and the rows are still waiting
+    assert writer.stats()['failures'] >= 1
+    assert writer.stats()['backlog'] == 2
+    with pytest.raises(RuntimeError):
+        writer.submit(_row(3))
+
+
+def test_application_writer_poisoned_batch(engine, tmp_path):
+    """test4 (ApplicationWriter): unhappy path moving the rows the database rejects aside"""
+    spool_dir = str(tmp_path / 'spool')
+    writer = ApplicationWriter(engine, spool_dir, batch_size=7, flush_interval=60)
+
+    # the second row with id 3 breaks the primary key of the whole batch
+    for i in [1, 2, 3, 3, 4, 5, 6]:
+        writer.submit(dict(_row(i), id=i))
+    writer.close()
+
+    # Test that the other rows are inserted and the duplicate is in the dead-letter file
+    assert _count(engine) == 6
+    with open(writer.dead_letter_path) as f:
+        rejected = [json.loads(line) for line in f]
+    assert [entry['row']['id'] for entry in rejected] == [3]
+    assert 'UNIQUE' in rejected[0]['error']
+    assert os.listdir(spool_dir) == ['dead_letter']
+    stats = writer.stats()
+    assert (stats['written'], stats['rejected'], stats['failures'], stats['backlog']) == \
+        (6, 1, 0, 0)
+
+
+def test_application_writer_recover_poisoned(engine, tmp_path):
+    """test5 (ApplicationWriter.recover()): unhappy path recovering rows the database rejects"""
+    spool_dir = tmp_path / 'spool'
+    spool_dir.mkdir()
+    with engine.begin() as connection:
+        connection.execute(Application.__table__.insert(), [dict(_row(1), id=1)])
+    with open(str(spool_dir / '1-1-1.jsonl'), 'w') as f:
+        for i in [1, 2, 3]:
+            f.write(json.dumps(dict(_row(i), id=i)) + '\n')
+        f.write(json.dumps(dict(_row(4), created_at='yesterday')) + '\n')
+
+    # Test that the writer starts although the spooled rows cannot all be inserted
+    writer = ApplicationWriter(engine, str(spool_dir), batch_size=10, flush_interval=60)
+    writer.close()
+
+    # Test that the valid rows are inserted and the others are in the dead-letter file
+    assert _count(engine) == 3
+    with open(writer.dead_letter_path) as f:
+        rejected = [json.loads(line)['row'] for line in f]
+    assert [row.get('id') for row in rejected] == [None, 1]
+    assert os.listdir(str(spool_dir)) == ['dead_letter']
+
+
+def test_bulk_ingest(tmp_path):
+    """test6 (bulk_ingest()): happy path loading a CSV file in several batches"""
+    path = str(tmp_path / 'applications.csv')
+    pd.DataFrame({'contract_type': ['Cash loans', 'Revolving loans', None] * 5,
+                  'age': range(15), 'amt_credit': [1.5, None, 2.5] * 5,
+                  'target': 0}).to_csv(path, index=False)
+    engine_string = 'sqlite:///%s' % (tmp_path / 'application.db')
+
+    n_rows = bulk_ingest(engine_string, path, batch_size=4)
+
+    # Test that all rows are inserted, with renamed columns and missing values as NULL
+    engine = sqlalchemy.create_engine(engine_string)
+    with engine.connect() as connection:
+        rows = connection.execute(sqlalchemy.text(
+            'SELECT contract_type, Age, amt_credit FROM applications ORDER BY id')).fetchall()
+    assert n_rows == 15
+    assert [tuple(row) for row in rows[:3]] == [('Cash loans', 0, 1.5),
+                                                ('Revolving loans', 1, None), (None, 2, 2.5)]
+
+
+def test_bulk_ingest_unknown_format(tmp_path):
+    """test7 (bulk_ingest()): unhappy path when the file is neither CSV nor Parquet"""
+    with pytest.raises(ValueError):
+        bulk_ingest('sqlite:///%s' % (tmp_path / 'application.db'),
+                    str(tmp_path / 'applications.npz'))
+
+
+def test_engine_options():
+    """test8 (engine_options()): happy path sizing the pool of server databases only"""
+    mysql = engine_options('mysql+pymysql://user:pw@host:3306/db', pool_size=3, max_overflow=1)
+    sqlite = engine_options('sqlite:///data/application.db', pool_size=3, max_overflow=1)
+
+    assert mysql['poolclass'] is TimedQueuePool
+    assert (mysql['pool_size'], mysql['max_overflow'], mysql['pool_pre_ping']) == (3, 1, True)
+    assert sorted(sqlite) == ['pool_pre_ping', 'pool_recycle']
+
+
+def test_pool_status(tmp_path):
+    """test9 (pool_status()): happy path counting checkouts, overflow and waits"""
+    engine = instrument_engine(sqlalchemy.create_engine(
+        'sqlite:///%s' % (tmp_path / 'application.db'), poolclass=TimedQueuePool,
+        pool_size=1, max_overflow=1))
+
+    with engine.connect():
+        with engine.connect():
+            busy = pool_status(engine)
+    idle = pool_status(engine)
+
+    # Test that the second connection is an overflow and both are returned afterwards
+    assert (busy['checkedout'], busy['overflow']) == (2, 1)
+    assert (idle['checkedout'], idle['checkouts'], idle['connects']) == (0, 2, 2)
+    assert idle['wait_count'] == 2 and idle['wait_time_max'] >= 0
+
+
+def _manager_with_applications(tmp_path):
+    """Build a manager on a database of 10 applications, the odd ones scored"""
+    engine_string = 'sqlite:///%s' % (tmp_path / 'application.db')
+    create_db(engine_string)
+    manager = ApplicationManager(engine_string=engine_string)
+    for i in range(10):
+        manager.add_application('Cash loans' if i < 6 else 'Revolving loans', 'F', 'N', 'Y',
+                                0, 1000.0, 1.0, 1.0, 1.0, 'Working', 'Higher education',
+                                'Married', 30, 1, 1, 'Yes', 2, 0, 'Yes',
+                                pred_prob=10.0 * i if i % 2 else None,
+                                pred_class=int(i > 5) if i % 2 else None)
+    return manager
+
+
+def test_recent_applications(tmp_path):
+    """test10 (ApplicationManager.recent_applications()): happy path paging by id"""
+    manager = _manager_with_applications(tmp_path)
+
+    first = manager.recent_applications(limit=2, scored_only=True)
+    second = manager.recent_applications(limit=2, before_id=first[-1]['id'], scored_only=True)
+    cash = manager.recent_applications(contract_type='Cash loans',
+                                       since=datetime.datetime(2000, 1, 1))
+    manager.close()
+
+    # Test that pages follow each other, newest first, with the filters applied
+    assert [row['id'] for row in first + second] == [10, 8, 6, 4]
+    assert [row['pred_prob'] for row in first] == [90.0, 70.0]
+    assert [row['id'] for row in cash] == [6, 5, 4, 3, 2, 1]
+    assert isinstance(cash[0]['created_at'], datetime.datetime)
+
+
+def test_score_summary(tmp_path):
+    """test11 (ApplicationManager.score_summary()): happy path grouping by contract type"""
+    manager = _manager_with_applications(tmp_path)
+
+    summary = manager.score_summary(group_by='contract_type')
+    with pytest.raises(ValueError):
+        manager.score_summary(group_by='gender')
+    manager.close()
+
+    assert summary == [
+        {'contract_type': 'Cash loans', 'n_applications': 6, 'n_scored': 3,
+         'mean_pred_prob': 30.0, 'n_pred_delinquent': 0},
+        {'contract_type': 'Revolving loans', 'n_applications': 4, 'n_scored': 2,
+         'mean_pred_prob': 80.0, 'n_pred_delinquent': 2}]
+
+
+def test_upgrade_db(tmp_path):
+    """test12 (upgrade_db()): happy path adding new columns and indexes to an old table"""
+    engine = sqlalchemy.create_engine('sqlite:///%s' % (tmp_path / 'application.db'))
+    with engine.begin() as connection:
+        connection.execute(sqlalchemy.text(
+            'CREATE TABLE applications (id INTEGER PRIMARY KEY, contract_type VARCHAR(100))'))
+        connection.execute(sqlalchemy.text(
+            "INSERT INTO applications (contract_type) VALUES ('Cash loans')"))
+
+    added = upgrade_db(engine)
+
+    # Test that the old row is kept and the new columns can be queried
+    assert {'created_at', 'pred_prob', 'pred_class'} <= set(added)
+    assert 'ix_applications_created_at' in added
+    with engine.connect() as connection:
+        assert connection.execute(sqlalchemy.text(
+            'SELECT contract_type, pred_prob FROM applications')).fetchall() == \
+            [('Cash loans', None)]
+
+
+def test_coerce_row():
+    """test13 (coerce_row()): happy path converting form values to the column types"""
+    row = coerce_row({'contract_type': 'Cash loans', 'Age': '30', 'income_total': '1000.5',
+                      'num_children': '2.0', 'pred_prob': None})
+
+    assert row == {'contract_type': 'Cash loans', 'Age': 30, 'income_total': 1000.5,
+                   'num_children': 2, 'pred_prob': None}
+    assert isinstance(row['Age'], int)
+
+
+def test_add_application_malformed(tmp_path):
+    """test14 (ApplicationManager.add_application()): unhappy path for a malformed number"""
+    manager = _manager_with_applications(tmp_path)
+
+    for age, income in [('abc', 1000.0), (30.5, 1000.0), (30, 'nan')]:
+        with pytest.raises(ValueError):
+            manager.add_application('Cash loans', 'F', 'N', 'Y', 0, income, 1.0, 1.0, 1.0,
+                                    'Working', 'Higher education', 'Married', age, 1, 1, 'Yes',
+                                    2, 0, 'Yes')
+    manager.close()
+
+    # Test that none of the malformed applications is stored
+    assert _count(manager.engine) == 10
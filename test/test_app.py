@@ -0,0 +1,227 @@
+"""
+Test app.py module
+"""
+import csv
+import io
+import json
+import os
+import time
+
+import pytest
+
+import numpy as np
+import sklearn.ensemble
+
+from src.add_application import create_db
+from src.model import export_forest
+
+
+def _applicant(i):
+    """Build an applicant record with the user input names of the app"""
+    return {'contract_type': 'Cash loans', 'gender': 'Female', 'own_car': 'No',
+            'own_realty': 'Yes', 'num_children': i % 3, 'income_total': 100000.0 + i,
+            'amt_credit': 500000.0, 'amt_annuity': 25000.0, 'amt_goods_price': 450000.0,
+            'income_type': 'Working', 'edu_type': 'Higher education', 'family_status': 'Married',
+            'Age': 30 + i, 'Years_Employed': 5, 'Years_ID_Publish': 3, 'phone_contactable': 'Yes',
+            'cnt_family_members': 2, 'amt_req_credit_bureau_day': 0, 'Employed': 'Yes'}
+
+
+@pytest.fixture(scope='module')
+def flask_app(tmp_path_factory):
+    """The app on a fresh SQLite database and spool, scoring a small exported forest"""
+    tmp_path = tmp_path_factory.mktemp('app')
+    env = {'SQLALCHEMY_DATABASE_URI': 'sqlite:///%s' % (tmp_path / 'application.db'),
+           'WRITE_BEHIND_SPOOL_DIR': str(tmp_path / 'spool')}
+    previous = {name: os.environ.get(name) for name in env}
+    os.environ.update(env)
+    create_db(env['SQLALCHEMY_DATABASE_URI'])
+    import app as flask_app
+
+    ohe_cols = flask_app.conf['predict']['get_prediction']['ohe_cols']
+    rng = np.random.RandomState(0)
+    rf = sklearn.ensemble.RandomForestClassifier(n_estimators=3, max_depth=3, random_state=0)
+    rf.fit(rng.rand(50, len(ohe_cols)), rng.randint(0, 2, 50))
+    model_path = str(tmp_path / 'randomforest.forest')
+    export_forest(rf, model_path)
+    get_prediction_conf = flask_app.conf['predict']['get_prediction']
+    default_model_path = get_prediction_conf['model_path']
+    get_prediction_conf['model_path'] = model_path
+    yield flask_app
+
+    get_prediction_conf['model_path'] = default_model_path
+    if flask_app.application_manager.writer is not None:
+        flask_app.application_manager.writer.close()
+    for name, value in previous.items():
+        if value is None:
+            os.environ.pop(name)
+        else:
+            os.environ[name] = value
+
+
+def _form(i):
+    """Build the form of the app's index page for an applicant"""
+    names = {'Age': 'age', 'Years_Employed': 'years_employed',
+             'Years_ID_Publish': 'years_id_publish', 'Employed': 'employed'}
+    return {names.get(name, name): value for name, value in _applicant(i).items()}
+
+
+def _lines(response):
+    """Parse the JSON lines of a streamed response"""
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+
+def test_predict_batch_json(flask_app):
+    """test1 (/predict/batch): happy path scoring a JSON list of applicants"""
+    client = flask_app.app.test_client()
+    applicants = [dict(_applicant(i), id=i) for i in range(3)]
+
+    response = client.post('/predict/batch', data=json.dumps(applicants),
+                           content_type='application/json')
+
+    # Test that every applicant gets a prediction, in input order
+    results = _lines(response)
+    assert response.status_code == 200
+    assert [result['id'] for result in results] == [0, 1, 2]
+    assert all(0 <= result['pred_prob'] <= 100 and result['pred_class'] in (0, 1)
+               for result in results)
+
+
+def test_predict_batch_csv(flask_app):
+    """test2 (/predict/batch): happy path scoring a CSV file of applicants"""
+    client = flask_app.app.test_client()
+    body = io.StringIO()
+    writer = csv.DictWriter(body, fieldnames=list(_applicant(0)))
+    writer.writeheader()
+    for i in range(2):
+        writer.writerow(_applicant(i))
+
+    response = client.post('/predict/batch', data=body.getvalue(), content_type='text/csv')
+    results = _lines(response)
+
+    # Test that the CSV rows are scored like the same JSON records
+    expected = client.post('/predict/batch', data=json.dumps([_applicant(0), _applicant(1)]),
+                           content_type='application/json')
+    assert response.status_code == 200
+    assert results == _lines(expected)
+
+
+def test_predict_batch_malformed(flask_app):
+    """test3 (/predict/batch): unhappy path when the body is not a list of applicants"""
+    client = flask_app.app.test_client()
+
+    for body in ['{"Age": ', '[1, 2]', '"abc"', '{"applicants": ["a"]}']:
+        response = client.post('/predict/batch', data=body, content_type='application/json')
+        # Test that the body is rejected with a JSON error before anything is streamed
+        assert response.status_code == 400
+        assert 'error' in response.get_json()
+    assert client.post('/predict/batch', data='a', content_type='text/plain').status_code == 415
+
+
+def test_predict_batch_model_missing(flask_app, tmp_path, monkeypatch):
+    """test4 (/predict/batch): unhappy path when the model cannot be loaded"""
+    client = flask_app.app.test_client()
+    monkeypatch.setitem(flask_app.conf['predict']['get_prediction'], 'model_path',
+                        str(tmp_path / 'missing.forest'))
+
+    response = client.post('/predict/batch', data=json.dumps([_applicant(0)]),
+                           content_type='application/json')
+
+    # Test that a missing model gets an error status instead of a cut 200 stream
+    assert response.status_code == 503
+    assert 'error' in response.get_json()
+
+
+def test_admin_pool(flask_app, monkeypatch):
+    """test5 (/admin/pool): happy path with the admin token, unhappy paths without it"""
+    client = flask_app.app.test_client()
+
+    # Test that the endpoint does not exist when no admin token is configured
+    monkeypatch.setitem(flask_app.app.config, 'ADMIN_TOKEN', None)
+    assert client.get('/admin/pool', headers={'X-Admin-Token': ''}).status_code == 404
+
+    monkeypatch.setitem(flask_app.app.config, 'ADMIN_TOKEN', 'secret')
+    assert client.get('/admin/pool').status_code == 403
+    assert client.get('/admin/pool', headers={'X-Admin-Token': 'wrong'}).status_code == 403
+
+    response = client.get('/admin/pool', headers={'X-Admin-Token': 'secret'})
+    # Test that the pool status is returned to the admin
+    assert response.status_code == 200
+    assert isinstance(response.get_json(), dict)
+
+
+def test_metrics(flask_app):
+    """test6 (/metrics): happy path exposing the request counters, streamed requests once"""
+    client = flask_app.app.test_client()
+    labels = {'route': '/predict/batch', 'method': 'POST', 'status': 200}
+    before = flask_app.request_count.value(**labels)
+
+    response = client.post('/predict/batch', data=json.dumps([_applicant(0), _applicant(1)]),
+                           content_type='application/json')
+    # Test that the streamed request is not counted before its last chunk, then counted once
+    assert flask_app.request_count.value(**labels) == before
+    response.get_data()
+    response.close()
+    assert flask_app.request_count.value(**labels) == before + 1
+
+    response = client.get('/metrics')
+    text = response.get_data(as_text=True)
+    # Test that the exposition has the request counter of the streamed route
+    assert response.status_code == 200
+    assert response.content_type.startswith('text/plain')
+    assert '# TYPE loan_app_requests_total counter' in text
+    assert 'loan_app_requests_total{route="/predict/batch",method="POST",status="200"}' in text
+
+
+def test_result_profile(flask_app, tmp_path, monkeypatch):
+    """test7 (/result): happy path profiling for the admin, unhappy path without the token"""
+    client = flask_app.app.test_client()
+    monkeypatch.setattr(flask_app.profile_writer, 'output_dir', str(tmp_path / 'profiles'))
+    monkeypatch.setattr(flask_app.profile_writer, 'sample_every', 0)
+    monkeypatch.setitem(flask_app.app.config, 'ADMIN_TOKEN', 'secret')
+
+    # Test that asking for a profile without a valid admin token writes no profile file
+    for headers in [{}, {'X-Admin-Token': 'wrong'}]:
+        assert client.post('/result?profile=1', data=_form(0), headers=headers).status_code == 200
+        assert client.post('/result', data=_form(0),
+                           headers=dict(headers, **{'X-Profile': '1'})).status_code == 200
+    assert not os.path.exists(tmp_path / 'profiles')
+
+    # Test that the admin gets a profile written
+    client.post('/result?profile=1', data=_form(0), headers={'X-Admin-Token': 'secret'})
+    assert len(os.listdir(tmp_path / 'profiles')) == 1
+
+
+def test_result_server_timing(flask_app):
+    """test8 (/result): happy path reporting the stage durations in Server-Timing"""
+    client = flask_app.app.test_client()
+
+    response = client.post('/result', data=_form(1))
+
+    # Test that every stage of the request is timed
+    assert response.status_code == 200
+    stages = [timing.split(';')[0] for timing in response.headers['Server-Timing'].split(', ')]
+    assert stages == ['encode', 'model_load', 'inference', 'db_write']
+
+
+def test_result_stores_prediction(flask_app):
+    """test9 (/result): happy path storing the applicant with its prediction"""
+    client = flask_app.app.test_client()
+    manager = flask_app.application_manager
+
+    response = client.post('/result', data=_form(7))
+    expected = _lines(client.post('/predict/batch', data=json.dumps([_applicant(7)]),
+                                  content_type='application/json'))[0]
+
+    # the rows are inserted by the write-behind thread, so wait for the row to show up
+    deadline = time.monotonic() + 5
+    stored = []
+    while not stored and time.monotonic() < deadline:
+        stored = [row for row in manager.recent_applications(scored_only=True)
+                  if row['income_total'] == _applicant(7)['income_total']]
+        time.sleep(0.05)
+
+    # Test that the applicant is stored once with the prediction it was shown
+    assert response.status_code == 200
+    assert len(stored) == 1
+    assert stored[0]['pred_prob'] == pytest.approx(expected['pred_prob'])
+    assert stored[0]['pred_class'] == expected['pred_class']
@@ -0,0 +1,63 @@
+"""
+Test artifacts.py module
+"""
+import pytest
+
+import pandas as pd
+import numpy as np
+
+from src.artifacts import save_artifact, load_artifact, ArtifactWriter
+
+
+def _sample_df():
+    """Build a small DataFrame with the column types found in pipeline artifacts"""
+    return pd.DataFrame({'num_children': np.array([0, 2, 1], dtype=np.int64),
+                         'income_total': [202500.0, 270000.0, np.nan],
+                         'gender': ['Male', 'Female', None],
+                         'edu_type': pd.Categorical(['Higher education', 'Secondary education',
+                                                     'Higher education']),
+                         'own_car_Yes': [True, False, True]})
+
+
+def test_npz_round_trip(tmp_path):
+    """test1 (save_artifact() & load_artifact()): happy path keeping dtypes and categoricals"""
+    df_true = _sample_df()
+    path = str(tmp_path / 'cleaned.npz')
+
+    save_artifact(df_true, path)
+    df_test = load_artifact(path)
+
+    # Test that the true and test are the same
+    pd.testing.assert_frame_equal(df_test, df_true)
+
+
+def test_parquet_round_trip(tmp_path):
+    """test2 (save_artifact() & load_artifact()): happy path for parquet artifacts"""
+    pytest.importorskip('pyarrow')
+    df_true = _sample_df()
+    path = str(tmp_path / 'cleaned.parquet')
+
+    save_artifact(df_true, path)
+    df_test = load_artifact(path)
+
+    pd.testing.assert_frame_equal(df_test, df_true)
+
+
+def test_unsupported_extension(tmp_path):
+    """test3 (save_artifact()): unhappy path when the extension is not supported"""
+    with pytest.raises(ValueError):
+        save_artifact(_sample_df(), str(tmp_path / 'cleaned.xlsx'))
+
+
+def test_artifact_writer_append(tmp_path):
+    """test4 (ArtifactWriter.write()): happy path appending chunks to a CSV artifact"""
+    df_true = pd.DataFrame({'id': [1, 2, 3, 4, 5], 'gender': ['M', 'F', 'F', 'M', 'F']})
+    path = str(tmp_path / 'cleaned.csv')
+
+    with ArtifactWriter(path) as writer:
+        writer.write(df_true.iloc[:2])
+        writer.write(df_true.iloc[2:])
+
+    # Test that the chunks were appended after a single header
+    assert writer.n_rows == 5
+    pd.testing.assert_frame_equal(load_artifact(path), df_true)
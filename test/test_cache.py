@@ -0,0 +1,64 @@
+"""
+Test cache.py module
+"""
+import os
+
+import pytest
+
+import pandas as pd
+
+from src.cache import StageCache, hash_dataframe
+
+
+def test_stage_cache_hit(tmp_path):
+    """test1 (StageCache.run()): happy path where an unchanged stage is not run again"""
+    cache = StageCache(str(tmp_path), max_size_mb=10)
+    calls = []
+
+    def stage():
+        calls.append(1)
+        return pd.DataFrame({'Age': [23., 45.], 'Employed': ['Yes', 'No']})
+
+    first, key = cache.run('featurize', 'input', {'new_col': 'Employed'}, 'v1', stage)
+    second, key_again = cache.run('featurize', 'input', {'new_col': 'Employed'}, 'v1', stage)
+
+    # Test that the stage ran once and the cached output is the same
+    assert len(calls) == 1
+    assert key == key_again
+    pd.testing.assert_frame_equal(first, second)
+
+
+def test_stage_cache_miss_on_change(tmp_path):
+    """test2 (StageCache.run()): happy path where a change of config or code reruns the stage"""
+    cache = StageCache(str(tmp_path), max_size_mb=10)
+    calls = []
+
+    def stage():
+        calls.append(1)
+        return {'n_estimators': len(calls)}
+
+    cache.run('model', 'input', {'n_estimat': 10}, 'v1', stage)
+    cache.run('model', 'input', {'n_estimat': 20}, 'v1', stage)
+    cache.run('model', 'input', {'n_estimat': 20}, 'v2', stage)
+    cache.run('model', 'other input', {'n_estimat': 20}, 'v2', stage)
+
+    assert len(calls) == 4
+
+
+def test_stage_cache_eviction(tmp_path):
+    """test3 (StageCache.evict()): happy path removing the least recently used entries"""
+    cache = StageCache(str(tmp_path), max_size_mb=10)
+    for i in range(3):
+        cache.put('entry%i' % i, b'x' * 1000)
+        os.utime(str(tmp_path / ('entry%i.joblib' % i)), (i, i))
+    cache.max_bytes = os.path.getsize(str(tmp_path / 'entry0.joblib')) * 2
+
+    cache.evict()
+
+    assert sorted(os.listdir(str(tmp_path))) == ['entry1.joblib', 'entry2.joblib']
+
+
+def test_hash_dataframe_non_df():
+    """test4 (hash_dataframe()): unhappy path when dataframe is not provided"""
+    with pytest.raises(AttributeError):
+        hash_dataframe('I am not a DataFrame')
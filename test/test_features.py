@@ -6,7 +6,7 @@ import pytest
 import pandas as pd
 import numpy as np
 
-from src.features import day_to_year, create_new_col, get_ohe_data
+from src.features import day_to_year, create_new_col, get_ohe_data, featurize
 
 
 def test_day_to_year():
@@ -241,3 +241,32 @@ def test_get_ohe_data_non_df():
 
     with pytest.raises(TypeError):
         get_ohe_data(df_in, cat_vars, num_vars, 'target')
+
+
+def _legacy_featurize(df, dty_cols_dict, old_col, new_col):
+    """Element-wise featurize that the column-level implementation replaced"""
+    for key, value in dty_cols_dict.items():
+        df[key] = df[value].apply(lambda x: np.round(x/365))
+    df[new_col] = ['Yes' if i >= 0 else 'No' for i in df[old_col]]
+    return df
+
+
+def test_featurize_matches_legacy():
+    """test7 (featurize()): happy path giving identical output to the element-wise implementation"""
+    rng = np.random.RandomState(0)
+    n = 1000
+    df_in = pd.DataFrame({'days_birth': rng.randint(7489, 25229, n),
+                          'days_employed': rng.choice([-365243, 0, 182, 183, 547, 9000], n),
+                          'days_id_change': rng.randint(0, 7197, n).astype(float)},
+                         index=rng.permutation(n))
+    kwargs = dict(dty_cols_dict={'Age': 'days_birth',
+                                 'Years_Employed': 'days_employed',
+                                 'Years_ID_Publish': 'days_id_change'},
+                  old_col='days_employed',
+                  new_col='Employed')
+
+    df_true = _legacy_featurize(df_in.copy(), **kwargs)
+    df_test = featurize(df_in.copy(), **kwargs)
+
+    # Test that the true and test are the same
+    pd.testing.assert_frame_equal(df_test, df_true)
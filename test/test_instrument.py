@@ -0,0 +1,84 @@
+"""
+Test instrument.py module
+"""
+import json
+import os
+
+import pytest
+
+import numpy as np
+import pandas as pd
+
+from src.instrument import instrument, count_rows, run_summary, RunSummary, StageMeter
+
+
+def test_stage_meter(tmp_path):
+    """test1 (StageMeter()): happy path recording the rows, times and peak memory of stages"""
+    summary = RunSummary()
+    df = pd.DataFrame({'a': range(10)})
+    with StageMeter('outer', rows_in=len(df), summary=summary) as outer:
+        with StageMeter('inner', summary=summary):
+            # about 80 MB allocated and freed within the inner stage
+            big = np.ones(10000000)
+            big[::512] = 2
+            del big
+        outer.rows_out = 2 * len(df)
+
+    path = str(tmp_path / 'run_summary.json')
+    written = summary.write(path, step='test')
+    with open(path) as f:
+        saved = json.load(f)
+    assert saved == json.loads(json.dumps(written))
+    assert saved['step'] == 'test'
+    assert [record['stage'] for record in saved['stages']] == ['inner', 'outer']
+    assert saved['totals']['outer']['rows_in'] == 10
+    assert saved['totals']['outer']['rows_out'] == 20
+    # the peak of each stage is only measured on its own on Linux
+    if os.path.exists('/proc/self/clear_refs'):
+        assert saved['stages'][0]['peak_delta_mb'] > 50
+        # the peak of the inner stage also counts for the stage around it
+        assert saved['stages'][1]['peak_delta_mb'] >= saved['stages'][0]['peak_delta_mb'] - 1
+
+
+def test_instrument_default_summary():
+    """test2 (instrument()): happy path adding the rows in and out to the default summary"""
+    run_summary.reset()
+
+    @instrument()
+    def double(df):
+        return [None, pd.concat([df, df])]
+
+    double(pd.DataFrame({'a': range(10)}))
+    record = run_summary.summary()['stages'][-1]
+    assert record['stage'] == 'double'
+    assert record['status'] == 'ok'
+    assert (record['rows_in'], record['rows_out']) == (10, 20)
+    assert record['wall_s'] >= 0 and record['cpu_s'] >= 0 and record['peak_delta_mb'] >= 0
+
+
+def test_instrument_error():
+    """test3 (instrument()): unhappy path recording a stage that raised an error"""
+    run_summary.reset()
+
+    @instrument('failing')
+    def fail(df):
+        raise ValueError('bad input')
+
+    with pytest.raises(ValueError):
+        fail(pd.DataFrame({'a': [1]}))
+    record = run_summary.summary()['stages'][-1]
+    assert (record['stage'], record['status'], record['rows_in']) == ('failing', 'error', 1)
+
+
+def test_count_rows():
+    """test4 (count_rows()): happy path counting the rows of the outputs of stages"""
+    assert count_rows(pd.DataFrame({'a': range(4)})) == 4
+    assert count_rows(np.zeros((3, 2))) == 3
+    assert count_rows(['model', pd.Series(range(5)), pd.Series(range(5))]) == 5
+
+
+def test_count_rows_no_rows():
+    """test5 (count_rows()): unhappy path for objects without rows"""
+    assert count_rows('data/sample/application_data.csv') is None
+    assert count_rows(None) is None
+    assert count_rows(np.float64(1.0)) is None
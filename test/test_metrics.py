@@ -0,0 +1,56 @@
+"""
+Test metrics.py module
+"""
+import pytest
+
+from src.metrics import MetricsRegistry
+
+
+def test_render():
+    """test1 (MetricsRegistry.render()): happy path rendering counters, histograms and callbacks"""
+    metrics = MetricsRegistry()
+    requests = metrics.counter('requests_total', 'Requests handled', ('route', 'status'))
+    latency = metrics.histogram('latency_seconds', 'Request latency', ('route',),
+                                buckets=(0.1, 1.0))
+    metrics.callback('cache_hit_rate', 'Share of hits', lambda: 0.25)
+    metrics.callback('model_info', 'Model in use', lambda: [({'version': 'a"b'}, 1)])
+
+    requests.inc(route='/result', status=200)
+    requests.inc(2, route='/result', status=200)
+    for value in (0.05, 0.1, 0.5, 3.0):
+        latency.observe(value, route='/result')
+
+    lines = metrics.render().splitlines()
+    assert '# TYPE requests_total counter' in lines
+    assert 'requests_total{route="/result",status="200"} 3' in lines
+    # Test that the buckets are cumulative and that a value on a bound is in that bucket
+    assert 'latency_seconds_bucket{route="/result",le="0.1"} 2' in lines
+    assert 'latency_seconds_bucket{route="/result",le="1.0"} 3' in lines
+    assert 'latency_seconds_bucket{route="/result",le="+Inf"} 4' in lines
+    assert 'latency_seconds_count{route="/result"} 4' in lines
+    assert 'latency_seconds_sum{route="/result"} 3.65' in lines
+    assert 'cache_hit_rate 0.25' in lines
+    assert 'model_info{version="a\\"b"} 1' in lines
+
+
+def test_render_failing_callback():
+    """test2 (MetricsRegistry.render()): unhappy path leaving out a metric whose callback fails"""
+    metrics = MetricsRegistry()
+    metrics.callback('broken', 'Fails to collect', lambda: 1 / 0)
+    metrics.counter('requests_total', 'Requests handled').inc()
+
+    text = metrics.render()
+    assert 'broken' not in text
+    assert 'requests_total 1' in text.splitlines()
+
+
+def test_counter_wrong_labels():
+    """test3 (Counter.inc()): unhappy path with missing labels or a negative increment"""
+    metrics = MetricsRegistry()
+    requests = metrics.counter('requests_total', 'Requests handled', ('route',))
+    with pytest.raises(ValueError):
+        requests.inc(status=200)
+    with pytest.raises(ValueError):
+        requests.inc(-1, route='/result')
+    with pytest.raises(ValueError):
+        metrics.counter('requests_total', 'Registered twice')
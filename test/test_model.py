@@ -0,0 +1,91 @@
+"""
+Test model.py module
+"""
+import pytest
+
+import pandas as pd
+import numpy as np
+
+from src.model import train_model, evaluate, get_sample_weight
+
+
+def _featurized_data(n=400, seed=0):
+    """Build a small one-hot encoded DataFrame with an imbalanced target"""
+    rng = np.random.RandomState(seed)
+    data = pd.DataFrame({'income_total': rng.randint(50000, 300000, n).astype(float),
+                         'Age': rng.randint(20, 70, n).astype(float),
+                         'gender_Male': rng.randint(0, 2, n)})
+    data['target'] = ((data['Age'] < 30) & (rng.rand(n) < 0.6)).astype(int)
+    return data
+
+
+def test_train_model_n_jobs():
+    """test1 (train_model()): happy path giving the same model for any number of cores"""
+    data = _featurized_data()
+    kwargs = dict(target_colname='target', sample_strat=0.5, ts=0.4,
+                  n_estimat=10, max_dep=5, rand_state=0)
+
+    rf_single, X_test, _ = train_model(data.copy(), n_jobs=1, **kwargs)
+    rf_parallel, _, _ = train_model(data.copy(), n_jobs=2, **kwargs)
+
+    # Test that the trees are the same, and that scoring in parallel only changes
+    # the order in which the tree probabilities are summed
+    proba_parallel = rf_parallel.predict_proba(X_test)
+    rf_parallel.set_params(n_jobs=1)
+    assert np.array_equal(rf_single.predict_proba(X_test), rf_parallel.predict_proba(X_test))
+    assert np.allclose(rf_single.predict_proba(X_test), proba_parallel)
+
+
+def test_evaluate(tmp_path):
+    """test2 (evaluate()): happy path saving AUC and accuracy"""
+    data = _featurized_data()
+    rf, X_test, y_test = train_model(data, 'target', 0.5, 0.4, 10, 5, 0)
+    save_path = str(tmp_path / 'evaluation_result.csv')
+
+    n_jobs = rf.n_jobs
+    evaluate(rf, X_test, y_test, save_path, n_jobs=2)
+
+    result = pd.read_csv(save_path)
+    assert list(result.columns) == ['AUC', 'ACC']
+    # Test that scoring with other cores leaves the setting of the model that is saved
+    assert rf.n_jobs == n_jobs != 2
+    assert result['ACC'][0] == pytest.approx(np.mean(rf.predict(X_test) == y_test))
+
+
+def test_train_model_non_df():
+    """test3 (train_model()): unhappy path when dataframe is not provided"""
+    with pytest.raises(AttributeError):
+        train_model('I am not a DataFrame', 'target', 0.5, 0.4, 10, 5, 0)
+
+
+def test_train_model_holdout():
+    """test4 (train_model()): happy path keeping the test rows out of training and unweighted"""
+    data = _featurized_data()
+    data['row_id'] = np.arange(len(data))
+
+    rf, X_test, y_test = train_model(data, 'target', 0.5, 0.4, 10, 5, 0)
+
+    # Test that the test set is a stratified split of distinct original rows
+    assert len(X_test) == 160
+    assert X_test['row_id'].is_unique
+    assert y_test.mean() == pytest.approx(data['target'].mean(), abs=0.01)
+    assert np.array_equal(y_test, data['target'].to_numpy()[X_test['row_id']])
+
+
+def test_get_sample_weight():
+    """test5 (get_sample_weight()): happy path matching the counts of random oversampling"""
+    y_train = np.array([0] * 80 + [1] * 10)
+
+    weight = get_sample_weight(y_train, 0.5, 'weight', 0)
+    drawn = get_sample_weight(y_train, 0.5, 'oversample', 0)
+
+    # Test that both modes weigh the minor class up to half the major class
+    assert weight[y_train == 1].sum() == pytest.approx(40)
+    assert drawn[y_train == 1].sum() == 40
+    assert np.all(weight[y_train == 0] == 1) and np.all(drawn[y_train == 0] == 1)
+
+
+def test_get_sample_weight_unknown():
+    """test6 (get_sample_weight()): unhappy path when the resampling is not supported"""
+    with pytest.raises(ValueError):
+        get_sample_weight(np.array([0, 1]), 0.5, 'smote', 0)
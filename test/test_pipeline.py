@@ -0,0 +1,99 @@
+"""
+Test pipeline.py module
+"""
+import os
+
+import pytest
+
+import pandas as pd
+import numpy as np
+import yaml
+
+from src.acquire import import_data, clean
+from src.features import featurize, get_ohe_data
+from src.pipeline import run_all, stream_clean_featurize
+from src.artifacts import load_artifact
+
+
+def _raw_data(n, seed=0):
+    """Build a small DataFrame shaped like the raw application data"""
+    rng = np.random.RandomState(seed)
+    return pd.DataFrame({
+        'SK_ID_CURR': np.arange(n),
+        'TARGET': (rng.rand(n) < 0.2).astype(int),
+        'NAME_CONTRACT_TYPE': rng.choice(['Cash loans', 'Revolving loans'], n),
+        'CODE_GENDER': rng.choice(['M', 'F', 'XNA'], n),
+        'FLAG_OWN_CAR': rng.choice(['Y', 'N'], n),
+        'FLAG_OWN_REALTY': rng.choice(['Y', 'N'], n),
+        'CNT_CHILDREN': rng.randint(0, 3, n),
+        'AMT_INCOME_TOTAL': rng.randint(50000, 300000, n).astype(float),
+        'AMT_CREDIT': rng.randint(50000, 1000000, n).astype(float),
+        'AMT_ANNUITY': rng.randint(5000, 50000, n).astype(float),
+        'AMT_GOODS_PRICE': rng.randint(50000, 1000000, n).astype(float),
+        'NAME_INCOME_TYPE': rng.choice(['Working', 'State servant', 'Commercial associate',
+                                        'Pensioner'], n),
+        'NAME_EDUCATION_TYPE': rng.choice(['Secondary / secondary special', 'Higher education',
+                                           'Incomplete higher', 'Lower secondary'], n),
+        'NAME_FAMILY_STATUS': rng.choice(['Single / not married', 'Married', 'Widow'], n),
+        'DAYS_BIRTH': -rng.randint(7489, 25229, n),
+        'DAYS_EMPLOYED': np.where(rng.rand(n) < 0.2, 365243, -rng.randint(0, 17912, n)),
+        'DAYS_ID_PUBLISH': -rng.randint(0, 7197, n),
+        'FLAG_CONT_MOBILE': rng.choice([0, 1], n),
+        'CNT_FAM_MEMBERS': rng.randint(1, 5, n).astype(float),
+        'AMT_REQ_CREDIT_BUREAU_DAY': np.where(rng.rand(n) < 0.1, np.nan, 0.)})
+
+
+@pytest.fixture
+def conf(tmp_path):
+    """Pipeline configuration from config.yaml pointed at a small raw file in tmp_path"""
+    with open('config/config.yaml', 'r') as f:
+        conf = yaml.load(f, Loader=yaml.FullLoader)
+    raw_path = str(tmp_path / 'application_data.csv')
+    _raw_data(300).to_csv(raw_path, index=False)
+    conf['acquire']['import_data']['path'] = raw_path
+    conf['model']['evaluate']['save_path'] = str(tmp_path / 'evaluation_result.csv')
+    return conf
+
+
+def test_run_all(conf, tmp_path):
+    """test1 (run_all()): happy path running every stage in memory"""
+    featurized_path = str(tmp_path / 'featurized.npz')
+
+    rf = run_all(conf, featurized_path=featurized_path)
+
+    # Test that the model was trained on the featurized columns and evaluated
+    featurized = load_artifact(featurized_path)
+    assert rf.predict_proba(featurized.drop(columns=['target'])).shape == (len(featurized), 2)
+    assert os.path.exists(conf['model']['evaluate']['save_path'])
+    assert not os.path.exists(str(tmp_path / 'cleaned.npz'))
+
+
+def test_run_all_missing_data(conf):
+    """test2 (run_all()): unhappy path when the raw data does not exist"""
+    conf['acquire']['import_data']['path'] = 'missing/application_data.csv'
+
+    with pytest.raises(FileNotFoundError):
+        run_all(conf)
+
+
+def test_stream_clean_featurize_parity(conf, tmp_path):
+    """test3 (stream_clean_featurize()): happy path keeping the rows of the batch steps"""
+    raw = _raw_data(300)
+    rng = np.random.RandomState(1)
+    # sparse columns of the raw data that the pipeline does not use
+    raw['OWN_CAR_AGE'] = np.where(rng.rand(300) < 0.5, np.nan, 5.)
+    raw['OCCUPATION_TYPE'] = np.where(rng.rand(300) < 0.1, None, 'Laborers')
+    raw.to_csv(conf['acquire']['import_data']['path'], index=False)
+    conf['acquire']['stream']['chunksize'] = 70
+    output_path = str(tmp_path / 'featurized.csv')
+
+    n_rows = stream_clean_featurize(conf, output_path)
+
+    # Test that the streamed rows and their encoding match the batch steps
+    streamed = load_artifact(output_path)
+    batch = featurize(clean(import_data(**conf['acquire']['import_data']),
+                            **conf['acquire']['clean']), **conf['features']['featurize'])
+    assert n_rows == len(batch) < 300
+    assert list(streamed['id']) == list(batch['id'])
+    ohe_conf = conf['features']['get_ohe_data']
+    assert get_ohe_data(streamed, **ohe_conf).shape == get_ohe_data(batch, **ohe_conf).shape
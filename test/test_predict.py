@@ -1,11 +1,20 @@
 """
 Test predict.py module
 """
+import io
+import os
+
 import pytest
 
+import joblib
+import numpy as np
 import pandas as pd
+import sklearn.ensemble
+import yaml
 
-from src.predict import transform_input
+from src.model import export_forest
+from src.predict import transform_input, get_prediction, InputEncoder, ModelRegistry, \
+    FlatForest, PredictionCache, load_model, read_applicants, score_batch
 
 
 def test_transform_input():
@@ -82,3 +91,284 @@ def test_transform_input_non_dict():
 
     with pytest.raises(ValueError):
         transform_input(sample_input, col_li, ohe_cols)
+
+
+def test_model_registry_cached(tmp_path):
+    """test3 (ModelRegistry.get()): happy path where the model is unpickled only once"""
+    model_path = str(tmp_path / 'model.joblib')
+    joblib.dump({'name': 'model'}, model_path)
+    registry = ModelRegistry()
+
+    first = registry.get(model_path)
+    second = registry.get(model_path)
+
+    # Test that the same in-memory object is returned
+    assert first is second
+
+
+def test_model_registry_reload(tmp_path):
+    """test4 (ModelRegistry.get()): happy path where a changed model file is reloaded"""
+    model_path = str(tmp_path / 'model.joblib')
+    joblib.dump({'name': 'old'}, model_path)
+    registry = ModelRegistry()
+    old_fingerprint = registry.fingerprint(model_path)
+    assert registry.get(model_path)['name'] == 'old'
+
+    joblib.dump({'name': 'new model'}, model_path)
+    os.utime(model_path, ns=(0, 10 ** 18))
+
+    # Test that the new model and a new fingerprint are returned
+    assert registry.get(model_path)['name'] == 'new model'
+    assert registry.fingerprint(model_path) != old_fingerprint
+
+
+def test_model_registry_missing(tmp_path):
+    """test5 (ModelRegistry.get()): unhappy path when the model file does not exist"""
+    registry = ModelRegistry()
+
+    with pytest.raises(OSError):
+        registry.get(str(tmp_path / 'missing.joblib'))
+
+
+def test_get_prediction_single_pass(tmp_path):
+    """test6 (get_prediction()): happy path where the class agrees with the model's predict"""
+    rng = np.random.RandomState(0)
+    X = pd.DataFrame(rng.rand(200, 3), columns=['a', 'b', 'c'])
+    y = (X['a'] + rng.rand(200) * 0.5 > 0.75).astype(int)
+    rf = sklearn.ensemble.RandomForestClassifier(n_estimators=5, max_depth=3, random_state=0)
+    rf.fit(X, y)
+    model_path = str(tmp_path / 'rf.joblib')
+    joblib.dump(rf, model_path)
+
+    for i in range(20):
+        row = X.iloc[[i]]
+        prediction = get_prediction(row, model_path, ['a', 'b', 'c'])
+        # Test that probability and class come from the same forward pass
+        assert prediction.pred_prob == np.round(100 * rf.predict_proba(row)[:, 1][0], 2)
+        assert prediction.pred_class == rf.predict(row)[0]
+
+    # Test that scoring on more cores leaves the model shared through the registry unchanged
+    get_prediction(X.iloc[[0]], model_path, ['a', 'b', 'c'], n_jobs=2)
+    assert load_model(model_path).n_jobs is None
+
+
+def test_get_prediction_threshold(tmp_path):
+    """test7 (get_prediction()): happy path where the cutoff decides the class"""
+    X = pd.DataFrame({'a': [0., 0., 1., 1.]})
+    y = [0, 1, 1, 1]
+    rf = sklearn.ensemble.RandomForestClassifier(n_estimators=3, random_state=0)
+    rf.fit(X, y)
+    model_path = str(tmp_path / 'rf.joblib')
+    joblib.dump(rf, model_path)
+
+    row = X.iloc[[0]]
+    prob = rf.predict_proba(row)[:, 1][0]
+
+    assert get_prediction(row, model_path, ['a'], threshold=prob - 0.01).pred_class == 1
+    assert get_prediction(row, model_path, ['a'], threshold=prob).pred_class == 0
+
+
+def _legacy_transform_input(ui_dict, cat_cols, ohe_cols):
+    """DataFrame-based transform_input that the compiled encoder replaced"""
+    input_df = pd.DataFrame(ui_dict, index=[0])
+    for col in cat_cols:
+        input_df = input_df.rename(columns={col: col + '_' + str(input_df[col].values[0])})
+    for col in input_df.columns:
+        if not str.isdigit(str(input_df[col].values[0])):
+            input_df[col] = 1
+    ohe_empty = pd.DataFrame(columns=ohe_cols)
+    return ohe_empty.T.join(input_df.T).fillna(0).T
+
+
+def test_input_encoder_parity():
+    """test8 (InputEncoder.encode()): happy path matching the DataFrame-based transformation"""
+    with open('config/config.yaml', 'r') as f:
+        conf = yaml.load(f, Loader=yaml.FullLoader)['predict']['transform_input']
+    encoder = InputEncoder(**conf)
+
+    # form input arrives as strings, the unit test input above uses integers
+    form_input = {'contract_type': 'Revolving loans', 'gender': 'Male', 'own_car': 'No',
+                  'own_realty': 'Yes', 'num_children': '2', 'income_total': '135000',
+                  'amt_credit': '513000', 'amt_annuity': '24939',
+                  'amt_goods_price': '450000', 'income_type': 'Pensioner',
+                  'edu_type': 'Higher education', 'family_status': 'Widow',
+                  'Age': '61', 'Years_Employed': '0', 'Years_ID_Publish': '12',
+                  'phone_contactable': 'Yes', 'cnt_family_members': '1',
+                  'amt_req_credit_bureau_day': '0', 'Employed': 'No'}
+    int_input = {'contract_type': 'Cash loans', 'gender': 'Not Provided', 'own_car': 'Yes',
+                 'own_realty': 'No', 'num_children': 0, 'income_total': 200000,
+                 'amt_credit': 10000, 'amt_annuity': 14000,
+                 'amt_goods_price': 30000, 'income_type': 'Working',
+                 'edu_type': 'Secondary education', 'family_status': 'Married',
+                 'Age': 23, 'Years_Employed': 2, 'Years_ID_Publish': 10,
+                 'phone_contactable': 'No', 'cnt_family_members': 4,
+                 'amt_req_credit_bureau_day': 1, 'Employed': 'Yes'}
+
+    for ui_dict in [form_input, int_input]:
+        legacy = _legacy_transform_input(ui_dict, **conf).values.astype(float)
+        # Test that the compiled encoder gives the same feature row
+        assert np.array_equal(encoder.encode(ui_dict), legacy)
+
+
+def test_input_encoder_non_dict():
+    """test9 (InputEncoder.encode()): unhappy path when a dictionary is not provided"""
+    encoder = InputEncoder(['gender'], ['Age', 'gender_Male'])
+
+    with pytest.raises(ValueError):
+        encoder.encode('I am not a dictionary')
+
+
+def test_score_batch(tmp_path):
+    """test10 (score_batch()): happy path matching single-applicant predictions"""
+    encoder = InputEncoder(['gender'], ['Age', 'gender_Male'])
+    rng = np.random.RandomState(0)
+    X = pd.DataFrame({'Age': rng.randint(20, 70, 100), 'gender_Male': rng.randint(0, 2, 100)})
+    y = ((X['Age'] > 40) ^ (X['gender_Male'] == 1)).astype(int)
+    rf = sklearn.ensemble.RandomForestClassifier(n_estimators=5, max_depth=3, random_state=0)
+    rf.fit(X.values, y)
+    model_path = str(tmp_path / 'rf.joblib')
+    joblib.dump(rf, model_path)
+
+    records = [{'id': i, 'Age': age, 'gender': 'Male' if male else 'Female'}
+               for i, (age, male) in enumerate(X.values)]
+    results = list(score_batch(records, encoder, model_path, chunk_size=7))
+
+    # Test that every applicant is scored in order, as if scored one at a time
+    assert [result['id'] for result in results] == list(range(100))
+    for record, result in zip(records, results):
+        single = get_prediction(encoder.encode(record), model_path, encoder.ohe_cols)
+        assert result['pred_prob'] == single.pred_prob
+        assert result['pred_class'] == single.pred_class
+
+
+def test_read_applicants_csv():
+    """test11 (read_applicants()): happy path for CSV input with a missing field"""
+    file = io.StringIO('Age,gender\n30,Male\n,Female\n')
+
+    assert list(read_applicants(file, 'csv')) == [{'Age': '30', 'gender': 'Male'},
+                                                  {'gender': 'Female'}]
+
+
+def test_read_applicants_unknown_format():
+    """test12 (read_applicants()): unhappy path when the format or a record is not supported"""
+    with pytest.raises(ValueError):
+        list(read_applicants(io.StringIO(''), 'xml'))
+    with pytest.raises(ValueError):
+        list(read_applicants(io.StringIO('{"Age": 30}\n[1, 2]\n'), 'jsonl'))
+
+
+def test_flat_forest_parity(tmp_path):
+    """test13 (FlatForest.predict_proba()): happy path matching the sklearn forest"""
+    rng = np.random.RandomState(0)
+    X = rng.rand(500, 4) * 100
+    y = (X[:, 0] + rng.rand(500) * 50 > 70).astype(int)
+    rf = sklearn.ensemble.RandomForestClassifier(n_estimators=20, max_depth=6, random_state=0)
+    rf.fit(X, y, sample_weight=np.where(y == 1, 2.0, 1.0))
+    save_dir = str(tmp_path / 'rf.forest')
+    export_forest(rf, save_dir)
+
+    forest = ModelRegistry().get(save_dir)
+    X_new = rng.rand(300, 4) * 100
+
+    # Test that the flat forest is loaded from the directory and scores like sklearn
+    assert isinstance(forest, FlatForest)
+    assert np.allclose(forest.predict_proba(X_new), rf.predict_proba(X_new))
+    assert list(forest.classes_) == list(rf.classes_)
+    for row in X_new[:10]:
+        prediction = get_prediction(row.reshape(1, -1), save_dir, None)
+        assert prediction.pred_class == rf.predict(row.reshape(1, -1))[0]
+
+
+def test_flat_forest_wrong_features(tmp_path):
+    """test14 (FlatForest.predict_proba()): unhappy path when the number of features differs"""
+    rf = sklearn.ensemble.RandomForestClassifier(n_estimators=2, random_state=0)
+    rf.fit([[0., 1.], [1., 0.]], [0, 1])
+    export_forest(rf, str(tmp_path / 'rf.forest'))
+    forest = FlatForest.load(str(tmp_path / 'rf.forest'))
+
+    with pytest.raises(ValueError):
+        forest.predict_proba(np.zeros((1, 3)))
+
+
+def test_model_registry_mmap(tmp_path):
+    """test15 (ModelRegistry.get()): happy path memory-mapping an export across reloads"""
+    rf = sklearn.ensemble.RandomForestClassifier(n_estimators=3, random_state=0)
+    rf.fit([[0., 1.], [1., 0.], [1., 1.]], [0, 1, 1])
+    save_dir = str(tmp_path / 'rf.forest')
+    export_forest(rf, save_dir)
+    registry = ModelRegistry()
+
+    forest = registry.get(save_dir, mmap_mode='r')
+    os.utime(os.path.join(save_dir, 'meta.json'), ns=(0, 10 ** 18))
+    reloaded = registry.get(save_dir)
+
+    # Test that the arrays are read-only maps of the files, also after a reload
+    assert reloaded is not forest
+    for model in (forest, reloaded):
+        assert isinstance(model.children, np.memmap)
+        assert not model.children.flags.writeable
+    assert np.allclose(reloaded.predict_proba([[1., 0.]]), rf.predict_proba([[1., 0.]]))
+
+
+def test_model_registry_export_fallback(tmp_path):
+    """test16 (ModelRegistry.get()): happy path loading the joblib model until it is exported"""
+    rf = sklearn.ensemble.RandomForestClassifier(n_estimators=3, random_state=0)
+    rf.fit([[0., 1.], [1., 0.], [1., 1.]], [0, 1, 1])
+    joblib.dump(rf, str(tmp_path / 'rf.joblib'))
+    save_dir = str(tmp_path / 'rf.forest')
+    registry = ModelRegistry()
+
+    fallback = registry.get(save_dir)
+    fallback_fingerprint = registry.fingerprint(save_dir)
+    export_forest(rf, save_dir)
+
+    # Test that the joblib model stands in for the missing export, which is used once saved
+    assert isinstance(fallback, sklearn.ensemble.RandomForestClassifier)
+    assert 'rf.joblib' in fallback_fingerprint
+    assert np.allclose(registry.get(save_dir).predict_proba([[1., 0.]]),
+                       rf.predict_proba([[1., 0.]]))
+    assert registry.fingerprint(save_dir) != fallback_fingerprint
+
+
+def test_prediction_cache_get_prediction(tmp_path):
+    """test17 (get_prediction()): happy path caching predictions until the model changes"""
+    X = pd.DataFrame({'a': [0., 0., 1., 1.]})
+    rf = sklearn.ensemble.RandomForestClassifier(n_estimators=3, random_state=0)
+    rf.fit(X.values, [0, 0, 1, 1])
+    model_path = str(tmp_path / 'rf.joblib')
+    joblib.dump(rf, model_path)
+    cache = PredictionCache(max_size=10, ttl=60)
+
+    first = get_prediction(np.array([[0.]]), model_path, ['a'], cache=cache)
+    second = get_prediction(np.array([[0.]]), model_path, ['a'], cache=cache)
+    get_prediction(np.array([[0.]]), model_path, ['a'], threshold=0.9, cache=cache)
+    assert second is first and first.pred_class == 0
+    assert (cache.hits, cache.misses) == (1, 2)
+
+    # Test that replacing the model file drops the cached predictions
+    rf.fit(X.values, [1, 1, 0, 0])
+    joblib.dump(rf, model_path)
+    os.utime(model_path, ns=(0, 10 ** 18))
+    third = get_prediction(np.array([[0.]]), model_path, ['a'], cache=cache)
+    assert third.pred_class == 1
+    assert cache.stats()['size'] == 1
+
+
+def test_prediction_cache_bounds():
+    """test18 (PredictionCache): happy path evicting the least recently used and expired entries"""
+    cache = PredictionCache(max_size=2, ttl=60)
+    for key in ('a', 'b'):
+        cache.get(key, 'model')
+        cache.put(key, 'model', key.upper())
+    cache.get('a', 'model')
+    cache.put('c', 'model', 'C')
+
+    # Test that 'b', the least recently used entry, was evicted
+    assert cache.get('b', 'model') is None
+    assert (cache.get('a', 'model'), cache.get('c', 'model')) == ('A', 'C')
+    assert cache.evictions == 1
+
+    expired = PredictionCache(max_size=2, ttl=-1)
+    expired.get('a', 'model')
+    expired.put('a', 'model', 'A')
+    assert expired.get('a', 'model') is None
@@ -0,0 +1,60 @@
+"""
+Test profiling.py module
+"""
+import os
+import sys
+import time
+
+from src.profiling import ProfileWriter, StackProfiler
+
+
+def _slow():
+    """Function that spends its time sleeping"""
+    time.sleep(0.02)
+
+
+def test_stack_profiler():
+    """test1 (StackProfiler.profile()): happy path recording folded stacks under the root frames"""
+    profiler = StackProfiler()
+    with profiler.profile('POST /result', 'inference'):
+        _slow()
+    assert sys.getprofile() is None
+
+    stacks = {}
+    for line in profiler.folded().splitlines():
+        stack, us = line.rsplit(' ', 1)
+        stacks[stack] = int(us)
+    slow = [stack for stack in stacks if stack.endswith('time.sleep')]
+    assert len(slow) == 1
+    assert slow[0].startswith('POST /result;inference;_slow (test_profiling.py:')
+    # Test that the time is in microseconds
+    assert 15000 < stacks[slow[0]] < 1000000
+    assert all(stack.startswith('POST /result;inference') for stack in stacks)
+
+
+def test_profile_writer(tmp_path):
+    """test2 (ProfileWriter): happy path sampling requests and keeping the latest profiles"""
+    writer = ProfileWriter(str(tmp_path / 'profiles'), sample_every=3, max_files=2)
+    assert [writer.should_profile() for _ in range(6)] == [False, False, True] * 2
+    assert writer.should_profile(requested=True)
+
+    paths = []
+    for _ in range(3):
+        profiler = StackProfiler()
+        with profiler.profile('GET /x'):
+            _slow()
+        paths.append(writer.write(profiler, 'GET /x'))
+
+    # Test that only the two latest profiles are kept
+    assert sorted(os.listdir(str(tmp_path / 'profiles'))) == \
+        [os.path.basename(path) for path in paths[1:]]
+    with open(paths[-1]) as f:
+        assert 'GET /x;_slow (test_profiling.py:' in f.read()
+
+
+def test_profile_writer_nothing_recorded(tmp_path):
+    """test3 (ProfileWriter.write()): unhappy path with a profiler that recorded nothing"""
+    writer = ProfileWriter(str(tmp_path / 'profiles'))
+    assert not writer.should_profile()
+    assert writer.write(StackProfiler(), 'GET /x') is None
+    assert not os.path.exists(str(tmp_path / 'profiles'))
@@ -0,0 +1,92 @@
+"""
+Test tune.py module
+"""
+import pytest
+
+import pandas as pd
+import numpy as np
+
+import src.tune
+from src.model import train_model, train_test_positions
+from src.tune import tune_model, get_candidates, train_model_args
+
+
+def test_tune_model(tmp_path):
+    """test1 (tune_model()): happy path halving the candidates and picking the best one"""
+    rng = np.random.RandomState(0)
+    n = 600
+    data = pd.DataFrame({'Age': rng.randint(20, 70, n).astype(float),
+                         'income_total': rng.randint(50000, 300000, n).astype(float),
+                         'gender_Male': rng.randint(0, 2, n)})
+    data['target'] = ((data['Age'] < 35) & (rng.rand(n) < 0.7)).astype(int)
+    leaderboard_path = str(tmp_path / 'tuning_leaderboard.csv')
+
+    best, leaderboard = tune_model(data, 'target', {'n_estimators': [5, 10],
+                                                  'max_depth': [1, 5]},
+                                 search='grid', n_iter=4, cv=3, factor=2, min_samples=150,
+                                 rand_state=0, n_jobs=2, leaderboard_path=leaderboard_path)
+
+    # Test that each round kept half the candidates on twice the rows
+    assert leaderboard.groupby('round')['candidate'].count().tolist() == [4, 2]
+    assert leaderboard.groupby('round')['n_rows'].first().tolist() == [150, 300]
+    # Test that the best candidate of the last round is returned and the leaderboard saved
+    assert best == {'n_estimators': leaderboard.iloc[0]['param_n_estimators'],
+                    'max_depth': leaderboard.iloc[0]['param_max_depth']}
+    assert len(pd.read_csv(leaderboard_path)) == 6
+
+    # Test that the best candidate is trained with the split and weighting of train_model
+    rf, X_test, _ = train_model(data, **train_model_args(
+        {'target_colname': 'target', 'sample_strat': 0.5, 'ts': 0.4, 'n_estimat': 1,
+         'max_dep': 1, 'rand_state': 0}, dict(best, min_samples_leaf=5)))
+    assert (rf.n_estimators, rf.max_depth) == (best['n_estimators'], best['max_depth'])
+    assert rf.min_samples_leaf == 5
+    assert len(X_test) == 240
+
+
+def test_tune_model_holdout(tmp_path, monkeypatch):
+    """test2 (tune_model()): happy path searching the weighted training rows of train_model"""
+    rng = np.random.RandomState(0)
+    n = 400
+    data = pd.DataFrame({'Age': rng.randint(20, 70, n).astype(float)})
+    data['target'] = ((data['Age'] < 35) & (rng.rand(n) < 0.7)).astype(int)
+    train_kwargs = {'target_colname': 'target', 'sample_strat': 0.5, 'ts': 0.4, 'n_estimat': 5,
+                    'max_dep': 3, 'rand_state': 0}
+    fits = []
+
+    def record_fit(params, X, y, train_idx, test_idx, rand_state, sample_strat, resample):
+        fits.append((set(train_idx) | set(test_idx), sample_strat, resample))
+        return 0.5
+
+    monkeypatch.setattr(src.tune, '_fit_and_score', record_fit)
+    tune_model(data, 'target', {'max_depth': [1, 5]}, search='grid', n_iter=2, cv=3,
+               factor=2, min_samples=100, rand_state=0, n_jobs=1,
+               leaderboard_path=str(tmp_path / 'tuning_leaderboard.csv'),
+               train_kwargs=train_kwargs)
+
+    # Test that no test row of train_model reaches a fold and that folds are weighted
+    _, test_idx = train_test_positions(data['target'].to_numpy(), 0.4, 0)
+    assert len(fits) == 6
+    assert all(rows.isdisjoint(test_idx) for rows, _, _ in fits)
+    assert {(sample_strat, resample) for _, sample_strat, resample in fits} == \
+        {(0.5, 'weight')}
+
+
+def test_tune_model_class_weight(tmp_path):
+    """test3 (tune_model()): unhappy path when class_weight would double the sample weights"""
+    data = pd.DataFrame({'Age': [20., 30., 40., 50.], 'target': [0, 1, 0, 1]})
+    train_kwargs = {'target_colname': 'target', 'sample_strat': 0.5, 'ts': 0.5, 'n_estimat': 5,
+                    'max_dep': 3, 'rand_state': 0}
+
+    with pytest.raises(ValueError):
+        tune_model(data, 'target', {'class_weight': [None, 'balanced']}, search='grid',
+                   n_iter=2, cv=2, factor=2, min_samples=4, rand_state=0, n_jobs=1,
+                   leaderboard_path=str(tmp_path / 'tuning_leaderboard.csv'),
+                   train_kwargs=train_kwargs)
+    with pytest.raises(ValueError):
+        train_model_args(train_kwargs, {'class_weight': 'balanced'})
+
+
+def test_get_candidates_unknown_search():
+    """test4 (get_candidates()): unhappy path when the search is not supported"""
+    with pytest.raises(ValueError):
+        get_candidates({'max_depth': [5, 10]}, 'bayesian', 10, 0)